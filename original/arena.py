@@ -0,0 +1,288 @@
+"""非同步競技場：玩家把當前隊伍存成防守快照，其他玩家按戰力匹配對手，用無界面戰鬥攻打快照。
+
+防守快照只保存戰鬥需要的數據：每名武將的 (名字, 兵種, Card.stats() 的 hp/atk/speed) 和隊伍總戰力，
+按定長記錄打包在一個 bytearray 裡（DEFENSE_RECORD，每份 50 位元組），武將名字放在共用的名字表裡。
+戰力索引是升序的 array("q")，每項是 戰力 << SLOT_BITS | 槽位，用 bisect 查找：匹配戰力區間內的對手
+是兩次 O(log n) 的二分，再從區間裡隨機取 k 個。一百萬份快照的記錄和索引約 58MB，加上玩家 id 的字典和列表，整個庫常駐約 200MB。
+單份快照的新增/更新是一次 insort（陣列內的 memmove），批量寫入（put_many）和載入時整體排序一次。
+
+攻打：防守方武將站在敵方城堡前不動（與關卡敵人相同），攻方開自動戰鬥進攻；
+在 ARENA_SECONDS 內消滅全部防守武將為勝，攻方全滅或超時為負。雙方都不帶好友助戰。
+"""
+import bisect
+import os
+import random
+import struct
+from array import array
+from collections import namedtuple
+
+from offline import SIM_DT
+from sanguo_prototype import BattleSimulation, Card, PlayerData, Unit
+
+ARENA_CHAPTER = 1  # 戰場使用第一章的配置（無地形、無 Boss）
+ARENA_SECONDS = 90
+PLAYER_BONUS = 1.05  # 與 BattleSimulation 給玩家武將的加成一致，防守方同樣享有
+SIEGE_RATIO = 0.7
+DEFENDER_Y = 160  # 防守方站位：敵方城堡前
+TEAM_SIZE = 3
+MATCH_BAND = 0.1  # 預設匹配戰力 ±10% 的對手
+
+SLOT_BITS = 24  # 最多 16M 份快照
+SLOT_MASK = (1 << SLOT_BITS) - 1
+UNIT_FORMAT = "HBIIf"  # 名字表下標, 兵種, hp, atk, speed
+UNIT_FIELDS = len(UNIT_FORMAT)
+DEFENSE_RECORD = struct.Struct("<IB" + UNIT_FORMAT * TEAM_SIZE)  # 戰力, 人數, 武將...
+FILE_HEADER = struct.Struct("<4sII")  # 魔數, 快照數, 名字表長度
+FILE_MAGIC = b"SGA1"
+
+DefenseUnit = namedtuple("DefenseUnit", "name unit_type hp atk speed")
+Defense = namedtuple("Defense", "owner power units")
+ArenaResult = namedtuple("ArenaResult", "outcome seconds survivors")
+
+
+def snapshot_units(team_cards):
+    """隊伍 -> [DefenseUnit]（最多 TEAM_SIZE 名）"""
+    out = []
+    for card in team_cards[:TEAM_SIZE]:
+        hp, atk, speed = card.stats()
+        out.append(DefenseUnit(card.name, card.unit_type, hp, atk, speed))
+    return out
+
+
+def team_power(team_cards):
+    return sum(card.power() for card in team_cards[:TEAM_SIZE])
+
+
+class DefenseStore:
+    """防守快照庫：玩家 id -> 定長記錄，外加按戰力排序的索引"""
+
+    def __init__(self):
+        self.records = bytearray()
+        self.owners = []  # 槽位 -> 玩家 id（空槽為 None）
+        self.slot_of = {}  # 玩家 id -> 槽位
+        self.free = []  # 移除後可複用的槽位
+        self.names = []
+        self._name_ids = {}
+        self.index = array("q")  # 升序的 戰力 << SLOT_BITS | 槽位
+        self.version = 0
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, owner):
+        return owner in self.slot_of
+
+    def _name_id(self, name):
+        i = self._name_ids.get(name)
+        if i is None:
+            i = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def _pack(self, power, units):
+        fields = [power, len(units)]
+        for u in units:
+            fields += (self._name_id(u.name), u.unit_type, u.hp, u.atk, u.speed)
+        fields += (0, 0, 0, 0, 0.0) * (TEAM_SIZE - len(units))
+        return DEFENSE_RECORD.pack(*fields)
+
+    def _power(self, slot):
+        return DEFENSE_RECORD.unpack_from(self.records, slot * DEFENSE_RECORD.size)[0]
+
+    def _unindex(self, slot):
+        key = self._power(slot) << SLOT_BITS | slot
+        i = bisect.bisect_left(self.index, key)
+        del self.index[i]
+
+    def _store(self, owner, power, units):
+        """給 owner 分配槽位並打包記錄（不寫入、不動索引），返回 (槽位, 是否已有快照, 記錄)"""
+        if not 0 < len(units) <= TEAM_SIZE:
+            raise ValueError(f"防守隊伍應有 1..{TEAM_SIZE} 名武將")
+        record = self._pack(power, units)
+        slot = self.slot_of.get(owner)
+        existed = slot is not None
+        if existed:
+            return slot, True, record
+        if self.free:
+            slot = self.free.pop()
+            self.owners[slot] = owner
+        else:
+            slot = len(self.owners)
+            if slot > SLOT_MASK:
+                raise OverflowError("防守快照數超過上限")
+            self.owners.append(owner)
+            self.records += bytes(DEFENSE_RECORD.size)
+        self.slot_of[owner] = slot
+        return slot, False, record
+
+    def put(self, owner, power, units):
+        """新增或替換 owner 的防守快照"""
+        slot, existed, record = self._store(owner, power, units)
+        if existed:
+            self._unindex(slot)
+        self.records[slot * DEFENSE_RECORD.size:(slot + 1) * DEFENSE_RECORD.size] = record
+        bisect.insort(self.index, power << SLOT_BITS | slot)
+        self.version += 1
+        return slot
+
+    def put_many(self, entries):
+        """批量 put：entries 為 (owner, 戰力, units)，寫完記錄後整體重建一次索引"""
+        for owner, power, units in entries:
+            slot, _, record = self._store(owner, power, units)
+            self.records[slot * DEFENSE_RECORD.size:(slot + 1) * DEFENSE_RECORD.size] = record
+        self._reindex()
+        self.version += 1
+
+    def _reindex(self):
+        keys = [self._power(slot) << SLOT_BITS | slot for slot in self.slot_of.values()]
+        keys.sort()
+        self.index = array("q", keys)
+
+    def remove(self, owner):
+        slot = self.slot_of.pop(owner)
+        self._unindex(slot)
+        self.owners[slot] = None
+        self.free.append(slot)
+        self.version += 1
+
+    def get(self, owner):
+        """owner 的 Defense，沒有快照時返回 None"""
+        slot = self.slot_of.get(owner)
+        return None if slot is None else self._decode(slot)
+
+    def _decode(self, slot):
+        fields = DEFENSE_RECORD.unpack_from(self.records, slot * DEFENSE_RECORD.size)
+        power, count = fields[0], fields[1]
+        units = []
+        for k in range(count):
+            name_id, unit_type, hp, atk, speed = fields[2 + k * UNIT_FIELDS:2 + (k + 1) * UNIT_FIELDS]
+            units.append(DefenseUnit(self.names[name_id], unit_type, hp, atk, round(speed, 4)))  # speed 存為 float32
+        return Defense(self.owners[slot], power, units)
+
+    def band(self, low, high):
+        """戰力在 [low, high] 內的快照在索引中的下標範圍 (i, j)"""
+        i = bisect.bisect_left(self.index, max(0, low) << SLOT_BITS)
+        j = bisect.bisect_left(self.index, (high + 1) << SLOT_BITS)
+        return i, j
+
+    def match(self, power, k=3, band=MATCH_BAND, exclude=None, rng=random):
+        """戰力 power ±band 內隨機取 k 份不同的快照（排除 exclude 玩家）；區間內不足 k 份時用戰力最接近的補足"""
+        skip = self.slot_of.get(exclude)
+        i, j = self.band(int(power * (1 - band)), int(power * (1 + band)))
+        picked = []
+        seen = set()
+        if j - i > 2 * k:
+            for _ in range(4 * k):
+                pos = rng.randrange(i, j)
+                slot = self.index[pos] & SLOT_MASK
+                if slot != skip and pos not in seen:
+                    seen.add(pos)
+                    picked.append(slot)
+                    if len(picked) >= k:
+                        break
+        else:
+            for pos in range(i, j):
+                slot = self.index[pos] & SLOT_MASK
+                if slot != skip:
+                    seen.add(pos)
+                    picked.append(slot)
+            rng.shuffle(picked)
+            del picked[k:]
+        # 從戰力最接近的位置向兩邊擴展
+        lo = hi = bisect.bisect_left(self.index, power << SLOT_BITS)
+        n = len(self.index)
+        while len(picked) < k and (lo > 0 or hi < n):
+            key = power << SLOT_BITS
+            if hi >= n or (lo > 0 and key - self.index[lo - 1] <= self.index[hi] - key):
+                lo -= 1
+                pos = lo
+            else:
+                pos = hi
+                hi += 1
+            slot = self.index[pos] & SLOT_MASK
+            if slot != skip and pos not in seen:
+                seen.add(pos)
+                picked.append(slot)
+        return [self._decode(slot) for slot in picked]
+
+    # --- 存檔 ---
+    def save(self, path):
+        """寫成二進位檔：檔頭、名字表、記錄、玩家 id（每行一個，空槽為空行）"""
+        names = "\n".join(self.names).encode("utf-8")
+        owners = "\n".join(o or "" for o in self.owners).encode("utf-8")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, len(self.owners), len(names)))
+            f.write(names)
+            f.write(self.records)
+            f.write(owners)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        with open(path, "rb") as f:
+            magic, slots, names_len = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != FILE_MAGIC:
+                raise ValueError(f"不是競技場快照檔: {path}")
+            names = f.read(names_len).decode("utf-8")
+            store.records = bytearray(f.read(slots * DEFENSE_RECORD.size))
+            owners = f.read().decode("utf-8").split("\n") if slots else []
+        store.names = names.split("\n") if names else []
+        store._name_ids = {name: i for i, name in enumerate(store.names)}
+        for slot, owner in enumerate(owners):
+            if owner:
+                store.owners.append(owner)
+                store.slot_of[owner] = slot
+            else:
+                store.owners.append(None)
+                store.free.append(slot)
+        store._reindex()
+        return store
+
+
+# --- 戰鬥 ---
+
+def defense_units(units, dx=0):
+    """防守快照 -> 敵方 Unit（站在敵方城堡前，屬性加成與玩家武將相同）"""
+    out = []
+    for i, u in enumerate(units):
+        atk = int(u.atk * PLAYER_BONUS)
+        out.append(Unit(u.name, 300 + 200 * i + dx, DEFENDER_Y, 1, u.unit_type, hp=int(u.hp * PLAYER_BONUS),
+                        atk=atk, speed=u.speed, siege_atk=int(atk * SIEGE_RATIO), hero=u.name))
+    return out
+
+
+class ArenaBattle(BattleSimulation):
+    """競技場戰鬥：敵方只有一波，就是防守快照的武將"""
+
+    def __init__(self, player, team_cards, defense, **kwargs):
+        self.defense = defense
+        super().__init__(player, team_cards, chapter=ARENA_CHAPTER, **kwargs)
+        self.max_waves = 1
+
+    def spawn_wave_enemies(self):
+        return defense_units(self.defense, self.formation_dx)
+
+
+def run_arena(cards, defense, seed, max_seconds=ARENA_SECONDS):
+    """進程池中執行：攻方卡牌數據對防守快照打一場，返回 ArenaResult
+
+    outcome："win"（防守方全滅）、"loss"（攻方全滅）、"timeout"（按負計）。
+    """
+    random.seed(seed)
+    player = PlayerData(os.devnull)
+    player.selected_friend = None
+    team = [Card.from_dict(d) for d in cards]
+    sim = ArenaBattle(player, team, defense, auto_battle=True, headless=True, auto_budget_us=None)
+    outcome = "timeout"
+    step = 0
+    for step in range(1, int(max_seconds / SIM_DT) + 1):
+        if not sim.step(SIM_DT):
+            outcome = "win"
+            break
+        if not any(u.hp > 0 for u in sim.player_units):
+            outcome = "loss"
+            break
+    survivors = tuple(u.hp > 0 for u in sim.player_units)
+    return ArenaResult(outcome, step * SIM_DT, survivors)
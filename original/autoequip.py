@@ -0,0 +1,213 @@
+"""一鍵配裝：把 equipment_inventory 分配給一組武將，使加權的 HP/ATK/速度總和最大。
+
+裝備屬性是平加到卡牌上的，各槽位互不影響，所以每個槽位是一個獨立的指派問題：
+卡牌 i 分到裝備 j 的價值 = 卡牌 i 對各屬性的權重 · 裝備 j 的屬性，求最大權匹配。
+卡牌權重考慮專精（如趙雲的攻擊加成讓 ATK 對他更值錢）。相同權重的卡牌、相同屬性的裝備可以互換，
+按類別壓縮後變成很小的運輸問題（見 transport），整個名冊配裝也能即時完成。
+
+每件庫存裝備只能屬於一名武將（equipped_to）；裝在範圍外武將身上的裝備不參與分配。
+apply_plan 一次性寫入所有變更並保存一次，保存失敗時回滾記憶體中的修改。
+"""
+import math
+from collections import namedtuple
+
+from sanguo_prototype import equipment_data
+from teambuilder import specialization_multipliers
+
+SLOTS = ("weapon", "horse", "book")
+DEFAULT_WEIGHTS = {"hp": 1.0, "atk": 5.0, "speed": 2.0}
+EPSILON = 1e-9  # 價值是浮點數：改進不超過 EPSILON 時不鬆弛，捨入誤差形成的「負環」不會進入前驅鏈
+
+EquipChange = namedtuple("EquipChange", "card slot old_id new_id inventory_index")
+
+
+def card_weights(card, weights):
+    hp_mult, atk_mult, speed_mult = specialization_multipliers(card.name)
+    return weights["hp"] * hp_mult, weights["atk"] * atk_mult, weights["speed"] * speed_mult
+
+
+def transport(supply, demand, value):
+    """最大權運輸問題：supply[i] 個第 i 類卡牌、demand[j] 件第 j 類裝備，每對的價值 value[i][j]
+
+    返回 flow[i][j]（第 i 類卡牌分到多少件第 j 類裝備）。逐次沿最長增益路徑（殘量圖上的
+    Bellman-Ford 最短路，費用取負）增廣，路徑增益不再超過 EPSILON 時停止；每次按路徑瓶頸整批推流。
+    """
+    n, m = len(supply), len(demand)
+    flow = [[0] * m for _ in range(n)]
+    supply = list(supply)
+    demand = list(demand)
+    inf = math.inf
+    while True:
+        # 節點 0..n-1 為卡牌類別，n..n+m-1 為裝備類別
+        dist = [0.0 if supply[i] > 0 else inf for i in range(n)] + [inf] * m
+        prev = [None] * (n + m)
+        for _ in range(n + m):
+            changed = False
+            for i in range(n):
+                di = dist[i]
+                if di < inf:
+                    for j in range(m):
+                        d = di - value[i][j]
+                        if d < dist[n + j] - EPSILON:
+                            dist[n + j] = d
+                            prev[n + j] = i
+                            changed = True
+            for j in range(m):
+                dj = dist[n + j]
+                if dj < inf:
+                    for i in range(n):
+                        # 反向邊：把已分配的流退回
+                        if flow[i][j] > 0 and dj + value[i][j] < dist[i] - EPSILON:
+                            dist[i] = dj + value[i][j]
+                            prev[i] = n + j
+                            changed = True
+            if not changed:
+                break
+        end = min((j for j in range(m) if demand[j] > 0), key=lambda j: dist[n + j], default=None)
+        if end is None or dist[n + end] >= -EPSILON:
+            return flow
+        # 回溯路徑並求瓶頸；前驅鏈成環說明數值已不可靠，停在當前（仍然可行的）流
+        path = []
+        node = n + end
+        while node is not None:
+            if node in path:
+                return flow
+            path.append(node)
+            node = prev[node]
+        path.reverse()  # 卡牌類別, 裝備類別, 卡牌類別, ...
+        amount = min(supply[path[0]], demand[end])
+        for a, b in zip(path[1::2], path[2::2]):
+            amount = min(amount, flow[b][a - n])
+        for k in range(0, len(path) - 1):
+            a, b = path[k], path[k + 1]
+            if a < n:
+                flow[a][b - n] += amount
+            else:
+                flow[b][a - n] -= amount
+        supply[path[0]] -= amount
+        demand[end] -= amount
+
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _classes(vectors):
+    """相同向量歸為一類：返回 (類別向量列表, 每類的成員下標列表)"""
+    index = {}
+    members = []
+    for k, vec in enumerate(vectors):
+        c = index.setdefault(vec, len(index))
+        if c == len(members):
+            members.append([])
+        members[c].append(k)
+    return list(index), members
+
+
+def _assign(card_w, item_vecs, owner_of=None):
+    """一個槽位的最優分配：返回 [(卡牌下標, 裝備下標)]
+
+    卡牌權重只由專精決定、裝備屬性只由目錄條目決定，兩邊都只有少數幾類，
+    所以按類別解運輸問題，再把每類的數量落實到具體卡牌和裝備上；
+    owner_of[裝備下標] = 卡牌下標 表示當前歸屬，同類之內優先保持不變。
+    """
+    if not card_w or not item_vecs:
+        return []
+    owner_of = owner_of or {}
+    card_keys, card_members = _classes(card_w)
+    item_keys, item_members = _classes(item_vecs)
+    value = [[_dot(w, v) for v in item_keys] for w in card_keys]
+    flow = transport([len(m) for m in card_members], [len(m) for m in item_members], value)
+    card_class = {i: c for c, members in enumerate(card_members) for i in members}
+    pairs = []
+    used_cards = set()
+    used_items = set()
+    # 先保留現有歸屬（在流量允許的範圍內），再把剩餘流量分給其他卡牌和裝備
+    for ii, items in enumerate(item_members):
+        for j in items:
+            i = owner_of.get(j)
+            if i is not None and i not in used_cards and flow[card_class[i]][ii] > 0:
+                flow[card_class[i]][ii] -= 1
+                pairs.append((i, j))
+                used_cards.add(i)
+                used_items.add(j)
+    for ci, cards in enumerate(card_members):
+        free_cards = [i for i in cards if i not in used_cards]
+        for ii, items in enumerate(item_members):
+            f = flow[ci][ii]
+            if f <= 0:
+                continue
+            free_items = [j for j in items if j not in used_items][:f]
+            for j in free_items:
+                i = free_cards.pop()
+                pairs.append((i, j))
+                used_cards.add(i)
+                used_items.add(j)
+    return pairs
+
+
+def plan_auto_equip(player, cards, weights=None):
+    """計算最優配裝，返回 [EquipChange]（只包含有變化的槽位），不修改任何數據"""
+    weights = weights or DEFAULT_WEIGHTS
+    by_id = equipment_data().by_id
+    card_ids = {c.id for c in cards}
+    card_w = [card_weights(c, weights) for c in cards]
+    inventory = player.equipment_inventory
+    changes = []
+    for slot in SLOTS:
+        catalog = by_id.get(slot, {})
+        # 可分配：空閒的，或者裝在本次範圍內武將身上的
+        items = [j for j, e in enumerate(inventory)
+                 if e["slot"] == slot and e["id"] in catalog
+                 and (e.get("equipped_to") is None or e.get("equipped_to") in card_ids)]
+        # 速度在 Card.stats() 中按 0.1 折算
+        item_vecs = [(catalog[inventory[j]["id"]].get("hp", 0), catalog[inventory[j]["id"]].get("atk", 0),
+                      catalog[inventory[j]["id"]].get("speed", 0) * 0.1) for j in items]
+        owned = {inventory[j]["equipped_to"]: j for j in items if inventory[j].get("equipped_to") is not None}
+        position = {c.id: i for i, c in enumerate(cards)}
+        owner_of = {k: position[inventory[j]["equipped_to"]] for k, j in enumerate(items)
+                    if inventory[j].get("equipped_to") is not None}
+        assigned = {i: items[k] for i, k in _assign(card_w, item_vecs, owner_of)}
+        for i, card in enumerate(cards):
+            j = assigned.get(i)
+            if j != owned.get(card.id):
+                changes.append(EquipChange(card, slot, card.equipment.get(slot),
+                                           inventory[j]["id"] if j is not None else None, j))
+    return changes
+
+
+def apply_plan(player, cards, changes):
+    """把計劃寫入卡牌和庫存並保存一次；保存失敗時恢復原狀後重新拋出異常"""
+    if not changes:
+        return
+    inventory = player.equipment_inventory
+    card_ids = {c.id for c in cards}
+    saved_inventory = [(e, e.get("equipped_to")) for e in inventory]
+    saved_equipment = [(c, dict(c.equipment)) for c in cards]
+    try:
+        touched = {(ch.card.id, ch.slot) for ch in changes}
+        # 先釋放變化槽位上的舊裝備，再裝上新的
+        for e in inventory:
+            if e.get("equipped_to") in card_ids and (e["equipped_to"], e["slot"]) in touched:
+                e["equipped_to"] = None
+        for ch in changes:
+            ch.card.equipment[ch.slot] = ch.new_id
+            if ch.inventory_index is not None:
+                inventory[ch.inventory_index]["equipped_to"] = ch.card.id
+        player.save()
+    except BaseException:
+        for e, owner in saved_inventory:
+            e["equipped_to"] = owner
+        for c, equipment in saved_equipment:
+            c.equipment.clear()
+            c.equipment.update(equipment)
+        raise
+    for c in {ch.card.id: ch.card for ch in changes}.values():
+        player.roster.update(c)
+
+
+def auto_equip(player, cards, weights=None):
+    """計劃並應用；返回變更列表"""
+    changes = plan_auto_equip(player, cards, weights)
+    apply_plan(player, cards, changes)
+    return changes
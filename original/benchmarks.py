@@ -0,0 +1,431 @@
+"""無界面性能基準：戰鬥模擬、養成和存檔的熱點路徑。
+
+    python benchmarks.py                 # 運行並與基準比較，退步超過閾值時退出碼為 1
+    python benchmarks.py --save          # 運行並把結果保存為新基準
+    python benchmarks.py -k save --quick # 只跑名稱含 "save" 的項目，規模縮小為 1/10
+
+基準保存在 .benchmarks/baseline.json（與機器相關，不納入版本控制）。
+本腳本只用標準庫，直接運行；單元測試（test_*.py）另用 pytest 運行，兩者互不依賴。
+比較使用各項目多次取樣中的最小值（與 timeit 相同，受系統抖動影響最小）；單次很快的項目會自動重複多次，每次取樣至少 MIN_SAMPLE_SECONDS。
+"""
+import argparse
+import functools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from arena import DefenseStore, run_arena, snapshot_units
+from camera import CULL_MARGIN, Camera, Minimap
+from formation import separate
+from pathing import FlowFieldCache, NavGrid
+from spatial import SpatialHash
+from verify import parse_claim, plausibility, record_claim, replay_claim
+from sanguo_prototype import (BATTLE_MAPS, BattleSimulation, Card, PlayerData, Unit, ARENa_MAX_X, ARENa_MAX_Y,
+                              ARENa_MIN_X, ARENa_MIN_Y, HERO_POOL, RARITY_WEIGHTS, card_stats_batch, choose_weighted,
+                              summon_pulls)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, ".benchmarks", "baseline.json")
+DEFAULT_THRESHOLD = 0.25  # 比基準慢 25% 以上視為退步
+MIN_SAMPLE_SECONDS = 0.05
+
+BENCHMARKS = []
+
+
+def benchmark(name, repeat=7):
+    """註冊基準項目：被裝飾的函數接收規模係數 scale，返回要計時的無參函數"""
+    def register(setup):
+        BENCHMARKS.append((name, setup, repeat))
+        return setup
+    return register
+
+
+def _player(n_cards, path):
+    player = PlayerData(path)
+    rng = random.Random(n_cards)
+    for i in range(n_cards):
+        meta = HERO_POOL[i % len(HERO_POOL)]
+        player.roster.append(Card(meta["name"], meta["type"], rng.choice(["C", "R", "SR", "SSR"]),
+                                  level=rng.randint(1, 50), base_hp=meta["base_hp"], base_atk=meta["base_atk"],
+                                  base_speed=meta["base_speed"], stars=rng.randint(1, 5)))
+    player.team = [c.id for c in player.roster[:3]]
+    return player
+
+
+def _battle(n_units):
+    """兩隊各 n_units/2 個單位在場地上鋪開；HP 足夠大，重複更新不會死亡"""
+    player = _player(3, os.path.join(tempfile.gettempdir(), "sanguo_bench_battle.json"))
+    sim = BattleSimulation(player, player.roster[:3], chapter=1, headless=True)
+    rng = random.Random(n_units)
+    units = []
+    for i in range(n_units):
+        team = i % 2
+        y = rng.uniform(320, 530) if team == 0 else rng.uniform(70, 280)
+        units.append(Unit(f"u{i}", rng.uniform(40, 960), y, team, i % 3, hp=10 ** 9, atk=30, speed=3))
+    sim.player_units = [u for u in units if u.team == 0]
+    sim.all_enemies = [u for u in units if u.team == 1]
+    sim.player_castle.hp = sim.player_castle.max_hp = 10 ** 9
+    for castle in sim.enemy_castles:
+        castle.hp = castle.max_hp = 10 ** 9
+    return sim, units
+
+
+def _unit_update(n):
+    def setup(scale):
+        sim, units = _battle(n)
+        castles = [sim.player_castle] + sim.enemy_castles
+
+        def run():
+            # 每帧清空目标，计入最近敌人扫描（击杀后重新索敌的最坏情况）
+            for u in units:
+                u.target_enemy = None
+            for u in units:
+                u.update(units, castles, sim)
+            sim.combat.resolve(heal_castle=sim.player_castle)
+            sim.projectiles.clear()  # 弓兵射出的箭不在此项计时内飞行
+        return run
+    return setup
+
+
+for _n in (6, 60, 600):
+    benchmark(f"unit_update_{_n}")(_unit_update(_n))
+
+
+@benchmark("volley_dense_crowd")
+def _volley(scale):
+    sim, units = _battle(2)
+    archer = next(u for u in units if u.team == 0)
+    archer.type = 2
+    archer.skill["effect"] = "volley"
+    archer.skill["arrow_count"] = 8
+    crowd = [Unit(f"e{i}", 500 + (i % 20), 200 + (i // 20), 1, i % 3, hp=10 ** 9) for i in range(400)]
+    everyone = [archer] + crowd
+    target = crowd[0]
+    sim.unit_grid.rebuild(everyone)
+
+    def run():
+        for _ in range(50):
+            archer.activate_skill(target, everyone, sim)
+        while sim.projectiles:
+            sim.projectiles.update(0.016, sim.unit_grid, sim.combat)
+        sim.combat.resolve()
+    return run
+
+
+@benchmark("projectiles_5k")
+def _projectiles(scale):
+    sim, units = _battle(2)
+    archers = [Unit(f"a{i}", 100 + (i % 50) * 16, 500, 0, 2) for i in range(100)]
+    targets = [Unit(f"e{i}", 100 + (i % 50) * 16, 380 + (i // 50) * 20, 1, i % 3, hp=10 ** 9) for i in range(100)]
+    sim.unit_grid.rebuild(archers + targets)
+    n = int(5_000 * scale)
+
+    def run():
+        for i in range(n):
+            sim.projectiles.fire(archers[i % 100], targets[i * 7 % 100], 10, 1.0, False, "attack")
+        while sim.projectiles:
+            sim.projectiles.update(0.016, sim.unit_grid, sim.combat)
+        sim.combat.resolve()
+    return run
+
+
+@benchmark("separation_1000")
+def _separation(scale):
+    sim, units = _battle(int(1000 * scale))
+    bounds = (ARENa_MIN_X, ARENa_MAX_X, ARENa_MIN_Y, ARENa_MAX_Y)
+
+    def run():
+        sim.unit_grid.rebuild(units)
+        separate(units, sim.unit_grid, bounds)
+    return run
+
+
+@benchmark("viewport_cull_10k")
+def _viewport_cull(scale):
+    """4000x2400 的戰場上鋪開 1 萬個單位：重建索引、取視口內單位、重算小地圖"""
+    rng = random.Random(7)
+    units = [Unit(f"u{i}", rng.uniform(30, 3970), rng.uniform(65, 2340), i % 2, i % 3)
+             for i in range(int(10_000 * scale))]
+    grid = SpatialHash(cell_size=100)
+    camera = Camera(4000, 2400)
+    camera.center_on(2000, 1200)
+    minimap = Minimap(4000, 2400, refresh=1)
+
+    def run():
+        grid.rebuild(units)
+        visible = sorted(grid.query_rect(*camera.rect(CULL_MARGIN)), key=lambda u: u.pos[1])
+        minimap.update(units)
+        minimap.occupied()
+        return visible
+    return run
+
+
+@benchmark("flow_field_waypoints_1000")
+def _flow_field(scale):
+    """fortress_gate 地圖上 1000 個單位各查一次繞牆的路點；每輪清空快取，包含一次流場計算"""
+    nav = NavGrid("bench", BATTLE_MAPS["fortress_gate"], cache=FlowFieldCache())
+    rng = random.Random(1)
+    starts = [(rng.uniform(ARENa_MIN_X, ARENa_MAX_X), rng.uniform(ARENa_MIN_Y, 200)) for _ in range(int(1000 * scale))]
+    target = [500, 520]
+
+    def run():
+        nav.cache.clear()
+        for pos in starts:
+            nav.waypoint(pos, target)
+    return run
+
+
+@benchmark("card_stats_10k")
+def _card_stats(scale):
+    roster = _player(int(10_000 * scale), os.devnull).roster
+
+    def run():
+        for c in roster:
+            c.stats()
+    return run
+
+
+@benchmark("card_stats_batch_10k")
+def _card_stats_batch(scale):
+    roster = _player(int(10_000 * scale), os.devnull).roster
+
+    def run():
+        card_stats_batch(roster)
+    return run
+
+
+@benchmark("roster_queries_100k")
+def _roster(scale):
+    roster = _player(int(100_000 * scale), os.devnull).roster
+    roster.top(1)  # 戰力索引只建一次
+    names = [meta["name"] for meta in HERO_POOL]
+    card = roster[len(roster) // 2]
+
+    def run():
+        for name in names:
+            roster.named(name)
+        roster.get(card.id)
+        card.level = 51 - card.level
+        roster.update(card)
+        roster.top(10, rarity="SSR")
+    return run
+
+
+@benchmark("choose_weighted_1m", repeat=3)
+def _choose_weighted(scale):
+    n = int(1_000_000 * scale)
+
+    def run():
+        for _ in range(n):
+            choose_weighted(RARITY_WEIGHTS)
+    return run
+
+
+@benchmark("summon_1m", repeat=3)
+def _summon(scale):
+    n = int(1_000_000 * scale)
+    player = _player(len(HERO_POOL), os.devnull)
+
+    def run():
+        summon_pulls(player, n)
+    return run
+
+
+def _save_load(n, op):
+    def setup(scale):
+        path = os.path.join(tempfile.gettempdir(), f"sanguo_bench_save_{n}.json")
+        player = _player(int(n * scale), path)
+        player.save()
+        if op == "save":
+            return player.save
+
+        def run():
+            PlayerData(path).load()
+        return run
+    return setup
+
+
+for _n in (1_000, 10_000, 100_000):
+    benchmark(f"save_{_n}", repeat=3)(_save_load(_n, "save"))
+    benchmark(f"load_{_n}", repeat=3)(_save_load(_n, "load"))
+
+
+@benchmark("update_quest_progress_100k")
+def _quests(scale):
+    player = PlayerData(os.devnull)
+    quest_ids = [("daily", q["id"]) for q in player.daily_quests] + [("weekly", q["id"]) for q in player.weekly_quests]
+    calls = [quest_ids[i % len(quest_ids)] for i in range(int(100_000 * scale))]
+
+    def run():
+        player.quest_completed.clear()
+        for q in player.daily_quests + player.weekly_quests:
+            q["progress"] = 0
+        for quest_type, quest_id in calls:
+            player.update_quest_progress(quest_type, quest_id)
+    return run
+
+
+def _claim():
+    player = _player(3, os.devnull)
+    team = player.roster[:3]
+    return player, team, record_claim(player, team, 1, seed=1)
+
+
+@benchmark("claim_prefilter_10k")
+def _claim_prefilter(scale):
+    """10k 份客戶端戰鬥結果的格式檢查和傷害界預篩（服務端事件循環內的開銷）"""
+    player, team, claim = _claim()
+    claims = [claim] * int(10_000 * scale)
+
+    def run():
+        for data in claims:
+            plausibility(team, player.selected_friend, parse_claim(data))
+    return run
+
+
+@benchmark("claim_replay", repeat=3)
+def _claim_replay(scale):
+    """完整重放一場自動戰鬥（進程池中每份抽中的聲明的開銷）"""
+    player, team, claim = _claim()
+    cards = [c.to_dict() for c in team]
+    parsed = parse_claim(claim)
+
+    def run():
+        replay_claim(cards, player.selected_friend, player.gold, parsed)
+    return run
+
+
+@functools.lru_cache(maxsize=1)
+def _arena_store(n):
+    """n 份防守快照（三名武將，戰力 100..100k 均勻分佈），用 put_many 整體建索引"""
+    rng = random.Random(n)
+    roster = _player(24, os.devnull).roster
+    teams = [snapshot_units(roster[i:i + 3]) for i in range(0, len(roster), 3)]
+    store = DefenseStore()
+    store.put_many((f"p{i}", rng.randint(100, 100_000), teams[i % len(teams)]) for i in range(n))
+    return store
+
+
+@benchmark("arena_match_1m", repeat=3)
+def _arena_match(scale):
+    """一百萬份快照裡按戰力區間匹配 10k 次（每次取 3 名對手並解碼）"""
+    store = _arena_store(int(1_000_000 * scale))
+    rng = random.Random(1)
+    powers = [rng.randint(100, 100_000) for _ in range(10_000)]
+
+    def run():
+        for power in powers:
+            store.match(power, 3, rng=rng)
+    return run
+
+
+@benchmark("arena_defend_1m", repeat=3)
+def _arena_defend(scale):
+    """一百萬份快照裡替換 1k 份防守隊伍（索引刪除 + insort）"""
+    store = _arena_store(int(1_000_000 * scale))
+    rng = random.Random(2)
+    units = store.get("p0").units
+    updates = [(f"p{rng.randrange(len(store))}", rng.randint(100, 100_000)) for _ in range(1_000)]
+
+    def run():
+        for owner, power in updates:
+            store.put(owner, power, units)
+    return run
+
+
+@benchmark("arena_battle", repeat=3)
+def _arena_battle(scale):
+    """一場競技場自動戰鬥（進程池中每次攻打的開銷）"""
+    player = _player(6, os.devnull)
+    attack, defense = player.roster[:3], player.roster[3:]
+    cards = [c.to_dict() for c in attack]
+    units = snapshot_units(defense)
+
+    def run():
+        run_arena(cards, units, seed=1)
+    return run
+
+
+def run_benchmarks(pattern=None, scale=1.0):
+    """返回 {名稱: {median_s, min_s, runs, number}}，時間為單次調用的秒數"""
+    results = {}
+    for name, setup, repeat in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        fn = setup(scale)
+        # 預熱並確定每次取樣的調用次數
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        number = max(1, int(MIN_SAMPLE_SECONDS / elapsed)) if elapsed > 0 else 1
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                fn()
+            times.append((time.perf_counter() - started) / number)
+        results[name] = {"median_s": statistics.median(times), "min_s": min(times), "runs": repeat, "number": number}
+        print(f"{name:<28}{min(times) * 1000:>10.3f} ms (中位數 {results[name]['median_s'] * 1000:.3f})", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """返回退步項目 [(名稱, 基準秒數, 當前秒數, 比例)]"""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = r["min_s"] / base["min_s"]
+        if ratio > 1 + threshold:
+            regressions.append((name, base["min_s"], r["min_s"], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="三國戰爭性能基準")
+    parser.add_argument("-k", dest="pattern", help="只運行名稱包含該字串的項目")
+    parser.add_argument("--save", action="store_true", help="把本次結果保存為基準")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準檔案路徑")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="允許的變慢比例")
+    parser.add_argument("--quick", action="store_true", help="規模縮小為 1/10")
+    args = parser.parse_args(argv)
+
+    scale = 0.1 if args.quick else 1.0
+    results = run_benchmarks(args.pattern, scale)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        # 不同規模的結果不可比
+        if saved.get("scale") == scale:
+            baseline = saved.get("results", {})
+
+    if args.save:
+        merged = dict(baseline)
+        merged.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"scale": scale, "python": sys.version.split()[0], "results": merged}, f, indent=2)
+        print(f"基準已保存: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("沒有可比較的基準（先運行 --save）")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for name, base, now, ratio in regressions:
+        print(f"退步: {name} {base * 1000:.2f} ms -> {now * 1000:.2f} ms (x{ratio:.2f})")
+    if regressions:
+        return 1
+    print(f"未發現超過 {args.threshold:.0%} 的退步")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""戰場攝影機、視口裁剪和小地圖。
+
+模擬全部在世界座標中進行，世界可以大於 1000x600 的畫布。GameWindow 每幀仍按世界座標建立繪製項目，
+但只建立視口（外擴 margin）內的：單位經 SpatialHash.query_rect 取出，箭矢、粒子和傷害數字按座標過濾；
+世界項目畫完後整體平移 (-camera.x, -camera.y)，HUD 在平移之後按畫布座標繪製。
+世界不大於視口時攝影機固定在原點，畫面與沒有攝影機時相同。
+
+Minimap 把存活單位按隊伍降採樣到粗格子裡計數（每 refresh 幀重算一次），繪製時只畫有單位的格子，
+開銷取決於格子數而不是軍隊規模。
+"""
+import math
+
+VIEW_WIDTH = 1000
+VIEW_HEIGHT = 600
+PAN_STEP = 60  # 方向鍵每次平移的像素
+CULL_MARGIN = 60  # 視口外擴：單位圖片、名字和仇恨線不會在邊緣突然消失
+
+
+class Camera:
+    def __init__(self, world_width, world_height, view_width=VIEW_WIDTH, view_height=VIEW_HEIGHT):
+        self.world_width = world_width
+        self.world_height = world_height
+        self.view_width = view_width
+        self.view_height = view_height
+        self.x = 0  # 視口左上角的世界座標（整數，圖片按像素對齊）
+        self.y = 0
+
+    @property
+    def scrollable(self):
+        return self.world_width > self.view_width or self.world_height > self.view_height
+
+    def move_to(self, x, y):
+        """把視口左上角移到 (x, y)，限制在世界範圍內"""
+        self.x = int(max(0, min(self.world_width - self.view_width, x)))
+        self.y = int(max(0, min(self.world_height - self.view_height, y)))
+
+    def pan(self, dx, dy):
+        self.move_to(self.x + dx, self.y + dy)
+
+    def center_on(self, x, y):
+        self.move_to(x - self.view_width / 2, y - self.view_height / 2)
+
+    def to_world(self, sx, sy):
+        """畫布座標 -> 世界座標"""
+        return sx + self.x, sy + self.y
+
+    def rect(self, margin=0):
+        """視口在世界中的矩形 (x0, y0, x1, y1)"""
+        return (self.x - margin, self.y - margin,
+                self.x + self.view_width + margin, self.y + self.view_height + margin)
+
+    def contains(self, x, y, margin=0):
+        return (self.x - margin <= x <= self.x + self.view_width + margin
+                and self.y - margin <= y <= self.y + self.view_height + margin)
+
+
+class Minimap:
+    """降採樣的單位分佈圖：每格記錄兩隊各自的單位數"""
+
+    def __init__(self, world_width, world_height, width=150, cell=50, refresh=10):
+        self.world_width = world_width
+        self.world_height = world_height
+        self.cell = cell
+        self.cols = math.ceil(world_width / cell)
+        self.rows = math.ceil(world_height / cell)
+        self.scale = width / world_width  # 世界像素 -> 小地圖像素
+        self.width = width
+        self.height = int(world_height * self.scale)
+        self.refresh = refresh
+        self.counts = (bytearray(self.cols * self.rows), bytearray(self.cols * self.rows))
+        self._frame = 0
+
+    def update(self, units, force=False):
+        """每 refresh 幀按存活單位重算一次格子計數（計數上限 255）"""
+        self._frame += 1
+        if not force and (self._frame - 1) % self.refresh:
+            return
+        for grid in self.counts:
+            grid[:] = bytes(len(grid))
+        cell, cols, rows = self.cell, self.cols, self.rows
+        for u in units:
+            if u.hp <= 0:
+                continue
+            col = min(cols - 1, max(0, int(u.pos[0] // cell)))
+            row = min(rows - 1, max(0, int(u.pos[1] // cell)))
+            grid = self.counts[1 if u.team else 0]
+            i = row * cols + col
+            if grid[i] < 255:
+                grid[i] += 1
+
+    def occupied(self):
+        """[(列, 行, 友軍數, 敵軍數)]：有單位的格子"""
+        allies, enemies = self.counts
+        cols = self.cols
+        return [(i % cols, i // cols, allies[i], enemies[i])
+                for i in range(len(allies)) if allies[i] or enemies[i]]
+
+    def contains(self, origin, sx, sy):
+        ox, oy = origin
+        return ox <= sx <= ox + self.width and oy <= sy <= oy + self.height
+
+    def to_world(self, origin, sx, sy):
+        """小地圖上的畫布座標 -> 世界座標"""
+        return (sx - origin[0]) / self.scale, (sy - origin[1]) / self.scale
+
+    def draw(self, canvas, origin, camera, castles=(), colors=("#3498DB", "#E74C3C", "#F1C40F")):
+        """在畫布座標 origin 處畫小地圖：有單位的格子、城堡和當前視口框
+
+        colors 為 (友軍, 敵軍, 雙方混戰) 的格子顏色。
+        """
+        ox, oy = origin
+        k = self.scale
+        canvas.create_rectangle(ox, oy, ox + self.width, oy + self.height, fill="#000000", outline="#888888")
+        size = self.cell * k
+        for col, row, allies, enemies in self.occupied():
+            color = colors[2] if allies and enemies else colors[0] if allies else colors[1]
+            x, y = ox + col * size, oy + row * size
+            canvas.create_rectangle(x, y, x + size, y + size, fill=color, outline="")
+        for castle in castles:
+            if castle.hp > 0:
+                x, y = ox + castle.pos[0] * k, oy + castle.pos[1] * k
+                canvas.create_rectangle(x - 3, y - 3, x + 3, y + 3, fill="#FFFFFF",
+                                        outline=colors[0] if castle.team == 0 else colors[1])
+        x0, y0, x1, y1 = camera.rect()
+        canvas.create_rectangle(ox + x0 * k, oy + y0 * k, ox + x1 * k, oy + y1 * k, outline="#FFFFFF")
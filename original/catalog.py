@@ -0,0 +1,280 @@
+"""關卡/Boss/事件/商店數據目錄：從 gamedata/*.json 載入、校驗並編譯成只讀索引。
+
+編譯結果以 marshal 快取在 gamedata/.cache/ 下，快取鍵為所有數據檔案內容的雜湊，
+數據未變時啟動直接讀取快取，跳過 JSON 解析和校驗。
+"""
+import hashlib
+import json
+import marshal
+import os
+from types import MappingProxyType
+
+from pathing import OBSTACLE_KINDS
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gamedata")
+CACHE_DIRNAME = ".cache"
+DATA_FILES = ("chapters.json", "bosses.json", "events.json", "shop.json")
+
+# 編譯格式版本：修改 _compile 的輸出結構時遞增，使舊快取失效
+CATALOG_VERSION = 5
+
+NUMBER = (int, float)
+
+# 戰場世界尺寸的下限（即畫布大小）；更大的戰場由攝影機平移顯示
+MIN_WORLD_WIDTH = 1000
+MIN_WORLD_HEIGHT = 600
+
+# 欄位 -> 類型；optional 中為 (類型, 預設值)
+SCHEMAS = {
+    "chapter": {
+        "required": {"chapter": int, "name": str, "waves": int, "base_hp": NUMBER, "base_atk": NUMBER,
+                     "level": int, "has_boss": bool, "formation": str},
+        "optional": {"boss": (str, None), "extra_bosses": (list, None),
+                     "hp_per_wave": (NUMBER, 20), "atk_per_wave": (NUMBER, 3),
+                     "event_weights": (dict, None), "map": (str, None),
+                     "width": (int, MIN_WORLD_WIDTH), "height": (int, MIN_WORLD_HEIGHT)},
+    },
+    "obstacle": {
+        "required": {"kind": str, "x0": NUMBER, "y0": NUMBER, "x1": NUMBER, "y1": NUMBER},
+        "optional": {},
+    },
+    "boss_spawn": {
+        "required": {"id": str, "x": NUMBER, "y": NUMBER},
+        "optional": {},
+    },
+    "formation_slot": {
+        "required": {"name": str, "type": int, "x": NUMBER, "y": NUMBER, "hp_mult": NUMBER, "atk_mult": NUMBER},
+        "optional": {},
+    },
+    "boss": {
+        "required": {"id": str, "name": str, "hp": NUMBER, "phase_hp": list, "base_atk": NUMBER, "abilities": list},
+        "optional": {},
+    },
+    "ability": {
+        "required": {"phase": int, "name": str, "damage": NUMBER, "cooldown": NUMBER, "effect": str},
+        "optional": {"range": (NUMBER, None), "threshold": (NUMBER, None)},
+    },
+    "event": {
+        "required": {"name": str, "desc": str, "effect": str, "type": str, "color": str},
+        "optional": {"cost": (int, None), "weight": (NUMBER, 1.0)},
+    },
+    "shop_item": {
+        "required": {"name": str, "desc": str, "cost": int, "effect": str, "value": NUMBER, "icon": str},
+        "optional": {"duration": (NUMBER, None)},
+    },
+}
+
+
+class CatalogError(ValueError):
+    """數據檔案不符合 schema"""
+
+
+def _check_type(value, expected):
+    # bool 是 int 的子類，數值欄位不接受 true/false
+    if isinstance(value, bool) and expected is not bool:
+        return False
+    return isinstance(value, expected)
+
+
+def _validate(record, kind, where):
+    """按 schema 校驗一條記錄，返回補齊預設值後的新 dict"""
+    if not isinstance(record, dict):
+        raise CatalogError(f"{where}: 應為物件，實際為 {type(record).__name__}")
+    schema = SCHEMAS[kind]
+    out = {}
+    for key, expected in schema["required"].items():
+        if key not in record:
+            raise CatalogError(f"{where}: 缺少欄位 '{key}'")
+        if not _check_type(record[key], expected):
+            raise CatalogError(f"{where}: 欄位 '{key}' 類型錯誤 ({record[key]!r})")
+        out[key] = record[key]
+    for key, (expected, default) in schema["optional"].items():
+        value = record.get(key, default)
+        if value is not None and not _check_type(value, expected):
+            raise CatalogError(f"{where}: 欄位 '{key}' 類型錯誤 ({value!r})")
+        if value is not None:
+            out[key] = value
+    unknown = set(record) - set(schema["required"]) - set(schema["optional"])
+    if unknown:
+        raise CatalogError(f"{where}: 未知欄位 {sorted(unknown)}")
+    return out
+
+
+def _compile(raw):
+    """校驗原始 JSON 並編譯成帶索引的結構（只含 marshal 可序列化的類型）"""
+    chapters_raw = raw["chapters.json"]
+    formations = {}
+    for fname, slots in chapters_raw.get("formations", {}).items():
+        if not isinstance(slots, list) or not slots:
+            raise CatalogError(f"formations.{fname}: 至少需要一個單位")
+        formations[fname] = [_validate(s, "formation_slot", f"formations.{fname}[{i}]") for i, s in enumerate(slots)]
+
+    maps = {}
+    for mname, obstacles in chapters_raw.get("maps", {}).items():
+        if not isinstance(obstacles, list):
+            raise CatalogError(f"maps.{mname}: 應為障礙列表")
+        maps[mname] = [_validate(o, "obstacle", f"maps.{mname}[{i}]") for i, o in enumerate(obstacles)]
+        for i, o in enumerate(maps[mname]):
+            if o["kind"] not in OBSTACLE_KINDS:
+                raise CatalogError(f"maps.{mname}[{i}]: 未知的障礙類型 '{o['kind']}'")
+            if not (o["x0"] < o["x1"] and o["y0"] < o["y1"]):
+                raise CatalogError(f"maps.{mname}[{i}]: 需要 x0 < x1 且 y0 < y1")
+
+    bosses = {}
+    for i, b in enumerate(raw["bosses.json"].get("bosses", [])):
+        boss = _validate(b, "boss", f"bosses[{i}]")
+        boss["abilities"] = [_validate(a, "ability", f"bosses[{i}].abilities[{j}]")
+                             for j, a in enumerate(boss["abilities"])]
+        phase_hp = boss["phase_hp"]
+        if not phase_hp or not all(_check_type(v, NUMBER) and v > 0 for v in phase_hp):
+            raise CatalogError(f"bosses[{i}]: phase_hp 必須是正數列表")
+        if sum(phase_hp) != boss["hp"]:
+            raise CatalogError(f"bosses[{i}]: phase_hp 總和 ({sum(phase_hp)}) 與 hp ({boss['hp']}) 不一致")
+        for j, a in enumerate(boss["abilities"]):
+            if not 1 <= a["phase"] <= len(phase_hp):
+                raise CatalogError(f"bosses[{i}].abilities[{j}]: 階段 {a['phase']} 超出範圍")
+        if boss["id"] in bosses:
+            raise CatalogError(f"bosses[{i}]: 重複的 id '{boss['id']}'")
+        bosses[boss["id"]] = boss
+
+    chapters = []
+    for i, c in enumerate(chapters_raw.get("chapters", [])):
+        chapter = _validate(c, "chapter", f"chapters[{i}]")
+        if chapter["formation"] not in formations:
+            raise CatalogError(f"chapters[{i}]: 未定義的陣型 '{chapter['formation']}'")
+        if chapter["width"] < MIN_WORLD_WIDTH or chapter["height"] < MIN_WORLD_HEIGHT:
+            raise CatalogError(f"chapters[{i}]: 戰場尺寸不能小於 {MIN_WORLD_WIDTH}x{MIN_WORLD_HEIGHT}")
+        if "map" in chapter:
+            if chapter["map"] not in maps:
+                raise CatalogError(f"chapters[{i}]: 未定義的地圖 '{chapter['map']}'")
+            for j, o in enumerate(maps[chapter["map"]]):
+                if o["x1"] > chapter["width"] or o["y1"] > chapter["height"]:
+                    raise CatalogError(f"chapters[{i}]: 地圖 '{chapter['map']}' 的障礙 {j} 超出戰場範圍")
+        if chapter["has_boss"] and chapter.get("boss") not in bosses:
+            raise CatalogError(f"chapters[{i}]: Boss 關卡需要有效的 'boss' id")
+        if "extra_bosses" in chapter:
+            chapter["extra_bosses"] = [_validate(b, "boss_spawn", f"chapters[{i}].extra_bosses[{j}]")
+                                       for j, b in enumerate(chapter["extra_bosses"])]
+            for j, b in enumerate(chapter["extra_bosses"]):
+                if b["id"] not in bosses:
+                    raise CatalogError(f"chapters[{i}].extra_bosses[{j}]: 未定義的 Boss '{b['id']}'")
+        chapters.append(chapter)
+    if not chapters:
+        raise CatalogError("chapters: 至少需要一個章節")
+    chapters.sort(key=lambda c: c["chapter"])
+    chapter_index = {}
+    for pos, c in enumerate(chapters):
+        if c["chapter"] in chapter_index:
+            raise CatalogError(f"chapters: 重複的章節編號 {c['chapter']}")
+        chapter_index[c["chapter"]] = pos
+
+    events_raw = raw["events.json"]
+    events = {}
+    effects = set()
+    for group in ("wave_events", "buffs", "curses", "trades"):
+        events[group] = [_validate(e, "event", f"{group}[{i}]") for i, e in enumerate(events_raw.get(group, []))]
+        for i, e in enumerate(events[group]):
+            if e["weight"] <= 0:
+                raise CatalogError(f"{group}[{i}]: weight 必須為正數")
+            effects.add(e["effect"])
+    for i, c in enumerate(chapters):
+        for effect, weight in c.get("event_weights", {}).items():
+            if effect not in effects:
+                raise CatalogError(f"chapters[{i}].event_weights: 未定義的事件效果 '{effect}'")
+            if not _check_type(weight, NUMBER) or weight < 0:
+                raise CatalogError(f"chapters[{i}].event_weights.{effect}: 權重必須為非負數")
+
+    shop_items = [_validate(s, "shop_item", f"shop_items[{i}]")
+                  for i, s in enumerate(raw["shop.json"].get("shop_items", []))]
+
+    return {
+        "chapters": chapters,
+        "chapter_index": chapter_index,
+        "formations": formations,
+        "maps": maps,
+        "bosses": bosses,
+        "shop_items": shop_items,
+        **events,
+    }
+
+
+def _freeze(obj):
+    """遞歸轉成只讀結構：dict -> MappingProxyType，list -> tuple"""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+def _read_sources(data_dir):
+    sources = {}
+    digest = hashlib.sha256(f"v{CATALOG_VERSION}".encode())
+    for name in DATA_FILES:
+        with open(os.path.join(data_dir, name), "rb") as f:
+            blob = f.read()
+        sources[name] = blob
+        digest.update(name.encode())
+        digest.update(blob)
+    return sources, digest.hexdigest()
+
+
+_loaded = {}
+_digests = {}
+
+
+def load_catalog(data_dir=DATA_DIR):
+    """載入數據目錄（同一進程內只載入一次）"""
+    if data_dir in _loaded:
+        return _loaded[data_dir]
+
+    sources, key = _read_sources(data_dir)
+    _digests[data_dir] = key
+    cache_dir = os.path.join(data_dir, CACHE_DIRNAME)
+    cache_path = os.path.join(cache_dir, f"catalog-{key[:16]}.marshal")
+
+    compiled = None
+    try:
+        with open(cache_path, "rb") as f:
+            compiled = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        compiled = None
+
+    if compiled is None:
+        raw = {}
+        for name, blob in sources.items():
+            try:
+                raw[name] = json.loads(blob.decode("utf-8"))
+            except ValueError as e:
+                raise CatalogError(f"{name}: JSON 解析失敗 ({e})") from e
+        compiled = _compile(raw)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                marshal.dump(compiled, f)
+            os.replace(tmp_path, cache_path)
+            # 清理舊版本數據留下的快取
+            for name in os.listdir(cache_dir):
+                if name.startswith("catalog-") and name.endswith(".marshal") \
+                        and os.path.join(cache_dir, name) != cache_path:
+                    os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            # 只讀目錄等情況下不寫快取，不影響遊戲
+            pass
+
+    catalog = _freeze(compiled)
+    _loaded[data_dir] = catalog
+    return catalog
+
+
+def catalog_digest(data_dir=DATA_DIR):
+    """已載入數據目錄的內容雜湊（與快取鍵相同），供其他由目錄數據派生的快取使用"""
+    load_catalog(data_dir)
+    return _digests[data_dir]
+
+
+def chapter_config(catalog, chapter):
+    """按章節編號取配置，不存在時回退到第一章"""
+    pos = catalog["chapter_index"].get(chapter, 0)
+    return catalog["chapters"][pos]
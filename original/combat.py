@@ -0,0 +1,76 @@
+"""傷害結算管線：一幀內的所有命中先排隊，幀末統一結算，結果以一個批次分發給渲染、任務計數和統計。
+
+所有傷害來源（普攻、技能、攻城、Boss技能）走同一條公式：
+    傷害 = 基礎值 × 倍率 × (暴擊 1.5) × (1 - 目標減傷)
+吸血只對普攻生效，按實際造成的傷害回復我方城堡。
+"""
+from collections import namedtuple
+
+HIT_ATTACK = "attack"
+HIT_SKILL = "skill"
+HIT_SIEGE = "siege"
+HIT_BOSS = "boss"
+
+CRIT_MULTIPLIER = 1.5
+
+Hit = namedtuple("Hit", "source target base multiplier crit reduction kind")
+HitResult = namedtuple("HitResult", "source target damage multiplier crit kind killed")
+
+
+def hit_damage(base, multiplier, crit, reduction):
+    damage = base * multiplier * (1 - reduction)
+    return damage * CRIT_MULTIPLIER if crit else damage
+
+
+class DamagePipeline:
+    def __init__(self):
+        self.pending = []
+        self.batch = []  # 最近一次結算的 [HitResult]
+        self.listeners = []  # fn(batch)，每次結算後調用
+        # 統計
+        self.damage_by_source = {}  # 來源名 -> 累計傷害
+        self.kills = [0, 0]  # 各隊伍的擊殺數（按擊殺方隊伍）
+        self.boss_kills = 0
+        self.lifesteal_healed = 0.0
+
+    def hit(self, source, target, base, multiplier=1.0, crit=False, kind=HIT_ATTACK):
+        """登記一次命中；目標減傷在登記時取值"""
+        self.pending.append(Hit(source, target, base, multiplier, crit,
+                                getattr(target, "damage_reduction", 0.0), kind))
+
+    def resolve(self, heal_castle=None):
+        """結算本幀全部命中並通知 listeners；heal_castle 為吸血回復的城堡"""
+        batch = []
+        damage_by_source = self.damage_by_source
+        for h in self.pending:
+            target = h.target
+            if target.hp <= 0:
+                # 同一幀內已被擊殺
+                continue
+            damage = hit_damage(h.base, h.multiplier, h.crit, h.reduction)
+            target.hp -= damage
+            killed = target.hp <= 0
+            source = h.source
+            name = getattr(source, "name", h.kind)
+            damage_by_source[name] = damage_by_source.get(name, 0.0) + damage
+            if killed:
+                self.kills[source.team] += 1
+                if getattr(target, "is_boss", False):
+                    self.boss_kills += 1
+            if h.kind == HIT_ATTACK and heal_castle is not None:
+                lifesteal = getattr(source, "lifesteal", 0.0)
+                if lifesteal > 0:
+                    healed = min(heal_castle.max_hp - heal_castle.hp, damage * lifesteal)
+                    if healed > 0:
+                        heal_castle.hp += healed
+                        self.lifesteal_healed += healed
+            batch.append(HitResult(source, target, damage, h.multiplier, h.crit, h.kind, killed))
+        self.pending.clear()
+        self.batch = batch
+        for listener in self.listeners:
+            listener(batch)
+        return batch
+
+    def top_damage(self, n=3):
+        """累計傷害最高的 n 個來源 [(名稱, 傷害)]"""
+        return sorted(self.damage_by_source.items(), key=lambda kv: kv[1], reverse=True)[:n]
@@ -0,0 +1,73 @@
+"""單位避讓與陣型移動。
+
+separate：同隊單位互相推開，避免大波次時疊成一團。每個單位通過 SpatialHash.neighbors 最多看
+SEPARATION_NEIGHBORS 個鄰居，總開銷與單位數近似線性。位移先按幀開始時的位置全部算出再一起施加，
+結果與遍歷順序無關。敵對單位之間不推開（否則近戰會被推出攻擊範圍）。
+
+formation_slots：玩家三名武將和好友助戰的陣型槽位（面朝上方敵陣，前排近戰、後排弓兵），
+以移動目標點為陣型中心，每個存活單位分到一個槽位。
+"""
+import math
+
+SEPARATION_RADIUS = 44.0  # 單位半徑 25，允許輕微重疊
+SEPARATION_PUSH = 1.2  # 完全重疊時每幀推開的像素
+SEPARATION_NEIGHBORS = 6
+
+# 槽位相對陣型中心的偏移（y 向下為正，敵陣在上方）：前排左、前排右、後排左、後排右
+FORMATION_SLOTS = ((-40, -35), (40, -35), (-40, 35), (40, 35))
+
+
+def separate(units, grid, bounds, radius=SEPARATION_RADIUS, push=SEPARATION_PUSH, limit=SEPARATION_NEIGHBORS,
+             passable=None):
+    """把同隊重疊的單位互相推開，返回被推動的單位數
+
+    bounds 為 (min_x, max_x, min_y, max_y)；passable(x, y) 為 False 的位置不推入。
+    """
+    order = {id(u): i for i, u in enumerate(units)}
+    moves = []
+    for u in units:
+        if u.hp <= 0:
+            continue
+        x, y = u.pos
+        fx = fy = 0.0
+        for other, dx, dy, d2 in grid.neighbors(x, y, radius, team=u.team, limit=limit, exclude=u):
+            if d2 > 0:
+                d = math.sqrt(d2)
+                k = (radius - d) / radius / d
+                fx -= dx * k
+                fy -= dy * k
+            else:
+                # 完全重合：按列表順序左右分開，保證結果確定
+                fx += 1.0 if order[id(u)] > order.get(id(other), -1) else -1.0
+        if fx or fy:
+            moves.append((u, fx, fy))
+    min_x, max_x, min_y, max_y = bounds
+    for u, fx, fy in moves:
+        norm = math.hypot(fx, fy)
+        scale = push / norm if norm > 1.0 else push
+        x = max(min_x, min(max_x, u.pos[0] + fx * scale))
+        y = max(min_y, min(max_y, u.pos[1] + fy * scale))
+        if passable is None or passable(x, y):
+            u.pos[0] = x
+            u.pos[1] = y
+    return len(moves)
+
+
+def formation_slots(units, anchor, back_row_types=(), bounds=None):
+    """[(單位, [x, y])]：存活單位按 (是否後排兵種, 原順序) 依次佔用 FORMATION_SLOTS
+
+    超過槽位數的單位從頭循環使用槽位並向後錯開一排。
+    """
+    alive = [u for u in units if u.hp > 0]
+    ordered = sorted(range(len(alive)), key=lambda i: (alive[i].type in back_row_types, i))
+    out = []
+    for n, i in enumerate(ordered):
+        ox, oy = FORMATION_SLOTS[n % len(FORMATION_SLOTS)]
+        oy += 70 * (n // len(FORMATION_SLOTS))
+        x, y = anchor[0] + ox, anchor[1] + oy
+        if bounds is not None:
+            min_x, max_x, min_y, max_y = bounds
+            x = max(min_x, min(max_x, x))
+            y = max(min_y, min(max_y, y))
+        out.append((alive[i], [x, y]))
+    return out
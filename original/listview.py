@@ -0,0 +1,293 @@
+"""大列表控件：只格式化可見行的虛擬列表，以及武將列表的預計算排序/篩選索引。"""
+import bisect
+import tkinter as tk
+from tkinter import font as tkfont
+
+
+class VirtualList(tk.Frame):
+    """接口接近 tk.Listbox 的虛擬列表
+
+    只有可見的行會調用 format_row 生成文字，結果按 key(item) 快取，
+    物件變化後用 invalidate(item) 讓該行重新格式化。選中變化時觸發 <<ListboxSelect>>。
+    """
+
+    def __init__(self, master, format_row, key=id, width=40, height=20, selectmode=tk.SINGLE,
+                 bg="#ECF0F1", fg="#000000", select_bg="#4A90E2", select_fg="#FFFFFF", font=("Arial", 10)):
+        super().__init__(master, bg=bg)
+        self.format_row = format_row
+        self.key = key
+        self.selectmode = selectmode
+        self.colors = (bg, fg, select_bg, select_fg)
+        self.font = tkfont.Font(font=font)
+        self.row_height = self.font.metrics("linespace") + 2
+
+        self.canvas = tk.Canvas(self, width=width * self.font.measure("0"), height=height * self.row_height,
+                                bg=bg, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.items = []
+        self.first = 0  # 第一個可見行
+        self.selected = set()
+        self._cache = {}
+        self._pool = []  # [(背景矩形, 文字)]，數量等於可見行數
+
+        self.canvas.bind("<Configure>", lambda e: self._layout())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.yview("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.yview("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.yview("scroll", 1, "units"))
+
+    # --- 數據 ---
+    def set_items(self, items, keep_selection=False):
+        """替換全部行（不格式化任何文字）"""
+        if keep_selection:
+            keys = {self.key(self.items[i]) for i in self.selected if i < len(self.items)}
+        self.items = list(items)
+        self.selected = {i for i, it in enumerate(self.items) if self.key(it) in keys} if keep_selection else set()
+        self.first = min(self.first, max(0, len(self.items) - self.visible_rows()))
+        self.refresh()
+
+    def invalidate(self, item=None):
+        """丟棄快取的行文字：item 為 None 時全部丟棄"""
+        if item is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(self.key(item), None)
+
+    def item(self, index):
+        return self.items[index]
+
+    def size(self):
+        return len(self.items)
+
+    # --- 選擇（與 Listbox 相同的用法） ---
+    def curselection(self):
+        return tuple(sorted(self.selected))
+
+    def selection_set(self, index):
+        if 0 <= index < len(self.items):
+            if self.selectmode != tk.MULTIPLE:
+                self.selected.clear()
+            self.selected.add(index)
+            self.see(index)
+            self.refresh()
+
+    def selection_clear(self):
+        self.selected.clear()
+        self.refresh()
+
+    def see(self, index):
+        rows = self.visible_rows()
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + rows:
+            self.first = index - rows + 1
+
+    # --- 捲動 ---
+    def visible_rows(self):
+        height = self.canvas.winfo_height()
+        if height <= 1:
+            height = int(self.canvas.cget("height"))
+        return max(1, height // self.row_height)
+
+    def yview(self, *args):
+        rows = self.visible_rows()
+        last = max(0, len(self.items) - rows)
+        if args and args[0] == "moveto":
+            self.first = int(float(args[1]) * len(self.items))
+        elif args and args[0] == "scroll":
+            step = int(args[1]) * (rows if args[2] == "pages" else 1)
+            self.first += step
+        self.first = max(0, min(last, self.first))
+        self.refresh()
+
+    # --- 繪製 ---
+    def _layout(self):
+        rows = self.visible_rows()
+        width = max(self.canvas.winfo_width(), int(self.canvas.cget("width")))
+        bg, fg, _, _ = self.colors
+        while len(self._pool) < rows + 1:
+            y = len(self._pool) * self.row_height
+            rect = self.canvas.create_rectangle(0, y, width, y + self.row_height, fill=bg, outline="")
+            text = self.canvas.create_text(4, y + 1, anchor="nw", font=self.font, fill=fg, text="")
+            self._pool.append((rect, text))
+        for rect, _ in self._pool:
+            x0, y0, _, y1 = self.canvas.coords(rect)
+            self.canvas.coords(rect, x0, y0, width, y1)
+        self.refresh()
+
+    def row_text(self, item):
+        k = self.key(item)
+        text = self._cache.get(k)
+        if text is None:
+            text = self._cache[k] = self.format_row(item)
+        return text
+
+    def refresh(self):
+        """重畫可見行（只格式化未快取的可見行）"""
+        bg, fg, select_bg, select_fg = self.colors
+        n = len(self.items)
+        for i, (rect, text) in enumerate(self._pool):
+            idx = self.first + i
+            if idx < n:
+                chosen = idx in self.selected
+                self.canvas.itemconfigure(text, text=self.row_text(self.items[idx]), fill=select_fg if chosen else fg)
+                self.canvas.itemconfigure(rect, fill=select_bg if chosen else bg)
+            else:
+                self.canvas.itemconfigure(text, text="")
+                self.canvas.itemconfigure(rect, fill=bg)
+        if n:
+            rows = self.visible_rows()
+            self.scrollbar.set(self.first / n, min(1.0, (self.first + rows) / n))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_click(self, event):
+        idx = self.first + int(event.y // self.row_height)
+        if idx >= len(self.items):
+            return
+        if self.selectmode == tk.MULTIPLE:
+            self.selected.symmetric_difference_update({idx})
+        else:
+            self.selected = {idx}
+        self.refresh()
+        self.event_generate("<<ListboxSelect>>")
+
+
+class CardIndex:
+    """武將列表的排序/篩選索引：按稀有度、兵種分桶，排序結果按需計算後快取
+
+    cards 變化後調用 rebuild()；只有等級/星級變化時調用 invalidate_order()。
+    """
+
+    SORTS = ("默认", "等级", "稀有度", "兵种")
+
+    def __init__(self, cards, rarity_order):
+        self.rarity_rank = {r: i for i, r in enumerate(rarity_order)}
+        self.rebuild(cards)
+
+    def rebuild(self, cards):
+        self.cards = list(cards)
+        self.by_rarity = {}
+        self.by_type = {}
+        for pos, c in enumerate(self.cards):
+            self.by_rarity.setdefault(c.rarity, set()).add(pos)
+            self.by_type.setdefault(c.unit_type, set()).add(pos)
+        self.invalidate_order()
+
+    def invalidate_order(self):
+        self._orders = {}
+        self._by_level = None
+
+    def _order(self, sort):
+        order = self._orders.get(sort)
+        if order is None:
+            cards = self.cards
+            rank = self.rarity_rank
+            positions = range(len(cards))
+            if sort == "等级":
+                order = sorted(positions, key=lambda p: (-cards[p].level, -rank.get(cards[p].rarity, 0)))
+            elif sort == "稀有度":
+                order = sorted(positions, key=lambda p: (-rank.get(cards[p].rarity, 0), -cards[p].level))
+            elif sort == "兵种":
+                order = sorted(positions, key=lambda p: (cards[p].unit_type, -cards[p].level))
+            else:
+                order = list(positions)
+            self._orders[sort] = order
+        return order
+
+    def _min_level(self, level):
+        """等級 >= level 的位置集合（按等級排好的陣列上二分）"""
+        if self._by_level is None:
+            ordered = sorted(range(len(self.cards)), key=lambda p: self.cards[p].level)
+            self._by_level = (ordered, [self.cards[p].level for p in ordered])
+        ordered, levels = self._by_level
+        return set(ordered[bisect.bisect_left(levels, level):])
+
+    def query(self, rarity=None, unit_type=None, min_level=None, sort=None):
+        """返回符合條件的武將列表（按 sort 排序）"""
+        allowed = None
+        for bucket in (self.by_rarity.get(rarity, set()) if rarity is not None else None,
+                       self.by_type.get(unit_type, set()) if unit_type is not None else None,
+                       self._min_level(min_level) if min_level else None):
+            if bucket is not None:
+                allowed = bucket if allowed is None else allowed & bucket
+        order = self._order(sort)
+        if allowed is None:
+            return [self.cards[p] for p in order]
+        return [self.cards[p] for p in order if p in allowed]
+
+
+class CardFilterBar(tk.Frame):
+    """稀有度/兵種/最低等級/排序 選擇條，變化時調用 on_change()"""
+
+    ALL = "全部"
+
+    def __init__(self, master, on_change, rarities, type_names, bg="#1A1A2E", fg="#ECF0F1"):
+        super().__init__(master, bg=bg)
+        self.type_names = list(type_names)
+        self.rarity = tk.StringVar(value=self.ALL)
+        self.unit_type = tk.StringVar(value=self.ALL)
+        self.min_level = tk.StringVar(value="1")
+        self.sort = tk.StringVar(value=CardIndex.SORTS[0])
+        fields = (("稀有", self.rarity, [self.ALL] + list(rarities)),
+                  ("兵种", self.unit_type, [self.ALL] + self.type_names),
+                  ("Lv≥", self.min_level, ["1", "10", "20", "30", "40", "50"]),
+                  ("排序", self.sort, list(CardIndex.SORTS)))
+        for i, (label, var, options) in enumerate(fields):
+            row, col = divmod(i, 2)
+            tk.Label(self, text=label, bg=bg, fg=fg, font=("Arial", 9)).grid(row=row, column=col * 2, sticky="e")
+            menu = tk.OptionMenu(self, var, *options)
+            menu.config(font=("Arial", 9), width=5)
+            menu.grid(row=row, column=col * 2 + 1, sticky="w", padx=(0, 6))
+            var.trace_add("write", lambda *a: on_change())
+
+    def query(self, index):
+        rarity = self.rarity.get()
+        unit_type = self.unit_type.get()
+        return index.query(rarity=None if rarity == self.ALL else rarity,
+                           unit_type=None if unit_type == self.ALL else self.type_names.index(unit_type),
+                           min_level=int(self.min_level.get()),
+                           sort=self.sort.get())
+
+
+class CardList(tk.Frame):
+    """篩選條 + 虛擬列表，行按 card.id 快取
+
+    set_cards(cards) 在武將增減後重建索引；card_changed(card) 在單個武將等級/星級變化後只重新格式化該行。
+    """
+
+    def __init__(self, master, format_row, rarity_order, type_names, bar_bg="#1A1A2E", bar_fg="#ECF0F1", **list_kw):
+        super().__init__(master, bg=bar_bg)
+        self.index = CardIndex([], rarity_order)
+        self.filter = CardFilterBar(self, self.apply_filter, rarity_order, type_names, bg=bar_bg, fg=bar_fg)
+        self.filter.pack(fill=tk.X, pady=(0, 2))
+        self.list = VirtualList(self, format_row, key=lambda c: c.id, **list_kw)
+        self.list.pack(fill=tk.BOTH, expand=True)
+        self.list.bind("<<ListboxSelect>>", lambda e: self.event_generate("<<ListboxSelect>>"))
+
+    def set_cards(self, cards):
+        self.index.rebuild(cards)
+        self.list.invalidate()
+        self.apply_filter()
+
+    def card_changed(self, card):
+        self.list.invalidate(card)
+        self.index.invalidate_order()
+        self.apply_filter()
+
+    def apply_filter(self):
+        self.list.set_items(self.filter.query(self.index), keep_selection=True)
+
+    def selected(self):
+        """選中的武將（按列表順序）"""
+        return [self.list.item(i) for i in self.list.curselection()]
+
+    def select(self, card):
+        for i, c in enumerate(self.list.items):
+            if c is card:
+                self.list.selection_set(i)
+                return True
+        return False
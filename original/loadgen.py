@@ -0,0 +1,232 @@
+"""戰鬥服務（server.py）的壓測工具：多個並發連接按比例發送請求，報告持續吞吐量和延遲分位數。
+
+    python loadgen.py --url http://127.0.0.1:8765 --concurrency 64 --seconds 10
+    python loadgen.py --spawn --seconds 5        # 在本進程內啟動服務（存檔放臨時目錄）再壓測
+    python loadgen.py --ws                       # 走 WebSocket 而不是 HTTP
+
+每個連接是一個機器人玩家（bot<序號>），保持連接連續發送：先查詢一次玩家數據拿到武將 id，
+之後按 --mix 的權重隨機選擇操作。前 --warmup 秒的請求不計入結果。
+回應 4xx（鑽石/金幣不足、已滿級等規則拒絕）計為 rejected，5xx 和連接錯誤計為 errors。
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from profiler import percentile
+from server import WS_TEXT, encode_frame, read_frame
+
+DEFAULT_MIX = "state=50,summon=20,level_up=15,battle=10,save=5"
+
+
+def parse_mix(text):
+    """"state=50,summon=20" -> [(操作, 權重)]"""
+    mix = []
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        mix.append((op.strip(), float(weight or 1)))
+    return mix
+
+
+class HttpClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, payload=None):
+        """返回 (狀態碼, 回應 JSON)"""
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode("latin-1") + body)
+        status_line = await self.reader.readline()
+        status = int(status_line.split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        data = await self.reader.readexactly(length) if length else b""
+        return status, json.loads(data) if data else {}
+
+    async def call(self, pid, op, params):
+        if op == "state":
+            return await self.request("GET", f"/api/players/{pid}")
+        return await self.request("POST", f"/api/players/{pid}/{op}", params)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self.writer.wait_closed()
+
+
+class WsClient(HttpClient):
+    async def connect(self):
+        await super().connect()
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.writer.write((f"GET /ws HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n")
+                          .encode("latin-1"))
+        status_line = await self.reader.readline()
+        if b" 101 " not in status_line:
+            raise ConnectionError(f"WebSocket 握手失敗: {status_line!r}")
+        await self.reader.readuntil(b"\r\n\r\n")
+        self._seq = 0
+
+    async def call(self, pid, op, params):
+        self._seq += 1
+        msg = {"id": self._seq, "op": op, "player": pid, **(params or {})}
+        self.writer.write(encode_frame(WS_TEXT, json.dumps(msg).encode("utf-8"), mask=True))
+        while True:
+            fin, opcode, payload = await read_frame(self.reader, max_size=1 << 24)
+            if opcode == WS_TEXT:
+                reply = json.loads(payload)
+                return (200 if reply.get("ok") else reply.get("status", 500)), reply
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}  # 操作 -> [秒]
+        self.outcomes = {}  # 操作 -> {"ok"/"rejected"/"errors": 次數}
+
+    def record(self, op, seconds, kind):
+        self.latencies.setdefault(op, []).append(seconds)
+        counts = self.outcomes.setdefault(op, {"ok": 0, "rejected": 0, "errors": 0})
+        counts[kind] += 1
+
+    def report(self, elapsed):
+        everything = sorted(t for values in self.latencies.values() for t in values)
+        total = len(everything)
+        by_op = {}
+        for op, values in sorted(self.latencies.items()):
+            values.sort()
+            by_op[op] = {"count": len(values), **self.outcomes[op],
+                         "p50_ms": percentile(values, 0.50) * 1000, "p99_ms": percentile(values, 0.99) * 1000}
+        return {
+            "seconds": elapsed,
+            "requests": total,
+            "rps": total / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(everything, 0.50) * 1000,
+            "p95_ms": percentile(everything, 0.95) * 1000,
+            "p99_ms": percentile(everything, 0.99) * 1000,
+            "max_ms": (everything[-1] if everything else 0) * 1000,
+            "errors": sum(o["errors"] for o in self.outcomes.values()),
+            "rejected": sum(o["rejected"] for o in self.outcomes.values()),
+            "ops": by_op,
+        }
+
+
+async def bot(n, client, mix, chapter, measure_from, stop_at, stats, rng):
+    pid = f"bot{n}"
+    ops = [op for op, _ in mix]
+    weights = [w for _, w in mix]
+    try:
+        await client.connect()
+        status, state = await client.call(pid, "state", None)
+        card_ids = [c["id"] for c in state.get("roster", [])]
+        while time.perf_counter() < stop_at:
+            op = rng.choices(ops, weights)[0]
+            params = {}
+            if op == "summon":
+                params = {"count": rng.choice((1, 10))}
+            elif op in ("level_up", "rank_up"):
+                params = {"card_id": rng.choice(card_ids) if card_ids else "", "times": 1}
+                if op == "rank_up":
+                    del params["times"]
+            elif op == "battle":
+                params = {"chapter": chapter}
+            t0 = time.perf_counter()
+            try:
+                status, reply = await client.call(pid, op, params)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                status, reply = 599, {}
+                await client.close()
+                await client.connect()
+            t1 = time.perf_counter()
+            if op == "summon" and status == 200:
+                card_ids.extend(c["id"] for c in reply.get("cards", ()))
+            if t0 >= measure_from:
+                kind = "ok" if status < 400 else "rejected" if status < 500 else "errors"
+                stats.record(op, t1 - t0, kind)
+    finally:
+        await client.close()
+
+
+async def run(args):
+    server = service = None
+    host, port = args.host, args.port
+    if args.spawn:
+        from server import start
+        data_dir = tempfile.mkdtemp(prefix="sanguo_loadgen_")
+        server, service = await start(host, port, args.workers, data_dir)
+        port = server.sockets[0].getsockname()[1]
+        print(f"已在本進程啟動服務: {host}:{port}，存檔目錄 {data_dir}")
+    try:
+        mix = parse_mix(args.mix)
+        stats = Stats()
+        started = time.perf_counter()
+        measure_from = started + args.warmup
+        stop_at = measure_from + args.seconds
+        client_cls = WsClient if args.ws else HttpClient
+        await asyncio.gather(*(bot(n, client_cls(host, port), mix, args.chapter, measure_from, stop_at, stats,
+                                   random.Random(args.seed + n))
+                               for n in range(args.concurrency)))
+        return stats.report(time.perf_counter() - measure_from)
+    finally:
+        if server is not None:
+            server.close()
+            await service.close()
+
+
+def print_report(r):
+    print(f"{r['requests']} 個請求 / {r['seconds']:.1f}s = {r['rps']:.1f} req/s   "
+          f"p50 {r['p50_ms']:.2f}ms  p95 {r['p95_ms']:.2f}ms  p99 {r['p99_ms']:.2f}ms  max {r['max_ms']:.2f}ms")
+    print(f"規則拒絕 {r['rejected']}，錯誤 {r['errors']}")
+    for op, o in r["ops"].items():
+        print(f"  {op:<10} {o['count']:>7}  ok {o['ok']:>7}  rejected {o['rejected']:>6}  errors {o['errors']:>5}  "
+              f"p50 {o['p50_ms']:8.2f}ms  p99 {o['p99_ms']:8.2f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="戰鬥服務壓測")
+    parser.add_argument("--url", default="http://127.0.0.1:8765", help="服務地址")
+    parser.add_argument("--concurrency", type=int, default=32, help="並發連接（機器人）數")
+    parser.add_argument("--seconds", type=float, default=10.0, help="計入結果的壓測時長")
+    parser.add_argument("--warmup", type=float, default=1.0, help="預熱秒數（不計入結果）")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="操作權重，如 state=50,battle=10")
+    parser.add_argument("--chapter", type=int, default=1, help="battle 操作挑戰的章節")
+    parser.add_argument("--ws", action="store_true", help="用 WebSocket 而不是 HTTP")
+    parser.add_argument("--spawn", action="store_true", help="在本進程內啟動服務（--url 的端口為 0 時自動選擇）")
+    parser.add_argument("--workers", type=int, default=None, help="--spawn 時的戰鬥模擬進程數")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="把完整結果寫到 JSON 檔案")
+    args = parser.parse_args(argv)
+    url = urlsplit(args.url)
+    args.host = url.hostname or "127.0.0.1"
+    args.port = 80 if url.port is None else url.port
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
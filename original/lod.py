@@ -0,0 +1,91 @@
+"""戰場繪製的細節層級（LOD）：單位多、幀耗時高時逐級省略裝飾性繪製。
+
+層級越高省略越多，順序按「看不到也不影響操作」排列：
+    0 全部繪製
+    1 省略名字、仇恨線，傷害數字按區域合併
+    2 再省略攻擊範圍圈、狀態文字
+    3 再省略技能冷卻條、傷害數字和飛行中的箭矢
+選中的單位始終保留名字、仇恨線和範圍圈。
+
+DetailPolicy 每幀先由 detail(單位數) 給出本幀的層級，繪製結束後用 record(耗時) 回報實際耗時。
+層級 = max(按單位數的下限, 按耗時自適應的層級)：耗時的指數平均超過預算時升一級，
+低於預算的 LOWER_RATIO 時降一級，每次變化後至少間隔若干幀，避免在兩級之間來回跳。
+"""
+from collections import namedtuple
+
+Detail = namedtuple("Detail", "level names aggro ranges status cooldown damage projectiles")
+
+# damage: "all" 每條都畫，"merge" 按區域合併，None 不畫
+LEVELS = (
+    Detail(0, True, True, True, True, True, "all", True),
+    Detail(1, False, False, True, True, True, "merge", True),
+    Detail(2, False, False, False, False, True, "merge", True),
+    Detail(3, False, False, False, False, False, None, False),
+)
+LEVEL_NAMES = ("全部", "精简", "低", "最低")
+
+# 存活單位數達到這些值時，層級至少為 1/2/3
+UNIT_COUNT_FLOORS = (40, 80, 160)
+DEFAULT_BUDGET_MS = 12.0  # 16ms 幀間隔中留給更新+繪製的時間
+LOWER_RATIO = 0.6
+EWMA_ALPHA = 0.1
+RAISE_AFTER_FRAMES = 15  # 變化後至少隔多少幀才能再升級
+LOWER_AFTER_FRAMES = 90  # 降級更保守：剛升上去的負載往往還在
+
+
+class DetailPolicy:
+    def __init__(self, budget_ms=DEFAULT_BUDGET_MS, floors=UNIT_COUNT_FLOORS):
+        self.budget_ms = budget_ms
+        self.floors = floors
+        self.adaptive = 0  # 按耗時自適應的層級
+        self.level = 0  # 本幀實際使用的層級
+        self.frame_ms = 0.0  # 耗時的指數平均
+        self._since_change = 0
+
+    def floor(self, unit_count):
+        return sum(1 for n in self.floors if unit_count >= n)
+
+    def detail(self, unit_count):
+        """本幀使用的 Detail"""
+        self.level = max(self.floor(unit_count), self.adaptive)
+        return LEVELS[self.level]
+
+    def record(self, elapsed_ms):
+        """回報本幀更新+繪製的耗時，必要時調整自適應層級"""
+        if self.frame_ms:
+            self.frame_ms += EWMA_ALPHA * (elapsed_ms - self.frame_ms)
+        else:
+            self.frame_ms = elapsed_ms
+        self._since_change += 1
+        if (self.frame_ms > self.budget_ms and self.adaptive < len(LEVELS) - 1
+                and self._since_change >= RAISE_AFTER_FRAMES):
+            self.adaptive += 1
+            self._since_change = 0
+        elif (self.frame_ms < self.budget_ms * LOWER_RATIO and self.adaptive > 0
+              and self._since_change >= LOWER_AFTER_FRAMES):
+            self.adaptive -= 1
+            self._since_change = 0
+
+    def hud_text(self):
+        return f"LOD {self.level} {LEVEL_NAMES[self.level]} · {self.frame_ms:.1f}ms"
+
+
+def merge_damage_texts(texts, cell=60):
+    """把同一區域的傷害數字合併成一條：數字相加，文字提示只保留最新的一條
+
+    texts 為 [(pos, 數值或文字, 剩餘幀數)]，返回相同格式的列表（位置和剩餘幀數取該區域最新的一條）。
+    """
+    merged = {}
+    for pos, value, t in texts:
+        numeric = not isinstance(value, str)
+        key = (int(pos[0] // cell), int(pos[1] // cell), numeric)
+        prev = merged.get(key)
+        if prev is None:
+            merged[key] = [pos, value, t]
+        elif numeric:
+            prev[1] += value
+            if t > prev[2]:
+                prev[0], prev[2] = pos, t
+        elif t >= prev[2]:
+            merged[key] = [pos, value, t]
+    return [tuple(m) for m in merged.values()]
@@ -0,0 +1,80 @@
+"""單位屬性修正堆疊：加法層 + 乘法層，按來源標籤撤銷、按戰鬥時鐘到期，有效值只在堆疊變化時重算。
+
+有效值 = (基礎值 + Σ加法修正) × Π乘法修正。
+"""
+import math
+from collections import namedtuple
+
+Modifier = namedtuple("Modifier", "source stat op value expires")
+
+
+class StatBlock:
+    __slots__ = ("base", "mods", "effective", "dirty", "next_expiry")
+
+    def __init__(self, **base):
+        self.base = base
+        self.mods = []
+        self.effective = dict(base)
+        self.dirty = False
+        self.next_expiry = math.inf
+
+    def set_base(self, stat, value):
+        self.base[stat] = value
+        self.dirty = True
+
+    def add(self, source, stat, op, value, expires=None):
+        """加入修正；op 為 "add" 或 "mul"，expires 為到期的戰鬥時間（None=不到期）"""
+        if op not in ("add", "mul"):
+            raise ValueError(f"未知的修正類型: {op}")
+        self.mods.append(Modifier(source, stat, op, value, math.inf if expires is None else expires))
+        if expires is not None and expires < self.next_expiry:
+            self.next_expiry = expires
+        self.dirty = True
+
+    def remove(self, source):
+        """移除 source 的全部修正，返回移除數量"""
+        kept = [m for m in self.mods if m.source != source]
+        removed = len(self.mods) - len(kept)
+        if removed:
+            self.mods = kept
+            self.dirty = True
+        return removed
+
+    def expire(self, now):
+        """移除到期的修正（沒有修正到期時只做一次比較）"""
+        if now < self.next_expiry:
+            return
+        self.mods = [m for m in self.mods if m.expires > now]
+        self.next_expiry = min((m.expires for m in self.mods), default=math.inf)
+        self.dirty = True
+
+    def recompute(self):
+        add = {}
+        mul = {}
+        for m in self.mods:
+            if m.op == "add":
+                add[m.stat] = add.get(m.stat, 0) + m.value
+            else:
+                mul[m.stat] = mul.get(m.stat, 1.0) * m.value
+        self.effective = {stat: (value + add.get(stat, 0)) * mul.get(stat, 1.0)
+                          for stat, value in self.base.items()}
+        self.dirty = False
+
+    def get(self, stat):
+        if self.dirty:
+            self.recompute()
+        return self.effective[stat]
+
+
+def stat_property(stat):
+    """把屬性讀寫映射到 self.stats：讀取返回有效值，賦值修改基礎值"""
+    def getter(self):
+        stats = self.stats
+        if stats.dirty:
+            stats.recompute()
+        return stats.effective[stat]
+
+    def setter(self, value):
+        self.stats.set_base(stat, value)
+
+    return property(getter, setter)
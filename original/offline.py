@@ -0,0 +1,180 @@
+"""離線掛機結算：用無界面的戰鬥規則（BattleSimulation）快進離線期間的自動戰鬥。
+
+只完整模擬有限幾場戰鬥；離線時間內能打的場數超過樣本數時，按樣本的勝率、
+平均時長和武將存活率外推，保證 24 小時的結算也能在一兩秒內完成。
+樣本太少（勝率的 95% 區間過寬）時不外推：先加時多打幾場，仍然不夠就只結算實際模擬的場次。
+"""
+import copy
+import math
+import time
+from collections import namedtuple
+
+from sanguo_prototype import (BattleSimulation, chapter_rewards, roll_equipment_drop)
+
+SIM_DT = 0.016  # 與 GameWindow 每幀的模擬步長一致
+MAX_BATTLE_SECONDS = 600  # 單場戰鬥最長模擬時間，超時按失敗計
+BATTLE_OVERHEAD_SECONDS = 5.0  # 兩場戰鬥之間的結算/重開時間
+OFFLINE_MAX_SECONDS = 24 * 3600  # 離線收益上限
+DEFEAT_GOLD = 80  # 失敗安慰獎，與 GameWindow 一致
+MIN_EXTRAPOLATION_SAMPLES = 12  # 外推至少需要的樣本場數
+MAX_WIN_RATE_MARGIN = 0.2  # 勝率區間半寬超過此值時不外推
+EXTRA_SIM_BUDGET = 1.0  # 樣本不足以外推時額外允許的模擬秒數
+MAX_DROP_ROLLS = 30  # 一次結算最多擲多少次裝備掉落（每場勝利一次，之後不再掉落）
+
+BattleResult = namedtuple("BattleResult", "outcome seconds survivors gold_spent")
+OfflineReport = namedtuple(
+    "OfflineReport",
+    "idle_seconds battles wins losses gold gems exp level_ups equipment sampled extrapolated win_rate_margin",
+)
+
+
+def simulate_battle(player, team_cards, chapter, max_seconds=MAX_BATTLE_SECONDS, deadline=None, gold=None):
+    """無界面跑一場自動戰鬥，不修改玩家數據；gold 給定時按這個金幣餘額開戰（交易事件只能花這麼多）
+
+    outcome 除 battle_outcome() 的結果外還有：
+    "wiped"（我方單位全滅，敵人不會移動，戰鬥不會再有進展）、"stalled"（波次耗盡而城堡未破）、
+    "timeout"（超過 max_seconds）和 "aborted"（超過 perf_counter 截止時間 deadline）。
+    """
+    # 交易事件會扣金幣，用淺拷貝隔離
+    sim_player = copy.copy(player)
+    if gold is not None:
+        sim_player.gold = gold
+    sim = BattleSimulation(sim_player, team_cards, chapter=chapter, auto_battle=True, headless=True)
+    steps = int(max_seconds / SIM_DT)
+    outcome = "timeout"
+    step = 0
+    for step in range(1, steps + 1):
+        if not sim.step(SIM_DT):
+            outcome = "stalled"
+            break
+        result = sim.battle_outcome()
+        if result is not None:
+            outcome = result
+            break
+        if not any(u.hp > 0 for u in sim.player_units):
+            outcome = "wiped"
+            break
+        if deadline is not None and step % 256 == 0 and time.perf_counter() > deadline:
+            outcome = "aborted"
+            break
+    survivors = tuple(i < len(sim.player_units) and sim.player_units[i].hp > 0
+                      for i in range(len(team_cards[:3])))
+    return BattleResult(outcome, step * SIM_DT, survivors, (player.gold if gold is None else gold) - sim_player.gold)
+
+
+def _win_rate_margin(wins, n, z=1.96):
+    """勝率 95% Wilson 區間的半寬，用於判斷外推是否可信"""
+    if n == 0:
+        return 1.0
+    p = wins / n
+    denom = 1 + z * z / n
+    return z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+
+
+def _can_extrapolate(wins, n):
+    return n >= MIN_EXTRAPOLATION_SAMPLES and _win_rate_margin(wins, n) <= MAX_WIN_RATE_MARGIN
+
+
+def settle_offline(player, team_cards, chapter, idle_seconds, max_sims=32, time_budget=0.6,
+                   extra_budget=EXTRA_SIM_BUDGET):
+    """結算離線收益並直接寫入 player/team_cards（不保存存檔），返回 OfflineReport
+
+    最多完整模擬 max_sims 場或用完 time_budget 秒（第一場總是打完）；若這些戰鬥已覆蓋離線時間則按實際結果結算。
+    否則樣本足夠（_can_extrapolate）時按樣本外推總場數、勝場和經驗；不夠時在 extra_budget 秒內繼續模擬，
+    仍不夠就只結算模擬過的場次。金幣餘額逐場累計：每場的交易只能花開戰時的餘額，
+    外推的場次同樣按平均花費和餘額取小，結算後的金幣不會為負。
+    """
+    idle_seconds = max(0.0, min(idle_seconds, OFFLINE_MAX_SECONDS))
+    team_cards = team_cards[:3]
+    reward_gold, reward_gems, base_exp = chapter_rewards(chapter)
+
+    def is_win(r):
+        return r.outcome == "chapter_clear"
+
+    def income(r):
+        # 只有完成全部波次的勝利發放關卡獎勵；城堡失守發放安慰金幣，與 GameWindow 一致
+        return reward_gold if is_win(r) else DEFEAT_GOLD if r.outcome == "defeat" else 0
+
+    samples = []
+    started = time.perf_counter()
+    hard_deadline = started + time_budget + extra_budget
+    covered = 0.0
+    balance = player.gold
+    wins_so_far = 0
+    while covered < idle_seconds and len(samples) < max_sims:
+        now = time.perf_counter()
+        if samples and (now > hard_deadline or now - started > time_budget
+                        and _can_extrapolate(wins_so_far, len(samples))):
+            break
+        # 第一場不設截止時間，保證至少有一場結果
+        result = simulate_battle(player, team_cards, chapter, deadline=hard_deadline if samples else None,
+                                 gold=balance)
+        if result.outcome == "aborted":
+            break
+        cycle = result.seconds + BATTLE_OVERHEAD_SECONDS
+        if covered + cycle > idle_seconds:
+            # 最後一場在離線時間內打不完
+            covered = idle_seconds
+            break
+        samples.append(result)
+        wins_so_far += is_win(result)
+        covered += cycle
+        balance += income(result) - result.gold_spent
+
+    sampled = len(samples)
+    win_count = sum(1 for r in samples if is_win(r))
+    extrapolated = covered < idle_seconds and _can_extrapolate(win_count, sampled)
+    defeat_count = sum(1 for r in samples if r.outcome == "defeat")
+    if extrapolated:
+        mean_cycle = sum(r.seconds for r in samples) / sampled + BATTLE_OVERHEAD_SECONDS
+        battles = int(idle_seconds // mean_cycle)
+        wins = round(battles * win_count / sampled)
+        defeats = round(battles * defeat_count / sampled)
+        # 樣本之後的場次：每場按樣本平均收支，花費不超過當時的餘額
+        mean_income = sum(income(r) for r in samples) / sampled
+        mean_spend = sum(r.gold_spent for r in samples) / sampled
+        gold_spent = sum(r.gold_spent for r in samples)
+        for _ in range(battles - sampled):
+            spend = min(max(balance, 0), mean_spend)
+            gold_spent += spend
+            balance += mean_income - spend
+        gold_spent = round(gold_spent)
+        survival = [sum(1 for r in samples if is_win(r) and r.survivors[i]) / win_count if win_count else 0.0
+                    for i in range(len(team_cards))]
+        exp_wins = [round(wins * rate) for rate in survival]
+    else:
+        battles = sampled
+        wins = win_count
+        defeats = defeat_count
+        gold_spent = sum(r.gold_spent for r in samples)
+        exp_wins = [sum(1 for r in samples if is_win(r) and r.survivors[i]) for i in range(len(team_cards))]
+
+    gold = max(wins * reward_gold + defeats * DEFEAT_GOLD - gold_spent, -player.gold)
+    gems = wins * reward_gems
+    player.gold += gold
+    player.gems += gems
+
+    exp = {}
+    level_ups = []
+    for card, n_wins in zip(team_cards, exp_wins):
+        amount = n_wins * base_exp
+        if amount <= 0:
+            continue
+        start_level = card.level
+        card.add_exp(amount)
+        exp[card.id] = amount
+        if card.level > start_level:
+            player.roster.update(card)
+            level_ups.append((card.name, start_level, card.level))
+
+    equipment = []
+    # 外推的勝場可達數千，掉落次數封頂，背包和隨機數調用都有上限
+    for _ in range(min(wins, MAX_DROP_ROLLS)):
+        drop = roll_equipment_drop(chapter)
+        if drop:
+            slot, dropped = drop
+            player.equipment_inventory.append({"id": dropped["id"], "slot": slot, "equipped_to": None})
+            equipment.append(dropped["id"])
+
+    return OfflineReport(idle_seconds, battles, wins, battles - wins, gold, gems, exp, level_ups, equipment,
+                         sampled, extrapolated, _win_rate_margin(win_count, sampled))
@@ -0,0 +1,237 @@
+"""戰場地形與流場尋路。
+
+章節可以在 chapters.json 的 maps 中引用一張地圖，地圖由矩形障礙組成：
+    river / wall  不可通行（箭矢不受影響）
+    gate          可通行，覆蓋在 river/wall 上表示橋和城門
+NavGrid 把地圖柵格化成 CELL 像素的格子。流場（每格走向目的地的下一格）按 (地圖, 目的格) 計算一次，
+放在 LRU 快取裡，所有單位共用：走向城堡、點擊目標或追擊敵人時每幀只是一次查表，不必每個單位跑 A*。
+兩點之間沒有障礙時直接走直線（不查流場），空曠的地圖行為與沒有地形時相同。
+"""
+import heapq
+import math
+from array import array
+from collections import OrderedDict, namedtuple
+
+CELL = 20
+BLOCKING = ("river", "wall")
+PASSABLE = ("gate",)
+OBSTACLE_KINDS = BLOCKING + PASSABLE
+
+STRAIGHT_COST = 10
+DIAGONAL_COST = 14
+UNREACHABLE = 1 << 30
+
+FlowField = namedtuple("FlowField", "goals dist next")
+
+
+class FlowFieldCache:
+    """(地圖, 目的格) -> FlowField 的 LRU 快取，所有戰鬥共用"""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._fields = OrderedDict()
+        self.builds = 0
+
+    def __len__(self):
+        return len(self._fields)
+
+    def get(self, nav, dest):
+        key = (nav.key, dest)
+        field = self._fields.get(key)
+        if field is not None:
+            self._fields.move_to_end(key)
+            return field
+        field = nav.build_field(dest)
+        self.builds += 1
+        self._fields[key] = field
+        while len(self._fields) > self.maxsize:
+            self._fields.popitem(last=False)
+        return field
+
+    def clear(self):
+        self._fields.clear()
+
+
+FIELD_CACHE = FlowFieldCache()
+
+
+class NavGrid:
+    def __init__(self, key, obstacles, width=1000, height=600, cell=CELL, cache=FIELD_CACHE):
+        self.key = key
+        self.obstacles = tuple(obstacles)
+        self.cell = cell
+        self.cols = math.ceil(width / cell)
+        self.rows = math.ceil(height / cell)
+        self.cache = cache
+        n = self.cols * self.rows
+        self.blocked = bytearray(n)
+        for kinds, value in ((BLOCKING, 1), (PASSABLE, 0)):
+            for ob in self.obstacles:
+                if ob["kind"] in kinds:
+                    self._mark(ob, value)
+        self.adj = [self._neighbors(i) for i in range(n)]
+        self._los = {}
+
+    def _mark(self, ob, value):
+        """格子中心落在障礙矩形內的格子"""
+        c = self.cell
+        for row in range(self.rows):
+            cy = (row + 0.5) * c
+            if not ob["y0"] <= cy <= ob["y1"]:
+                continue
+            for col in range(self.cols):
+                if ob["x0"] <= (col + 0.5) * c <= ob["x1"]:
+                    self.blocked[row * self.cols + col] = value
+
+    def _neighbors(self, i):
+        """[(鄰格, 代價)]：只含可通行的鄰格，斜向移動要求兩個相鄰正向格都可通行（不切牆角）"""
+        cols, rows, blocked = self.cols, self.rows, self.blocked
+        row, col = divmod(i, cols)
+        out = []
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                if not (dr or dc):
+                    continue
+                r, c = row + dr, col + dc
+                if not (0 <= r < rows and 0 <= c < cols) or blocked[r * cols + c]:
+                    continue
+                if dr and dc:
+                    if blocked[row * cols + c] or blocked[r * cols + col]:
+                        continue
+                    out.append((r * cols + c, DIAGONAL_COST))
+                else:
+                    out.append((r * cols + c, STRAIGHT_COST))
+        return out
+
+    # --- 座標 ---
+    def cell_index(self, pos):
+        col = min(self.cols - 1, max(0, int(pos[0] // self.cell)))
+        row = min(self.rows - 1, max(0, int(pos[1] // self.cell)))
+        return row * self.cols + col
+
+    def center(self, i):
+        row, col = divmod(i, self.cols)
+        return [(col + 0.5) * self.cell, (row + 0.5) * self.cell]
+
+    def passable(self, x, y):
+        return not self.blocked[self.cell_index((x, y))]
+
+    def nearest_passable(self, i):
+        """i 本身可通行時返回 (i,)，否則向外逐圈找，返回距離最近的全部可通行格（障礙兩側同樣近時都算）"""
+        if not self.blocked[i]:
+            return (i,)
+        row, col = divmod(i, self.cols)
+        for radius in range(1, max(self.cols, self.rows)):
+            found = []
+            for r in range(row - radius, row + radius + 1):
+                for c in range(col - radius, col + radius + 1):
+                    if max(abs(r - row), abs(c - col)) != radius or not (0 <= r < self.rows and 0 <= c < self.cols):
+                        continue
+                    j = r * self.cols + c
+                    if not self.blocked[j]:
+                        found.append(((r - row) ** 2 + (c - col) ** 2, j))
+            if found:
+                best = min(d for d, _ in found)
+                return tuple(j for d, j in found if d == best)
+        return (i,)
+
+    def clear_line(self, a, b):
+        """a 所在格子內任一點到 b 所在格子內對應點的直線都不經過障礙（結果按格子對快取）
+
+        取樣兩格中心的連線和四個角的連線：格子沿直線平移掃過的區域以角連線為邊界，
+        所以實際位置不在格子中心時也不會擦過障礙的邊角。
+        """
+        src, dst = self.cell_index(a), self.cell_index(b)
+        key = (src, dst)
+        clear = self._los.get(key)
+        if clear is None:
+            if len(self._los) > 8192:
+                self._los.clear()
+            p, q = self.center(src), self.center(dst)
+            steps = int(math.hypot(q[0] - p[0], q[1] - p[1]) / (self.cell / 4)) + 1
+            h = self.cell / 2 - 0.01
+            clear = True
+            for ox, oy in ((0.0, 0.0), (-h, -h), (h, -h), (-h, h), (h, h)):
+                for s in range(steps + 1):
+                    t = s / steps
+                    x = p[0] + ox + (q[0] - p[0]) * t
+                    y = p[1] + oy + (q[1] - p[1]) * t
+                    if self.blocked[self.cell_index((x, y))]:
+                        clear = False
+                        break
+                if not clear:
+                    break
+            self._los[key] = clear
+        return clear
+
+    # --- 流場 ---
+    def build_field(self, dest):
+        """從目的格（不可通行時取最近的可通行格）出發的 Dijkstra，得到每格的距離和下一格"""
+        n = self.cols * self.rows
+        goals = frozenset(self.nearest_passable(dest))
+        dist = array("i", [UNREACHABLE]) * n
+        for g in goals:
+            dist[g] = 0
+        heap = [(0, g) for g in goals]
+        adj = self.adj
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d > dist[i]:
+                continue
+            for j, cost in adj[i]:
+                nd = d + cost
+                if nd < dist[j]:
+                    dist[j] = nd
+                    heapq.heappush(heap, (nd, j))
+        nxt = array("i", [-1]) * n
+        for i in range(n):
+            if i in goals:
+                continue
+            # 障礙格也給出方向（被推進障礙的單位能走出來）
+            best, best_d = -1, UNREACHABLE
+            for j, cost in (self._neighbors(i) if self.blocked[i] else adj[i]):
+                d = dist[j] + cost
+                if dist[j] < UNREACHABLE and d < best_d:
+                    best, best_d = j, d
+            nxt[i] = best
+        return FlowField(goals, dist, nxt)
+
+    def field(self, dest):
+        return self.cache.get(self, dest)
+
+    def waypoint(self, pos, target):
+        """從 pos 走向 target 時本幀應朝向的點
+
+        直線無障礙時就是 target，否則是流場給出的下一格中心；target 在障礙裡而已經走到
+        離它最近的可通行格時返回 None（到達）。目的地不可達時返回 target（撞到障礙為止）。
+        """
+        src, dst = self.cell_index(pos), self.cell_index(target)
+        if src == dst or (not self.blocked[src] and self.clear_line(pos, target)):
+            return target
+        field = self.field(dst)
+        if src in field.goals:
+            return None if self.blocked[dst] else target
+        j = field.next[src]
+        if j < 0:
+            return target
+        # 向前看一格：能直接走到下下格時跳過當前格，路線少走鋸齒
+        k = field.next[j]
+        if k >= 0 and not self.blocked[src] and self.clear_line(pos, self.center(k)):
+            j = k
+        if j in field.goals and not self.blocked[dst]:
+            return target
+        return self.center(j)
+
+
+_grids = {}
+
+
+def nav_grid(map_name, obstacles, width=1000, height=600):
+    """按 (地圖名, 世界尺寸) 共用 NavGrid（流場快取以此為鍵）；沒有障礙時返回 None"""
+    if not obstacles:
+        return None
+    key = (map_name, width, height)
+    grid = _grids.get(key)
+    if grid is None:
+        grid = _grids[key] = NavGrid(key, obstacles, width, height)
+    return grid
@@ -0,0 +1,121 @@
+"""性能計時工具。
+
+FrameProfiler：逐幀分階段計時，每個階段保留最近 window 幀的耗時（perf_counter_ns），給出 p50/p95/p99。
+每幀開始調用 begin()，每個階段結束時調用 lap(階段名)，記錄的是距上一次 begin/lap 的時間。
+一幀內同一階段可以 lap 多次（一幀推進多個模擬步長），按幀累加，下一次 begin() 時每個階段記一個樣本。
+
+StartupTimer：記錄啟動各階段的時間點（--profile-startup）。
+"""
+import json
+import math
+import sys
+import time
+from collections import deque
+
+# GameWindow.update_game 的階段，按執行順序
+FRAME_PHASES = (
+    ("spawn", "波次/事件"),
+    ("units", "单位更新"),
+    ("siege", "攻城扫描"),
+    ("boss", "Boss/结算"),
+    ("clear", "清空画布"),
+    ("draw", "单位绘制"),
+    ("particles", "粒子"),
+    ("hud", "HUD"),
+    ("present", "canvas.update"),
+)
+
+
+def percentile(sorted_values, q):
+    """已排序列表的 q 分位數（最近秩）"""
+    if not sorted_values:
+        return 0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+class FrameProfiler:
+    def __init__(self, window=600, refresh_frames=30):
+        self.samples = {name: deque(maxlen=window) for name, _ in FRAME_PHASES}
+        self.frame_times = deque(maxlen=window)
+        self.frames = 0
+        self.refresh_frames = refresh_frames  # 每隔多少幀重新計算分位數
+        self._frame_start = 0
+        self._t = 0
+        self._frame_laps = {}  # 本幀各階段累計耗時，begin() 時寫入 samples
+        self._summary = None
+        self._summary_frame = -1
+
+    def begin(self):
+        now = time.perf_counter_ns()
+        if self._frame_start:
+            self.frame_times.append(now - self._frame_start)
+        for phase, elapsed in self._frame_laps.items():
+            self.samples[phase].append(elapsed)
+        self._frame_laps.clear()
+        self._frame_start = now
+        self._t = now
+        self.frames += 1
+
+    def lap(self, phase):
+        now = time.perf_counter_ns()
+        self._frame_laps[phase] = self._frame_laps.get(phase, 0) + now - self._t
+        self._t = now
+
+    def summary(self):
+        """{階段: {p50_ms, p95_ms, p99_ms, max_ms, count}}，每 refresh_frames 幀重算一次"""
+        if self._summary is not None and self.frames - self._summary_frame < self.refresh_frames:
+            return self._summary
+        out = {}
+        for name, values in list(self.samples.items()) + [("frame", self.frame_times)]:
+            ordered = sorted(values)
+            out[name] = {
+                "p50_ms": percentile(ordered, 0.50) / 1e6,
+                "p95_ms": percentile(ordered, 0.95) / 1e6,
+                "p99_ms": percentile(ordered, 0.99) / 1e6,
+                "max_ms": (ordered[-1] / 1e6) if ordered else 0.0,
+                "count": len(ordered),
+            }
+        self._summary = out
+        self._summary_frame = self.frames
+        return out
+
+    def overlay_lines(self):
+        """疊加層顯示用的文字行"""
+        summary = self.summary()
+        lines = [f"{'阶段':<12}{'p50':>7}{'p95':>7}{'p99':>7} ms"]
+        for name, label in FRAME_PHASES + (("frame", "整帧"),):
+            s = summary[name]
+            lines.append(f"{label:<12}{s['p50_ms']:>7.2f}{s['p95_ms']:>7.2f}{s['p99_ms']:>7.2f}")
+        return lines
+
+    def dump(self, path, **meta):
+        """把分位數和原始樣本寫入 JSON"""
+        self._summary = None
+        data = {
+            "frames": self.frames,
+            "meta": meta,
+            "summary": self.summary(),
+            "samples_ns": {name: list(values) for name, values in self.samples.items()},
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        return path
+
+
+class StartupTimer:
+    """啟動階段計時（--profile-startup），輸出格式仿照 -X importtime：自身耗時 | 累計耗時 | 階段"""
+
+    def __init__(self, t0=None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.marks = []
+
+    def mark(self, label, at=None):
+        self.marks.append((label, time.perf_counter() if at is None else at))
+
+    def report(self, out=None):
+        out = out or sys.stderr
+        print("startup: self [us] | cumulative | phase", file=out)
+        prev = self.t0
+        for label, at in self.marks:
+            print(f"startup: {int((at - prev) * 1e6):>9} | {int((at - self.t0) * 1e6):>10} | {label}", file=out)
+            prev = at
@@ -0,0 +1,58 @@
+"""養成數值表：import 時把 config 的曲線和星級/稀有度加成編譯成平坦的查表陣列。
+
+BASE_STAT_TABLE[稀有度][等級][星級] = (稀有度倍率, 等級倍率, 等級速度加成, 星級HP倍率, 星級ATK倍率, 星級速度倍率)
+Card.stats() 只做一次查表，運算順序與逐項計算時相同，結果逐位一致。
+"""
+import math
+
+from config import LEVEL_CURVE, LEVEL_EXP
+
+RARITY_STAT_MULT = {"C": 1.0, "R": 1.1, "SR": 1.25, "SSR": 1.45}
+
+# 星级加成
+STAR_BONUSES = [
+    {"stars": 1, "hp_mult": 1.0, "atk_mult": 1.0, "speed_mult": 1.0, "cost": 100},
+    {"stars": 2, "hp_mult": 1.1, "atk_mult": 1.1, "speed_mult": 1.05, "cost": 200},
+    {"stars": 3, "hp_mult": 1.2, "atk_mult": 1.2, "speed_mult": 1.1, "cost": 300},
+    {"stars": 4, "hp_mult": 1.35, "atk_mult": 1.35, "speed_mult": 1.15, "cost": 500},
+    {"stars": 5, "hp_mult": 1.5, "atk_mult": 1.5, "speed_mult": 1.2, "cost": 800},
+    {"stars": 6, "hp_mult": 1.7, "atk_mult": 1.7, "speed_mult": 1.25, "cost": 1200},
+]
+
+SPEED_PER_LEVEL = 0.05
+SPEED_LEVEL_CAP = 2.0
+
+# 表覆蓋到曲線的最高等級和等級速度加成封頂的等級，更高等級的結果與最後一行相同
+MAX_LEVEL = max(max(LEVEL_CURVE), math.ceil(SPEED_LEVEL_CAP / SPEED_PER_LEVEL) + 1)
+MAX_STARS = len(STAR_BONUSES)
+
+
+def _compile_rarity(rarity_mult):
+    top_curve = LEVEL_CURVE[max(LEVEL_CURVE)]
+    stars = []
+    for s in range(MAX_STARS + 1):
+        b = STAR_BONUSES[min(max(s, 1), MAX_STARS) - 1]
+        stars.append((b["hp_mult"], b["atk_mult"], b["speed_mult"]))
+    table = []
+    for level in range(MAX_LEVEL + 1):
+        head = (rarity_mult, LEVEL_CURVE.get(level, top_curve), min(SPEED_LEVEL_CAP, (level - 1) * SPEED_PER_LEVEL))
+        table.append([head + s for s in stars])
+    return table
+
+
+# 未知稀有度按倍率 1.0（鍵 None）
+BASE_STAT_TABLE = {r: _compile_rarity(m) for r, m in RARITY_STAT_MULT.items()}
+BASE_STAT_TABLE[None] = _compile_rarity(1.0)
+
+# LEVEL_EXP_TABLE[等級] = 升到下一級所需經驗（表外為 0）
+LEVEL_EXP_TABLE = [LEVEL_EXP.get(level, 0) for level in range(max(LEVEL_EXP, default=0) + 1)]
+
+
+def base_stat_row(rarity, level, stars):
+    """(稀有度倍率, 等級倍率, 等級速度加成, 星級HP倍率, 星級ATK倍率, 星級速度倍率)；等級不會小於 1"""
+    table = BASE_STAT_TABLE.get(rarity) or BASE_STAT_TABLE[None]
+    return table[min(level, MAX_LEVEL)][min(max(stars, 0), MAX_STARS)]
+
+
+def exp_for_level(level):
+    return LEVEL_EXP_TABLE[level] if 0 <= level < len(LEVEL_EXP_TABLE) else 0
@@ -0,0 +1,139 @@
+"""箭矢池：弓兵普攻和連射技能的飛行道具。
+
+所有箭矢放在預先分配的陣列裡（struct-of-arrays：x、y、vx、vy、剩餘飛行時間各一個 array('d')，
+命中所需的來源/目標/傷害參數放在平行的 list 裡），每幀一次 update 在一個循環裡推進全部箭矢，
+不為每支箭創建物件。存活的箭矢緊湊排列在 [0, count)，落地的用最後一支填補（交換刪除）。
+
+箭矢瞄準發射時目標所在的位置，到達後用戰鬥的 SpatialHash 查詢落點：
+原目標仍在 HIT_RADIUS 內則命中它，否則命中落點附近最近的同隊單位，都沒有則落空。
+命中與其他傷害一樣登記到 DamagePipeline，在幀末統一結算。
+"""
+import math
+from array import array
+
+ARROW_SPEED = 900.0  # 像素/秒
+HIT_RADIUS = 40.0
+TRAIL_SECONDS = 0.02  # 繪製時箭桿長度（按速度折算）
+
+# 命中時的附加效果
+EFFECT_SLOW = "slow"  # 連射技能：減速 40%，持續 1.5 秒
+
+
+class ProjectilePool:
+    def __init__(self, capacity=1024):
+        self.capacity = 0
+        self.count = 0
+        self.x = array("d")
+        self.y = array("d")
+        self.vx = array("d")
+        self.vy = array("d")
+        self.ttl = array("d")
+        self.source = []
+        self.target = []
+        self.base = []
+        self.multiplier = []
+        self.crit = []
+        self.kind = []
+        self.effect = []
+        self.fired = 0
+        self.hits = 0
+        self.misses = 0
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        zeros = array("d", bytes(8 * extra))
+        for arr in (self.x, self.y, self.vx, self.vy, self.ttl):
+            arr.extend(zeros)
+        for lst in (self.source, self.target, self.base, self.multiplier, self.crit, self.kind, self.effect):
+            lst.extend([None] * extra)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        for lst in (self.source, self.target):
+            for i in range(self.count):
+                lst[i] = None
+        self.count = 0
+
+    def fire(self, source, target, base, multiplier, crit, kind, effect=None, speed=ARROW_SPEED):
+        """從 source 射向 target 當前位置；返回箭矢下標"""
+        if self.count == self.capacity:
+            self._grow(self.capacity * 2)
+        i = self.count
+        self.count += 1
+        x0, y0 = source.pos
+        dx = target.pos[0] - x0
+        dy = target.pos[1] - y0
+        dist = math.hypot(dx, dy)
+        self.x[i] = x0
+        self.y[i] = y0
+        if dist > 0:
+            self.vx[i] = dx / dist * speed
+            self.vy[i] = dy / dist * speed
+        else:
+            self.vx[i] = self.vy[i] = 0.0
+        self.ttl[i] = dist / speed
+        self.source[i] = source
+        self.target[i] = target
+        self.base[i] = base
+        self.multiplier[i] = multiplier
+        self.crit[i] = crit
+        self.kind[i] = kind
+        self.effect[i] = effect
+        self.fired += 1
+        return i
+
+    def _remove(self, i):
+        last = self.count - 1
+        if i != last:
+            for arr in (self.x, self.y, self.vx, self.vy, self.ttl, self.source, self.target,
+                        self.base, self.multiplier, self.crit, self.kind, self.effect):
+                arr[i] = arr[last]
+        self.source[last] = None
+        self.target[last] = None
+        self.count = last
+
+    def update(self, dt, grid, combat):
+        """推進全部箭矢 dt 秒，到達的在 grid 上查詢落點並把命中登記到 combat"""
+        x, y, vx, vy, ttl = self.x, self.y, self.vx, self.vy, self.ttl
+        # 倒序遍歷：交換刪除搬來的是已經處理過的箭矢
+        for i in range(self.count - 1, -1, -1):
+            t = ttl[i]
+            if t > dt:
+                x[i] += vx[i] * dt
+                y[i] += vy[i] * dt
+                ttl[i] = t - dt
+                continue
+            x[i] += vx[i] * t
+            y[i] += vy[i] * t
+            self._land(i, grid, combat)
+            self._remove(i)
+
+    def _land(self, i, grid, combat):
+        px, py = self.x[i], self.y[i]
+        target = self.target[i]
+        hit = None
+        if target.hp > 0:
+            dx = target.pos[0] - px
+            dy = target.pos[1] - py
+            if dx * dx + dy * dy <= HIT_RADIUS * HIT_RADIUS:
+                hit = target
+        if hit is None:
+            hit = grid.nearest(px, py, HIT_RADIUS, team=target.team)
+        if hit is None:
+            self.misses += 1
+            return
+        self.hits += 1
+        combat.hit(self.source[i], hit, self.base[i], self.multiplier[i], self.crit[i], self.kind[i])
+        if self.effect[i] == EFFECT_SLOW:
+            hit.slow_factor = 0.6
+            hit.speed_recover_time = 1.5
+
+    def segments(self):
+        """繪製用：[(箭頭x, 箭頭y, 箭尾x, 箭尾y, 發射方隊伍)]"""
+        x, y, vx, vy, source = self.x, self.y, self.vx, self.vy, self.source
+        k = TRAIL_SECONDS
+        return [(x[i], y[i], x[i] - vx[i] * k, y[i] - vy[i] * k, source[i].team) for i in range(self.count)]
@@ -0,0 +1,153 @@
+"""武將名冊：保持 list 的用法（迭代、len、下標、切片、append），同時增量維護二級索引。
+
+索引：id、武將名、兵種、稀有度，以及按戰力排序的陣列（bisect 維護）。
+名字/兵種/稀有度在卡牌創建後不變；等級、星級、裝備變化會改變戰力，修改卡牌後調用 update(card)。
+戰力索引在第一次按戰力查詢時才建立（讀檔時不必為每張卡計算屬性），之後增量維護。
+version 在每次增刪/update 後遞增，供外部快取判斷名冊是否變化。
+"""
+import bisect
+
+
+class Roster:
+    def __init__(self, cards=(), power=None):
+        self.power = power or (lambda card: card.power())
+        self._items = []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_type = {}
+        self._by_rarity = {}
+        self._power_of = {}  # id -> 建索引時的戰力
+        self._power_keys = None  # 升序 [(戰力, id)]，None 表示尚未建立
+        self.version = 0
+        self.extend(cards)
+
+    # --- list 兼容 ---
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __contains__(self, card):
+        return self._by_id.get(card.id) is card
+
+    def __repr__(self):
+        return f"Roster({self._items!r})"
+
+    def append(self, card):
+        if card.id in self._by_id:
+            raise ValueError(f"duplicate card id: {card.id}")
+        self._items.append(card)
+        self._by_id[card.id] = card
+        self._by_name.setdefault(card.name, {})[card.id] = card
+        self._by_type.setdefault(card.unit_type, {})[card.id] = card
+        self._by_rarity.setdefault(card.rarity, {})[card.id] = card
+        self.version += 1
+        if self._power_keys is not None:
+            self._index_power(card)
+
+    def extend(self, cards):
+        for card in cards:
+            self.append(card)
+
+    def remove(self, card):
+        cid = card.id
+        if self._by_id.pop(cid, None) is None:
+            raise ValueError(f"card not in roster: {cid}")
+        self._items.remove(card)
+        for index, key in ((self._by_name, card.name), (self._by_type, card.unit_type), (self._by_rarity, card.rarity)):
+            bucket = index[key]
+            del bucket[cid]
+            if not bucket:
+                del index[key]
+        self.version += 1
+        if self._power_keys is not None:
+            self._unindex_power(cid)
+
+    # --- 增量更新 ---
+    def _index_power(self, card):
+        p = self.power(card)
+        self._power_of[card.id] = p
+        bisect.insort(self._power_keys, (p, card.id))
+
+    def _unindex_power(self, cid):
+        p = self._power_of.pop(cid)
+        i = bisect.bisect_left(self._power_keys, (p, cid))
+        del self._power_keys[i]
+
+    def _power_index(self):
+        if self._power_keys is None:
+            self._power_of = {c.id: self.power(c) for c in self._items}
+            self._power_keys = sorted((p, cid) for cid, p in self._power_of.items())
+        return self._power_keys
+
+    def update(self, card):
+        """卡牌等級/星級/裝備變化後重新計算戰力位置"""
+        if card.id not in self._by_id:
+            return
+        self.version += 1
+        if self._power_keys is None:
+            return
+        self._unindex_power(card.id)
+        self._index_power(card)
+
+    # --- 查詢 ---
+    def get(self, cid, default=None):
+        return self._by_id.get(cid, default)
+
+    def by_id(self):
+        """id -> 卡牌（內部索引，調用方不得修改）"""
+        return self._by_id
+
+    def named(self, name):
+        """同名的第一張卡牌（沒有時返回 None）"""
+        bucket = self._by_name.get(name)
+        return next(iter(bucket.values())) if bucket else None
+
+    def power_of(self, card):
+        self._power_index()
+        return self._power_of[card.id]
+
+    def filter(self, rarity=None, unit_type=None, name=None, predicate=None):
+        """按條件篩選，先從最小的索引桶開始；結果保持加入順序"""
+        buckets = []
+        for index, key in ((self._by_rarity, rarity), (self._by_type, unit_type), (self._by_name, name)):
+            if key is not None:
+                buckets.append(index.get(key, {}))
+        if not buckets:
+            candidates = self._items
+        else:
+            buckets.sort(key=len)
+            smallest, rest = buckets[0], buckets[1:]
+            # 各索引桶都按加入順序插入，遍歷順序與名冊一致
+            candidates = [c for c in smallest.values() if all(c.id in b for b in rest)]
+        if predicate is not None:
+            candidates = [c for c in candidates if predicate(c)]
+        return list(candidates)
+
+    def sort(self, key="power", reverse=True, **filters):
+        """排序後的列表；key 為 "power" 時直接使用戰力索引"""
+        if key == "power":
+            ordered = self.top(len(self._items), **filters)
+            return ordered if reverse else ordered[::-1]
+        return sorted(self.filter(**filters), key=key, reverse=reverse)
+
+    def top(self, k, rarity=None, unit_type=None, predicate=None):
+        """戰力最高的 k 張卡牌（從戰力索引高端往下走，滿足條件的取前 k 個）"""
+        out = []
+        by_id = self._by_id
+        for _, cid in reversed(self._power_index()):
+            if len(out) >= k:
+                break
+            c = by_id[cid]
+            if rarity is not None and c.rarity != rarity:
+                continue
+            if unit_type is not None and c.unit_type != unit_type:
+                continue
+            if predicate is not None and not predicate(c):
+                continue
+            out.append(c)
+        return out
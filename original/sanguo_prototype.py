@@ -1,14 +1,35 @@
+import time
+_MODULE_T0 = time.perf_counter()  # --profile-startup 的起点
 import tkinter as tk
 from tkinter import Canvas, messagebox
 import random
 import math
-import time
 import os
+import sys
 import json
 import uuid
+import bisect
+import functools
+import itertools
+from collections import deque, namedtuple
 
 # progression curves
-from config import LEVEL_CURVE, STAR_COST, LEVEL_EXP, LEVEL_UP_GOLD_COST
+from config import STAR_COST, LEVEL_UP_GOLD_COST
+from catalog import load_catalog, chapter_config
+from progression import STAR_BONUSES, base_stat_row, exp_for_level
+from spatial import SpatialHash
+from modifiers import StatBlock, stat_property
+from profiler import FrameProfiler, StartupTimer
+from listview import CardList, VirtualList
+from roster import Roster
+from sprites import SpriteCache
+from lod import DetailPolicy, merge_damage_texts
+from scheduler import FPS_CAPS, SIM_DT, FrameScheduler, SimClock
+from projectiles import EFFECT_SLOW, ProjectilePool
+from formation import formation_slots, separate
+from pathing import PASSABLE, nav_grid
+from camera import CULL_MARGIN, PAN_STEP, Camera, Minimap
+from combat import DamagePipeline, hit_damage, HIT_ATTACK, HIT_SKILL, HIT_SIEGE, HIT_BOSS
 
 # 顏色 - 美麗的手繪風格配色
 WHITE = "#FFFFFF"
@@ -36,6 +57,12 @@ ARENa_PLAYER_MIN_Y = 300  # 玩家隊伍下方區域
 ARENa_PLAYER_MAX_Y = 540
 ARENa_ENEMY_MIN_Y = 65
 ARENa_ENEMY_MAX_Y = 300   # 敵人隊伍上方區域
+ARENA_BOUNDS = (ARENa_MIN_X, ARENa_MAX_X, ARENa_MIN_Y, ARENa_MAX_Y)
+
+
+def arena_bounds(width, height):
+    """按戰場世界尺寸算出單位活動範圍 (min_x, max_x, min_y, max_y)；1000x600 時即 ARENA_BOUNDS"""
+    return ARENa_MIN_X, width - (1000 - ARENa_MAX_X), ARENa_MIN_Y, height - (600 - ARENa_MAX_Y)
 
 # 兵種：0=槍, 1=騎, 2=弓
 # 攻击范围：枪兵60、骑兵50、弓兵120
@@ -50,21 +77,40 @@ def get_multiplier(attacker, defender):
         return 1.2
     return 1.0
 
+# 地形障碍的颜色
+OBSTACLE_COLORS = {"river": "#1F4E79", "wall": "#6D4C41", "gate": "#A1887F"}
+
+# 普攻射出箭矢（有飞行时间）的兵种：弓
+RANGED_TYPES = {2}
+
 def get_attack_range(unit_type):
     """获取兵种的攻击范围"""
     return UNIT_ATTACK_RANGES.get(unit_type, 60)
 
+# 兵种图标（sprites.ICON_MASKS 的點陣）：枪、骑、弓
+UNIT_SPRITE_ICONS = {0: "spear", 1: "horse", 2: "bow"}
+
+
 class Unit:
-    def __init__(self, name, x, y, team, unit_type, hp=100, atk=20, speed=3, siege_atk=None):
+    # 可被Buff/诅咒/商店道具修正的属性：读取有效值，赋值修改基础值（见 modifiers.py）
+    atk = stat_property("atk")
+    speed = stat_property("speed")
+    siege_atk = stat_property("siege_atk")
+    cooldown_mult = stat_property("cooldown_mult")  # 技能冷却倍数
+    crit_chance = stat_property("crit_chance")  # 暴击率（暴击伤害x1.5）
+    damage_reduction = stat_property("damage_reduction")  # 受伤减免，负数为易伤
+    lifesteal = stat_property("lifesteal")  # 普攻伤害按比例回复我方城堡
+
+    def __init__(self, name, x, y, team, unit_type, hp=100, atk=20, speed=3, siege_atk=None, hero=None):
         self.name = name
         self.pos = [x, y]
         self.team = team  # 0=玩家, 1=敵人
         self.type = unit_type
         self.hp = hp
         self.max_hp = hp
-        self.atk = atk
-        self.speed = speed
-        self.siege_atk = siege_atk if siege_atk is not None else atk  # 攻城傷害 (預設等於普通攻擊)
+        self.stats = StatBlock(atk=atk, speed=speed,
+                               siege_atk=siege_atk if siege_atk is not None else atk,  # 攻城傷害 (預設等於普通攻擊)
+                               cooldown_mult=1.0, crit_chance=0.0, damage_reduction=0.0, lifesteal=0.0)
         self.target_pos = None
         self.target_enemy = None
         self.selected = False
@@ -78,9 +124,11 @@ class Unit:
         self.skill = UNIT_SKILLS.get(unit_type, {}).copy() if unit_type in UNIT_SKILLS else {}
         self.skill_cooldown = 0.0  # 当前冷却时间
         self.skill_ready = True
+        self.hold_skill = False  # 自动战斗AI暂缓释放技能
+        self.hold_siege = False  # 自动战斗AI暂不攻城（城堡留到最后一波再打）
         
-        # 专精系统
-        self.specialization = HERO_SPECIALIZATION.get(name, {})
+        # 专精系统（hero 为武将名；单位名带等级后缀时需显式传入）
+        self.specialization = HERO_SPECIALIZATION.get(hero or name, {})
         self.apply_specialization()
     
     def apply_specialization(self):
@@ -96,8 +144,8 @@ class Unit:
         elif bonus_type == "speed_boost":
             self.speed = self.speed * bonus_value
         elif bonus_type == "crit_rate":
-            # 存储到unit自身，后续在damage计算时使用
-            self.crit_rate = bonus_value
+            # 作为暴击率的基础值，Roguelite暴击Buff在此之上叠加
+            self.crit_chance = bonus_value
         elif bonus_type == "skill_cooldown":
             if self.skill:
                 self.skill["cooldown"] = self.skill.get("cooldown", 4.0) * bonus_value
@@ -136,19 +184,34 @@ class Unit:
         current_speed = self.speed * self.slow_factor
         # 允許自由移動：不論是否有敵人目標，只要有target_pos就移動
         if self.target_pos:
-            dx = self.target_pos[0] - self.pos[0]
-            dy = self.target_pos[1] - self.pos[1]
+            # 有地形时沿流场绕过障碍（直线可达时仍走直线）
+            nav = getattr(game_window, "nav", None)
+            goal = nav.waypoint(self.pos, self.target_pos) if nav is not None else self.target_pos
+        else:
+            goal = None
+        if goal is None:
+            # 目标在障碍里时 waypoint 走到最近处后返回 None，视为到达
+            self.target_pos = None
+        else:
+            dx = goal[0] - self.pos[0]
+            dy = goal[1] - self.pos[1]
             dist = math.hypot(dx, dy)
             if dist > current_speed:
-                self.pos[0] += dx / dist * current_speed
-                self.pos[1] += dy / dist * current_speed
-            else:
+                if nav is None:
+                    self.pos[0] += dx / dist * current_speed
+                    self.pos[1] += dy / dist * current_speed
+                else:
+                    self.move_on(nav, dx / dist * current_speed, dy / dist * current_speed)
+            elif goal is self.target_pos:
                 self.target_pos = None
+            else:
+                self.pos[0], self.pos[1] = goal
         
         # 限制在戰鬥場地內（完全移除隊伍區域限制，雙方可自由移動到全場）
-        # X軸範圍: 30-970, Y軸範圍: 65-540（中線在y=300，完全可以跨越）
-        self.pos[0] = max(ARENa_MIN_X, min(ARENa_MAX_X, self.pos[0]))
-        self.pos[1] = max(ARENa_MIN_Y, min(ARENa_MAX_Y, self.pos[1]))
+        # 1000x600 的戰場上 X軸範圍: 30-970, Y軸範圍: 65-540（中線在y=300，完全可以跨越）
+        min_x, max_x, min_y, max_y = getattr(game_window, "bounds", ARENA_BOUNDS)
+        self.pos[0] = max(min_x, min(max_x, self.pos[0]))
+        self.pos[1] = max(min_y, min(max_y, self.pos[1]))
         # 找敵人（只在未指定攻擊目標時自動選擇）
         if not self.target_enemy or self.target_enemy.hp <= 0:
             # 所有單位都自動選擇最近的敵人
@@ -175,45 +238,53 @@ class Unit:
             attack_range = get_attack_range(self.type)
             
             # 尝试释放技能
-            if self.skill and self.skill_ready and dist < self.skill.get("range", attack_range):
+            if self.skill and self.skill_ready and not self.hold_skill and dist < self.skill.get("range", attack_range):
                 self.activate_skill(self.target_enemy, units, game_window)
                 return 0
             
             # 普通攻击（在攻击范围内）
             if dist < attack_range:
                 multiplier = get_multiplier(self.type, self.target_enemy.type)
-                damage = self.atk * multiplier
-                
-                # 应用英雄暴击率（黄忠专精）
-                if hasattr(self, 'crit_rate') and random.random() < self.crit_rate:
-                    damage *= 1.5
-                
-                # 应用玩家方Roguelite效果
-                if self.team == 0 and game_window:
-                    # 暴击判定
-                    if random.random() < game_window.crit_chance:
-                        damage *= 1.5
-                    # 生命偷取
-                    if game_window.lifesteal_rate > 0 and hasattr(game_window, 'player_castle'):
-                        heal_amount = damage * game_window.lifesteal_rate
-                        game_window.player_castle.hp = min(game_window.player_castle.max_hp, 
-                                                         game_window.player_castle.hp + heal_amount)
-                
-                # 应用目标方伤害减免
-                if self.target_enemy.team == 0 and game_window:
-                    if game_window.damage_reduction > 0:
-                        damage *= (1 - game_window.damage_reduction)
-                
-                self.target_enemy.hp -= damage
-                
-                # 显示类型优势反馈（SanZhenZhi 风格）
-                if game_window:
-                    if multiplier > 1.0:
-                        game_window.damage_texts.append((self.target_enemy.pos[:], "⭐克制!", 60))
-                    elif multiplier < 1.0:
-                        game_window.damage_texts.append((self.target_enemy.pos[:], "✗劣势", 60))
-                return int(damage)
+                # 暴击判定（黄忠专精和Roguelite暴击Buff已合并在 crit_chance 中）
+                crit_chance = self.crit_chance
+                crit = crit_chance > 0 and random.random() < crit_chance
+                # 减伤、吸血和克制反馈在 DamagePipeline 结算时统一处理
+                if self.type in RANGED_TYPES:
+                    return self.shoot(game_window, self.target_enemy, self.atk, multiplier, crit, HIT_ATTACK)
+                return self.deal_damage(game_window, self.target_enemy, self.atk, multiplier, crit, HIT_ATTACK)
         return 0
+
+    def move_on(self, nav, dx, dy):
+        """在地形上移动一步：撞到障碍时沿障碍滑动，完全走不动时放弃移动目标"""
+        x, y = self.pos
+        escaping = not nav.passable(x, y)  # 被推进障碍里时允许走出来
+        for mx, my in ((dx, dy), (dx, 0.0), (0.0, dy)):
+            if (mx or my) and (escaping or nav.passable(x + mx, y + my)):
+                self.pos[0] = x + mx
+                self.pos[1] = y + my
+                return
+        self.target_pos = None
+
+    def deal_damage(self, game_window, target, base, multiplier=1.0, crit=False, kind=HIT_ATTACK):
+        """登记一次命中到本帧的伤害批次；没有战斗实例时立即结算。返回预估伤害"""
+        if game_window:
+            game_window.combat.hit(self, target, base, multiplier, crit, kind)
+            return int(hit_damage(base, multiplier, crit, getattr(target, "damage_reduction", 0.0)))
+        damage = hit_damage(base, multiplier, crit, getattr(target, "damage_reduction", 0.0))
+        target.hp -= damage
+        return int(damage)
+    
+    def shoot(self, game_window, target, base, multiplier=1.0, crit=False, kind=HIT_ATTACK, effect=None):
+        """射出一支箭，落地时才登记命中；没有箭矢池时立即命中。返回预估伤害"""
+        projectiles = getattr(game_window, "projectiles", None)
+        if projectiles is None:
+            damage = self.deal_damage(game_window, target, base, multiplier, crit, kind)
+            if effect == EFFECT_SLOW:
+                target.slow_factor = 0.6
+                target.speed_recover_time = 1.5
+            return damage
+        projectiles.fire(self, target, base, multiplier, crit, kind, effect)
+        return int(hit_damage(base, multiplier, crit, getattr(target, "damage_reduction", 0.0)))
     
     def activate_skill(self, target, units, game_window):
         """激活单位技能"""
@@ -221,76 +292,57 @@ class Unit:
             return
         
         skill = self.skill
-        damage = self.atk * skill.get("damage_mult", 1.5) * get_multiplier(self.type, target.type)
-        
-        # 应用技能伤害加成（黄月英专精）
-        if hasattr(self, 'specialization') and self.specialization.get("bonus") == "skill_damage":
-            # 伤害已经在apply_specialization中应用到skill["damage_mult"]
-            pass
+        # 黄月英专精的技能伤害加成已在apply_specialization中应用到skill["damage_mult"]
+        damage_mult = skill.get("damage_mult", 1.5)
         
         effect = skill.get("effect")
         
         if effect == "pierce":  # 槍兵：贯穿突刺 - 有概率击晕
-            target.hp -= damage
+            self.deal_damage(game_window, target, self.atk * damage_mult, get_multiplier(self.type, target.type),
+                             kind=HIT_SKILL)
             # 击晕效果 (25%概率，持续1秒)
             if random.random() < 0.25:
                 target.stunned = True
                 target.speed_recover_time = 1.0
                 if game_window:
                     game_window.damage_texts.append((target.pos[:], "击晕!", 60))
-            if game_window:
-                game_window.damage_texts.append((target.pos[:], int(damage), 30))
-                game_window.particles.append(Particle(target.pos[0], target.pos[1], YELLOW, life=1.0, vx=0, vy=-40))
         
         elif effect == "charge":  # 騎兵：冲锋突击 - 减速目标，自身恢复
-            target.hp -= damage
+            self.deal_damage(game_window, target, self.atk * damage_mult, get_multiplier(self.type, target.type),
+                             kind=HIT_SKILL)
             # 减速目标50% (持续2秒)
             target.slow_factor = 0.5
             target.speed_recover_time = 2.0
             # 自身恢复25% HP
             self.hp = min(self.max_hp, self.hp + self.max_hp * 0.25)
-            if game_window:
-                game_window.damage_texts.append((target.pos[:], int(damage), 30))
-                game_window.particles.append(Particle(target.pos[0], target.pos[1], WHITE, life=1.0, vx=0, vy=-40))
         
         elif effect == "volley":  # 弓兵：连射覆盖 - 多目标减速
-            # 命中范围内的多个敌人
+            # 命中范围内的多个敌人（倍率按主目标计算，每支箭伤害降低为80%）
             arrow_count = skill.get("arrow_count", 3)
+            multiplier = get_multiplier(self.type, target.type) * 0.8
             nearby_enemies = [u for u in units if u.team != self.team and u.hp > 0 
                              and math.dist(u.pos, target.pos) < skill.get("range", 100)]
-            for i, enemy in enumerate(nearby_enemies[:arrow_count]):
-                arrow_damage = damage * 0.8  # 每支箭伤害降低
-                enemy.hp -= arrow_damage
-                # 减速效果 (40%减速，持续1.5秒)
-                enemy.slow_factor = 0.6
-                enemy.speed_recover_time = 1.5
-                if game_window:
-                    game_window.damage_texts.append((enemy.pos[:], int(arrow_damage), 30))
-                    game_window.particles.append(Particle(enemy.pos[0], enemy.pos[1], CYAN, life=1.0, vx=0, vy=-40))
+            for enemy in nearby_enemies[:arrow_count]:
+                # 每个目标一支箭，命中时减速 (40%减速，持续1.5秒)
+                self.shoot(game_window, enemy, self.atk * damage_mult, multiplier, kind=HIT_SKILL, effect=EFFECT_SLOW)
         
         # 启动技能冷却
         cooldown = skill.get("cooldown", 4.0)
         # 应用关羽冷却减免
         if hasattr(self, 'specialization') and self.specialization.get("bonus") == "skill_cooldown":
             cooldown = cooldown * self.specialization.get("value", 0.8)
+        cooldown *= self.cooldown_mult
         
         self.skill_cooldown = cooldown
         self.skill_ready = False
 
-    def draw(self, canvas):
+    def draw(self, canvas, detail=None):
+        """detail 為 lod.Detail，None 表示全部繪製"""
         color = BLUE if self.team == 0 else RED
-        # 畫單位
-        canvas.create_oval(
-            int(self.pos[0])-25, int(self.pos[1])-25,
-            int(self.pos[0])+25, int(self.pos[1])+25,
-            fill=color, outline=WHITE, width=2
-        )
-        
-        # 兵种图标
-        unit_icons = {0: "🔱", 1: "🐎", 2: "🏹"}  # 枪、骑、弓
-        icon = unit_icons.get(self.type, "⚔")
-        canvas.create_text(self.pos[0], self.pos[1], text=icon, 
-                          fill=WHITE, font=("Arial", 16))
+        # 單位圓盤 + 兵种图标 + 選中框：預渲染的精靈，一個圖片項目
+        icon = UNIT_SPRITE_ICONS.get(self.type, "sword")
+        canvas.create_image(int(self.pos[0]), int(self.pos[1]),
+                            image=SpriteCache.of(canvas).unit(color, icon, self.selected))
         
         # 血條背景
         canvas.create_rectangle(
@@ -306,12 +358,15 @@ class Unit:
             fill=GREEN, outline=GREEN
         )
         # 名稱
-        canvas.create_text(self.pos[0], self.pos[1]+40, text=self.name, fill=WHITE, font=("Arial", 9))
+        if detail is None or detail.names or self.selected:
+            canvas.create_text(self.pos[0], self.pos[1]+40, text=self.name, fill=WHITE, font=("Arial", 9))
         
         # 状态指示器
         status_text = ""
         status_color = WHITE
-        if self.stunned:
+        if detail is not None and not detail.status:
+            pass  # LOD 省略
+        elif self.stunned:
             status_text = "💫击晕"
             status_color = YELLOW
         elif self.slow_factor < 1.0:
@@ -322,7 +377,9 @@ class Unit:
             canvas.create_text(self.pos[0], self.pos[1]+52, text=status_text, fill=status_color, font=("Arial", 8))
         
         # 技能冷却指示
-        if self.skill and not self.skill_ready:
+        if detail is not None and not detail.cooldown:
+            pass  # LOD 省略
+        elif self.skill and not self.skill_ready:
             cooldown_pct = self.skill_cooldown / self.skill.get("cooldown", 4.0)
             cooldown_width = 50 * (1 - cooldown_pct)  # 从满到空
             # 冷却条（在血条下方）
@@ -343,48 +400,39 @@ class Unit:
                 self.pos[0]+25, self.pos[1]-24,
                 fill="#00FF00", outline="#00FF00", width=1
             )
-        
-        # 選中框
-        if self.selected:
-            canvas.create_oval(
-                int(self.pos[0])-30, int(self.pos[1])-30,
-                int(self.pos[0])+30, int(self.pos[1])+30,
-                outline=YELLOW, width=3
-            )
 
 class Castle:
-    def __init__(self, x, y, team, is_boss=False):
+    def __init__(self, x, y, team, is_boss=False, boss_config=None):
         self.pos = [x, y]
         self.team = team
         self.hp = 500
         self.max_hp = 500
         self.is_boss = is_boss
-        self.boss_phase = 1  # Boss所在阶段 (1-3)
-        self.boss_phase_hp = [500, 350, 200] if is_boss else [500]  # 各阶段HP上限
+        self.boss_config = boss_config
+        self.boss_phase = 1  # Boss所在阶段
+        self.boss_phase_hp = list(boss_config['phase_hp']) if boss_config else [500]  # 各阶段HP
+        # 进入下一阶段的剩余HP阈值（降序），例如 [500,500,500] -> [1000, 500]
+        self.phase_thresholds = []
         
         if is_boss:
-            self.hp = 1500  # Boss总HP为三个阶段之和
-            self.max_hp = 1500
+            self.hp = sum(self.boss_phase_hp)  # Boss总HP为各阶段之和
+            self.max_hp = self.hp
+            remaining = self.hp
+            for phase_hp in self.boss_phase_hp[:-1]:
+                remaining -= phase_hp
+                self.phase_thresholds.append(remaining)
 
     def draw(self, canvas):
         # 颜色和标识
         if self.is_boss:
             color = "#9B59B6"  # Boss紫色
-            icon = "👑"
+            icon = "crown"  # 👑
         else:
             color = GREEN if self.team == 0 else RED
-            icon = "🏰"
+            icon = "castle"  # 🏰
         
-        # 城堡主体
-        canvas.create_rectangle(
-            self.pos[0]-60, self.pos[1]-40,
-            self.pos[0]+60, self.pos[1]+40,
-            fill=color, outline=DARK_GOLD, width=3
-        )
-        
-        # 城堡图标
-        canvas.create_text(self.pos[0], self.pos[1], text=icon, 
-                          fill=WHITE, font=("Arial", 24))
+        # 城堡主体 + 图标（預渲染的精靈）
+        canvas.create_image(int(self.pos[0]), int(self.pos[1]), image=SpriteCache.of(canvas).castle(color, icon))
         
         # 血條背景
         canvas.create_rectangle(
@@ -411,27 +459,81 @@ class Castle:
                               fill=CYAN if self.team == 0 else ACCENT, font=("Arial", 11, "bold"))
     
     def update_boss_phase(self):
-        """更新Boss所在阶段"""
+        """更新Boss所在阶段（只会前进，不会回退）"""
         if not self.is_boss:
             return
         
-        total_hp = 1500
-        if self.hp > 1000:  # 1500-1000
-            self.boss_phase = 1
-        elif self.hp > 500:  # 1000-500
-            if self.boss_phase == 1:
-                self.boss_phase = 2
-                self.trigger_phase_transition()
-        else:  # 500-0
-            if self.boss_phase == 2:
-                self.boss_phase = 3
-                self.trigger_phase_transition()
+        phase = 1
+        for threshold in self.phase_thresholds:
+            if self.hp <= threshold:
+                phase += 1
+        while self.boss_phase < phase:
+            self.boss_phase += 1
+            self.trigger_phase_transition()
     
     def trigger_phase_transition(self):
         """触发阶段转换效果"""
         # 可以在这里添加特殊效果，如全屏闪光、特殊攻击等
         pass
 
+class BossAbilityEngine:
+    """Boss技能引擎：技能按阶段预先索引，目标通过城堡周围的空间查询选取"""
+    def __init__(self, castle, config, global_range):
+        self.castle = castle
+        self.config = config
+        # 技能未配置范围时覆盖整个战场（战场对角线长度）
+        self.global_range = global_range
+        self.cooldown = 0.0
+        by_phase = {}
+        for ability in config['abilities']:
+            by_phase.setdefault(ability['phase'], []).append(ability)
+        self.abilities_by_phase = {phase: tuple(abilities) for phase, abilities in by_phase.items()}
+        # 同一阶段有多个技能时轮流释放
+        self.rotation = dict.fromkeys(self.abilities_by_phase, 0)
+
+    def select_targets(self, ability, grid):
+        """返回 [(目标, 伤害倍率)]"""
+        x, y = self.castle.pos
+        radius = ability.get('range') or self.global_range
+        candidates = grid.query(x, y, radius, team=0)
+        effect = ability['effect']
+        if effect == 'aoe':
+            # 范围攻击：范围内所有玩家单位
+            return [(u, 1.0) for u in candidates]
+        if effect == 'execute':
+            # 斩杀：对低血量单位伤害翻倍
+            threshold = ability.get('threshold', 0.3)
+            return [(u, 2.0) for u in candidates if u.hp / u.max_hp < threshold]
+        # 普通单体攻击
+        if candidates:
+            return [(random.choice(candidates), 1.0)]
+        return []
+
+    def update(self, dt, grid, game_window):
+        castle = self.castle
+        if castle.hp <= 0:
+            return
+        castle.update_boss_phase()
+        self.cooldown -= dt
+        if self.cooldown > 0:
+            return
+
+        phase = castle.boss_phase
+        abilities = self.abilities_by_phase.get(phase)
+        if not abilities:
+            return
+        ability = abilities[self.rotation[phase] % len(abilities)]
+        targets = self.select_targets(ability, grid)
+        if not targets:
+            # 没有目标时不进入冷却，等目标进入范围
+            return
+        self.rotation[phase] += 1
+
+        ability_damage = self.config['base_atk'] * ability.get('damage', 1.0)
+        for u, mult in targets:
+            game_window.combat.hit(castle, u, ability_damage, mult, kind=HIT_BOSS)
+        self.cooldown = ability.get('cooldown', 3.0)
+
 # --- New: Meta, Card and Player Data ---
 
 RARITY_ORDER = ["C", "R", "SR", "SSR"]
@@ -454,85 +556,29 @@ HERO_POOL = [
 RARITY_WEIGHTS = [("SSR", 1), ("SR", 9), ("R", 30), ("C", 60)]
 
 # --- 关卡系统 ---
-CHAPTER_CONFIGS = [
-    {"chapter": 1, "name": "初出茅庐", "waves": 8, "base_hp": 80, "base_atk": 15, "level": 1, "has_boss": False},
-    {"chapter": 2, "name": "崭露头角", "waves": 9, "base_hp": 120, "base_atk": 20, "level": 5, "has_boss": False},
-    {"chapter": 3, "name": "中原逐鹿", "waves": 10, "base_hp": 160, "base_atk": 26, "level": 10, "has_boss": True},
-]
+# 关卡、Boss、波间事件和商店数据来自 gamedata/*.json（见 catalog.py）
+CATALOG = load_catalog()
+CHAPTER_CONFIGS = CATALOG["chapters"]
+ENEMY_FORMATIONS = CATALOG["formations"]
+BATTLE_MAPS = CATALOG["maps"]
 
 # --- Boss 系统 ---
-BOSS_CONFIG = {
-    "name": "黄巾贼首",
-    "hp": 1500,  # 三个阶段总HP
-    "phase_hp": [500, 350, 200],  # 每阶段HP
-    "base_atk": 35,
-    "abilities": [
-        {
-            "phase": 1,
-            "name": "普通攻击",
-            "damage": 1.0,
-            "cooldown": 2.0,
-            "effect": "single"  # 单体攻击
-        },
-        {
-            "phase": 2,
-            "name": "旋风斩",
-            "damage": 2.0,
-            "cooldown": 3.0,
-            "effect": "aoe",  # 范围攻击
-            "range": 150
-        },
-        {
-            "phase": 3,
-            "name": "绝命一击",
-            "damage": 3.0,
-            "cooldown": 4.0,
-            "effect": "execute",  # 可能秒杀低血量单位
-            "threshold": 0.3  # 血量低于30%时生效
-        }
-    ]
-}
+BOSS_CONFIGS = CATALOG["bosses"]
+BOSS_CONFIG = BOSS_CONFIGS["yellow_turban"]
 
-WAVE_EVENTS = [
-    {"name": "补给", "desc": "所有单位恢复25% HP", "effect": "heal", "type": "buff", "color": GREEN},
-    {"name": "陷阱", "desc": "敌方下波的攻击降低20%", "effect": "curse", "type": "buff", "color": GREEN},
-    {"name": "增援", "desc": "下波敌人减少1个", "effect": "fewer_enemies", "type": "buff", "color": GREEN},
-    {"name": "暴雨", "desc": "所有单位速度降低30%", "effect": "slow", "type": "curse", "color": RED},
-]
+WAVE_EVENTS = CATALOG["wave_events"]
 
 # Roguelite Buff池
-ROGUELITE_BUFFS = [
-    {"name": "攻速+30%", "desc": "攻击速度提升30%", "effect": "atk_speed", "type": "buff", "color": "#FF6B6B"},
-    {"name": "暴击+25%", "desc": "暴击率提升25%（伤害翻倍）", "effect": "crit", "type": "buff", "color": "#FFD700"},
-    {"name": "移速+40%", "desc": "单位移动速度提升40%", "effect": "move_speed", "type": "buff", "color": "#4169FF"},
-    {"name": "吸血+15%", "desc": "造成伤害时恢复15%血量", "effect": "lifesteal", "type": "buff", "color": "#FF1493"},
-    {"name": "护甲+25%", "desc": "受伤减少25%", "effect": "armor", "type": "buff", "color": "#708090"},
-    {"name": "技能冷却-40%", "desc": "技能冷却时间减少40%", "effect": "cooldown", "type": "buff", "color": "#9370DB"},
-]
+ROGUELITE_BUFFS = CATALOG["buffs"]
 
 # Roguelite 诅咒
-ROGUELITE_CURSES = [
-    {"name": "诅咒：衰弱", "desc": "攻击力降低30%", "effect": "weakness", "type": "curse", "color": "#8B0000"},
-    {"name": "诅咒：迟缓", "desc": "移动速度降低50%", "effect": "curse_slow", "type": "curse", "color": "#4B0082"},
-    {"name": "诅咒：脆弱", "desc": "受伤增加40%", "effect": "curse_fragile", "type": "curse", "color": "#FF4500"},
-]
+ROGUELITE_CURSES = CATALOG["curses"]
 
 # Roguelite 交易选项
-ROGUELITE_TRADE = [
-    {"name": "血契", "desc": "花费100金币，获得2个随机Buff", "effect": "trade_double_buff", "type": "trade", "cost": 100, "color": "#FF1493"},
-    {"name": "商人", "desc": "花费80金币，移除1个诅咒", "effect": "trade_remove_curse", "type": "trade", "cost": 80, "color": "#20B2AA"},
-    {"name": "赌徒", "desc": "花费50金币，随机获得Buff或诅咒", "effect": "trade_gamble", "type": "trade", "cost": 50, "color": "#FFB6C1"},
-]
+ROGUELITE_TRADE = CATALOG["trades"]
 
 # --- 战斗商店系统 ---
-SHOP_ITEMS = [
-    {"name": "迅速恢复药", "desc": "恢复150 HP", "cost": 80, "effect": "heal", "value": 150, "icon": "💊"},
-    {"name": "伤害药剂", "desc": "攻击力+20%", "cost": 120, "effect": "atk_boost", "value": 0.2, "icon": "⚡", "duration": 30},
-    {"name": "防护符", "desc": "伤害减免15%", "cost": 100, "effect": "def_boost", "value": 0.15, "icon": "🛡️", "duration": 30},
-    {"name": "速度靴", "desc": "移动速度+30%", "cost": 110, "effect": "speed_boost", "value": 0.3, "icon": "👢", "duration": 30},
-    {"name": "中等恢复", "desc": "恢复250 HP", "cost": 150, "effect": "heal", "value": 250, "icon": "💊"},
-    {"name": "强力合剂", "desc": "HP+100, ATK+30%", "cost": 200, "effect": "super_potion", "value": 100, "icon": "🔥"},
-]
+SHOP_ITEMS = CATALOG["shop_items"]
 
 # --- 每日任务系统 ---
 DAILY_QUESTS = [
@@ -601,17 +647,11 @@ EQUIPMENT_TYPES = {
     "accessory": {"name": "饰品", "stat": "hp", "rarity_bonus": {"C": 15, "R": 25, "SR": 40, "SSR": 60}},
 }
 
-# 星级加成
-STAR_BONUSES = [
-    {"stars": 1, "hp_mult": 1.0, "atk_mult": 1.0, "speed_mult": 1.0, "cost": 100},
-    {"stars": 2, "hp_mult": 1.1, "atk_mult": 1.1, "speed_mult": 1.05, "cost": 200},
-    {"stars": 3, "hp_mult": 1.2, "atk_mult": 1.2, "speed_mult": 1.1, "cost": 300},
-    {"stars": 4, "hp_mult": 1.35, "atk_mult": 1.35, "speed_mult": 1.15, "cost": 500},
-    {"stars": 5, "hp_mult": 1.5, "atk_mult": 1.5, "speed_mult": 1.2, "cost": 800},
-    {"stars": 6, "hp_mult": 1.7, "atk_mult": 1.7, "speed_mult": 1.25, "cost": 1200},
-]
-
 # --- Item 9: 粒子效果系统 ---
+# 技能命中粒子颜色（按技能效果）
+SKILL_HIT_COLORS = {"pierce": YELLOW, "charge": WHITE, "volley": CYAN}
+
+
 class Particle:
     def __init__(self, x, y, color, life=1.0, vx=0, vy=0):
         self.x = x
@@ -651,6 +691,27 @@ FRIEND_ASSIST_UNITS = [
     {"name": "友军-黃忠", "type": 2, "base_hp": 100, "base_atk": 35, "base_speed": 3},
 ]
 
+
+def friend_unit_stats(friend):
+    """好友助戰單位的 (hp, atk, speed)：FRIEND_ASSIST_UNITS 的 base_* 屬性，缺省時沿用舊的默認值"""
+    return friend.get('base_hp', 400), friend.get('base_atk', 50), friend.get('base_speed', 80)
+
+
+EquipmentData = namedtuple("EquipmentData", "catalog rarity_color by_id by_rarity")
+
+
+@functools.lru_cache(maxsize=None)
+def equipment_data():
+    """首次用到时才导入 data 模块，并建好按 id / (槽位, 稀有度) 的索引"""
+    from data import EQUIPMENT_CATALOG, EQUIPMENT_RARITY_COLOR
+    by_id = {slot: {e["id"]: e for e in items} for slot, items in EQUIPMENT_CATALOG.items()}
+    by_rarity = {}
+    for slot, items in EQUIPMENT_CATALOG.items():
+        for e in items:
+            by_rarity.setdefault((slot, e["rarity"]), []).append(e)
+    return EquipmentData(EQUIPMENT_CATALOG, EQUIPMENT_RARITY_COLOR, by_id, by_rarity)
+
+
 def choose_weighted(options):
     total = sum(w for _, w in options)
     r = random.uniform(0, total)
@@ -662,6 +723,50 @@ def choose_weighted(options):
     return options[-1][0]
 
 
+def equipment_bonus(equipment):
+    """裝備槽 {slot: 裝備id} 的 (HP, ATK, 速度) 平加值；目錄中找不到的 id 不計"""
+    by_id = equipment_data().by_id
+    equip_hp = 0
+    equip_atk = 0
+    equip_speed = 0
+    for slot in ("weapon", "horse", "book"):
+        equip_id = equipment.get(slot)
+        if not equip_id or equip_id == "None" or not isinstance(equip_id, str):
+            continue
+        equip_data = by_id.get(slot, {}).get(equip_id)
+        if equip_data:
+            equip_hp += equip_data.get("hp", 0)
+            equip_atk += equip_data.get("atk", 0)
+            equip_speed += equip_data.get("speed", 0)
+    return equip_hp, equip_atk, equip_speed
+
+
+def card_stats_batch(cards):
+    """一次算出整個名冊的屬性，結果與逐張 Card.stats() 相同：[(hp, atk, speed)]
+
+    查表函數和裝備目錄只取一次，相同裝備組合的加成只算一次。
+    """
+    row = base_stat_row
+    bonus_cache = {}
+    out = []
+    append = out.append
+    for c in cards:
+        rarity_mult, lv_mult, lv_speed, hp_mult, atk_mult, speed_mult = row(c.rarity, c.level, c.stars)
+        eq = c.equipment
+        key = (eq.get("weapon"), eq.get("horse"), eq.get("book"))
+        try:
+            bonus = bonus_cache[key]
+        except KeyError:
+            bonus = bonus_cache[key] = equipment_bonus(eq)
+        except TypeError:
+            # 舊版養成窗口寫入的 dict 裝備不可雜湊，逐張計算
+            bonus = equipment_bonus(eq)
+        append((int(int(c.base_hp * rarity_mult * lv_mult) * hp_mult) + bonus[0],
+                int(int(c.base_atk * rarity_mult * lv_mult) * atk_mult) + bonus[1],
+                (c.base_speed + lv_speed) * speed_mult + bonus[2] * 0.1))
+    return out
+
+
 class Card:
     def __init__(self, name, unit_type, rarity, level=1, cid=None, base_hp=100, base_atk=20, base_speed=3,
                  stars=1, exp=0, shards=0, equipment=None):
@@ -702,7 +807,8 @@ class Card:
         card = Card(
             name=d["name"], unit_type=d["unit_type"], rarity=d["rarity"], level=d.get("level", 1),
             cid=d.get("id"), base_hp=d.get("base_hp", 100), base_atk=d.get("base_atk", 20), base_speed=d.get("base_speed", 3),
-            stars=d.get("stars", 1), exp=d.get("exp", 0), shards=d.get("shards", 0), equipment=d.get("equipment", {})
+            stars=d.get("stars", 1), exp=d.get("exp", 0), shards=d.get("shards", 0),
+            equipment=dict(d.get("equipment") or {})
         )
         # 兼容舊存檔：填滿裝備槽
         for slot in ["weapon", "horse", "book"]:
@@ -711,51 +817,28 @@ class Card:
 
     def stats(self):
         """計算卡牌的最終屬性（含等級/星級/裝備）"""
-        # 基礎稀有度加成
-        rarity_mult = {"C": 1.0, "R": 1.1, "SR": 1.25, "SSR": 1.45}.get(self.rarity, 1.0)
-
-        # 等級曲線
-        lv_mult = LEVEL_CURVE.get(self.level, LEVEL_CURVE[max(LEVEL_CURVE.keys())])
-        max_hp = int(self.base_hp * rarity_mult * lv_mult)
-        atk = int(self.base_atk * rarity_mult * lv_mult)
-        speed = self.base_speed + min(2.0, (self.level - 1) * 0.05)
-
-        # 星級加成
-        star_idx = min(max(self.stars, 1), len(STAR_BONUSES)) - 1
-        star_bonus = STAR_BONUSES[star_idx]
-        max_hp = int(max_hp * star_bonus["hp_mult"])
-        atk = int(atk * star_bonus["atk_mult"])
-        speed = speed * star_bonus["speed_mult"]
-
-        # 裝備加成
-        from data import EQUIPMENT_CATALOG, EQUIPMENT_RARITY_COLOR
-        equip_hp = 0
-        equip_atk = 0
-        equip_speed = 0
-        
-        for slot in ["weapon", "horse", "book"]:
-            equip_id = self.equipment.get(slot)
-            if not equip_id or equip_id == "None":
-                continue
-            
-            # Find equipment in catalog
-            if slot in EQUIPMENT_CATALOG:
-                equip_data = next((e for e in EQUIPMENT_CATALOG[slot] if e["id"] == equip_id), None)
-                if equip_data:
-                    equip_hp += equip_data.get("hp", 0)
-                    equip_atk += equip_data.get("atk", 0)
-                    equip_speed += equip_data.get("speed", 0)
-        
+        # 稀有度/等級/星級加成（progression 預編譯的查表）
+        rarity_mult, lv_mult, lv_speed, hp_mult, atk_mult, speed_mult = base_stat_row(self.rarity, self.level, self.stars)
+        max_hp = int(int(self.base_hp * rarity_mult * lv_mult) * hp_mult)
+        atk = int(int(self.base_atk * rarity_mult * lv_mult) * atk_mult)
+        speed = (self.base_speed + lv_speed) * speed_mult
+
         # Apply flat bonuses from equipment
+        equip_hp, equip_atk, equip_speed = equipment_bonus(self.equipment)
         max_hp += equip_hp
         atk += equip_atk
         speed += equip_speed * 0.1  # Convert speed stat to actual speed multiplier
 
         return max_hp, atk, speed
+
+    def power(self):
+        """戰力：生命與攻擊的幾何平均，再按速度加成（名冊排序用）"""
+        hp, atk, speed = self.stats()
+        return int(math.sqrt(hp * atk) * (1 + 0.05 * speed))
     
     def exp_needed(self):
         """當前等級升級所需經驗"""
-        return LEVEL_EXP.get(self.level, 0)
+        return exp_for_level(self.level)
 
     def add_exp(self, amount):
         """增加經驗，自動升級（返回是否升級）"""
@@ -793,16 +876,22 @@ class PlayerData:
         self.path = path
         self.gold = 0
         self.gems = 1200
-        self.roster = []  # list of Card
+        self.roster = Roster()  # Card 名冊（用法同 list，帶索引）
         self.team = []    # list of card ids
         self.equipment_inventory = []  # list of equipment dicts with {id, slot, equipped_to}
         self.daily_quests = [q.copy() for q in DAILY_QUESTS]  # 每日任务进度
         self.weekly_quests = [q.copy() for q in WEEKLY_QUESTS]  # 周任务进度
         self.quest_completed = set()  # 已完成的任务ID
         self.selected_friend = "无"  # Friend assist unit name
+        self.offline_chapter = None  # 离开时自动战斗所在章节（用于离线结算）
+        self.last_active = None  # 离开时间戳
 
     def save(self):
-        data = {
+        write_save(self.path, self.save_data())
+
+    def save_data(self):
+        """存档内容（可 JSON 序列化的 dict）"""
+        return {
             "gold": self.gold,
             "gems": self.gems,
             "roster": [c.to_dict() for c in self.roster],
@@ -812,9 +901,9 @@ class PlayerData:
             "weekly_quests": self.weekly_quests,
             "quest_completed": list(self.quest_completed),
             "selected_friend": self.selected_friend,
+            "offline_chapter": self.offline_chapter,
+            "last_active": self.last_active,
         }
-        with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
 
     def load(self):
         if not os.path.exists(self.path):
@@ -828,7 +917,6 @@ class PlayerData:
             self.gems = 999999
             
             # Give starter equipment
-            from data import EQUIPMENT_CATALOG
             self.equipment_inventory = [
                 {"id": "w005", "slot": "weapon", "equipped_to": None},
                 {"id": "w006", "slot": "weapon", "equipped_to": None},
@@ -838,23 +926,26 @@ class PlayerData:
             
             self.save()
             return
-        with open(self.path, "r", encoding="utf-8") as f:
-            d = json.load(f)
+        d = read_save(self.path)
         self.gold = d.get("gold", 0)
         self.gems = d.get("gems", 0)
-        self.roster = [Card.from_dict(x) for x in d.get("roster", [])]
-        self.team = d.get("team", [])
-        self.equipment_inventory = d.get("equipment_inventory", [])
-        self.daily_quests = d.get("daily_quests", [q.copy() for q in DAILY_QUESTS])
-        self.weekly_quests = d.get("weekly_quests", [q.copy() for q in WEEKLY_QUESTS])
+        self.roster = Roster(Card.from_dict(x) for x in d.get("roster", []))
+        self.team = list(d.get("team", []))
+        # 解析结果会被缓存复用，可变的子结构复制一份
+        self.equipment_inventory = [dict(e) for e in d.get("equipment_inventory", [])]
+        self.daily_quests = [dict(q) for q in d.get("daily_quests", DAILY_QUESTS)]
+        self.weekly_quests = [dict(q) for q in d.get("weekly_quests", WEEKLY_QUESTS)]
         self.quest_completed = set(d.get("quest_completed", []))
         self.selected_friend = d.get("selected_friend", "无")
+        self.offline_chapter = d.get("offline_chapter")
+        self.last_active = d.get("last_active")
 
     def add_card(self, card: Card):
         self.roster.append(card)
 
     def cards_by_id(self):
-        return {c.id: c for c in self.roster}
+        """id -> Card（名冊的索引，只讀）"""
+        return self.roster.by_id()
     
     def update_quest_progress(self, quest_type, target_id):
         """更新任务进度"""
@@ -867,6 +958,88 @@ class PlayerData:
                         self.quest_completed.add(quest['id'])
 
 
+_save_cache = {}
+
+
+def write_save(path, data):
+    """把 save_data() 的结果写入存档：先写临时文件再替换，写到一半失败时旧存档保持完整"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    # mtime 精度不够时，同一时刻写入、大小相同的新存档会被 read_save 当成没变
+    _save_cache.pop(path, None)
+
+
+def read_save(path):
+    """读取并解析存档 JSON；文件未变（mtime/大小相同）时直接返回上次的解析结果，调用方不得修改
+
+    write_save 会作废对应路径的缓存；其他进程写入的存档只能靠 mtime/大小判断
+    """
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _save_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        d = json.load(f)
+    _save_cache[path] = (key, d)
+    return d
+
+
+def summon_pulls(player, count):
+    """执行 count 次抽卡并写入 player（不扣钻石、不保存）
+
+    返回 (新武将列表, 重复转碎片 [(名字, 碎片, 稀有度)], 十连赠送装备描述列表)
+    """
+    pulls = []
+    shard_conversions = []  # Track duplicates converted to shards
+    equipment_bonus = []  # Track equipment rewards from 10-pull
+    
+    for _ in range(count):
+        rarity = choose_weighted(RARITY_WEIGHTS)
+        hero = random.choice(HERO_POOL)
+        
+        # Check if player already has this hero
+        existing_card = player.roster.named(hero["name"])
+        
+        if existing_card:
+            # Duplicate! Convert to shards instead
+            shard_amount = 10  # Base shards per duplicate
+            if rarity == "SSR":
+                shard_amount = 30
+            elif rarity == "SR":
+                shard_amount = 20
+            elif rarity == "R":
+                shard_amount = 15
+            
+            existing_card.shards += shard_amount
+            shard_conversions.append((hero["name"], shard_amount, rarity))
+        else:
+            # New hero! Add to roster
+            c = Card(hero["name"], hero["type"], rarity, level=1,
+                     base_hp=hero["base_hp"], base_atk=hero["base_atk"], base_speed=hero["base_speed"])
+            player.add_card(c)
+            pulls.append(c)
+    
+    # 10-pull bonus: guaranteed equipment
+    if count == 10:
+        # Higher chance for better equipment in 10-pull
+        bonus_rarity = random.choices(["SR", "R", "R", "C"], weights=[15, 40, 30, 15])[0]
+        bonus_slot = random.choice(["weapon", "horse", "book"])
+        available = equipment_data().by_rarity.get((bonus_slot, bonus_rarity))
+        
+        if available:
+            bonus_equip = random.choice(available)
+            player.equipment_inventory.append({
+                "id": bonus_equip["id"],
+                "slot": bonus_slot,
+                "equipped_to": None
+            })
+            equipment_bonus.append(f"[{bonus_equip['rarity']}] {bonus_equip['name']}")
+    return pulls, shard_conversions, equipment_bonus
+
+
 def get_save_path():
     base = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base, "sanguo_save.json")
@@ -913,39 +1086,406 @@ def choose_buff_screen(root, units):
     root.wait_window(buff_window)
     return result[0] if result[0] else False
 
+# --- 自动战斗 AI ---
+# 单条决策记录，供性能分析查看（cost_ns 为该单位决策耗时）
+AutoDecision = namedtuple("AutoDecision", "unit target score action hold_skill cost_ns")
+
+
+class AutoBattlePlanner:
+    """自动战斗AI：按兵种相克分配目标、集火残血、弓兵风筝、择机释放技能
+
+    每隔 replan_interval 秒规划一次；单次规划超出 budget_us 微秒时中断，
+    下一帧从中断的单位继续，保证每帧开销有上限。budget_us 为 None 时不限时，
+    规划结果只取决于战斗状态（重放校验需要逐帧确定的结果）。
+    """
+    SEARCH_RADIUS = 400
+    FOCUS_WEIGHT = 1.5  # 残血目标的加权
+    MAX_SKILL_HOLD = 1.5  # 技能最多暂缓的秒数
+
+    def __init__(self, replan_interval=0.25, budget_us=500):
+        self.replan_interval = replan_interval
+        self.budget_ns = int(budget_us * 1000) if budget_us is not None else None
+        self.timer = 0.0
+        self.cursor = 0  # 未完成规划时下次开始的单位下标
+        self.hold_time = {}  # id(unit) -> 已暂缓技能的时间
+        self.decisions = deque(maxlen=64)
+        self.stats = {"plans": 0, "decisions": 0, "budget_overruns": 0, "last_plan_ns": 0, "max_plan_ns": 0}
+
+    def reset(self, units):
+        """关闭自动战斗时清除AI留下的技能暂缓标记"""
+        for u in units:
+            u.hold_skill = False
+            u.hold_siege = False
+        self.hold_time.clear()
+        self.cursor = 0
+        self.timer = 0.0
+
+    def update(self, dt, game_window):
+        for key in self.hold_time:
+            self.hold_time[key] += dt
+        self.timer -= dt
+        if self.timer > 0 and self.cursor == 0:
+            return
+
+        start = time.perf_counter_ns()
+        deadline = start + self.budget_ns if self.budget_ns is not None else None
+        units = game_window.player_units
+        while self.cursor < len(units):
+            u = units[self.cursor]
+            self.cursor += 1
+            if u.hp > 0:
+                self.plan_unit(u, game_window)
+            if deadline is not None and time.perf_counter_ns() > deadline and self.cursor < len(units):
+                self.stats["budget_overruns"] += 1
+                break
+        else:
+            self.cursor = 0
+            self.timer = self.replan_interval
+            self.stats["plans"] += 1
+
+        elapsed = time.perf_counter_ns() - start
+        self.stats["last_plan_ns"] = elapsed
+        self.stats["max_plan_ns"] = max(self.stats["max_plan_ns"], elapsed)
+
+    def score_target(self, u, enemy, dist, focused):
+        """目标评分：相克倍率 × 残血加权 × 距离衰减，已被友军锁定的目标额外加分"""
+        hp_ratio = enemy.hp / enemy.max_hp if enemy.max_hp else 1.0
+        score = get_multiplier(u.type, enemy.type) * (1 + self.FOCUS_WEIGHT * (1 - hp_ratio))
+        score /= 1 + dist / 300
+        if focused:
+            score *= 1.2
+        return score
+
+    def plan_unit(self, u, game_window):
+        t0 = time.perf_counter_ns()
+        # 提前攻破城堡算提前胜利、没有关卡奖励：最后一波出现前不攻城
+        u.hold_siege = game_window.wave <= game_window.max_waves
+        candidates = game_window.unit_grid.query(u.pos[0], u.pos[1], self.SEARCH_RADIUS, team=1)
+        if not candidates:
+            candidates = [e for e in game_window.all_enemies if e.hp > 0]
+
+        if not candidates:
+            # 没有敌人：向敌方城堡推进
+            u.target_pos = [u.pos[0], game_window.enemy_castle.pos[1] + 80]
+            u.hold_skill = False
+            self.record(u, None, 0.0, "advance", t0)
+            return
+
+        focused = {id(a.target_enemy) for a in game_window.player_units
+                   if a is not u and a.hp > 0 and a.target_enemy is not None}
+        best, best_score, best_dist = None, -1.0, 0.0
+        for e in candidates:
+            dist = math.dist(u.pos, e.pos)
+            score = self.score_target(u, e, dist, id(e) in focused)
+            if score > best_score:
+                best, best_score, best_dist = e, score, dist
+        u.target_enemy = best
+
+        # 走位：弓兵保持在射程边缘风筝，近战直接贴近
+        attack_range = get_attack_range(u.type)
+        if u.type == 2:
+            kite_dist = UNIT_ATTACK_RANGES[2] * 0.9
+            if best_dist < kite_dist * 0.75 or best_dist > attack_range:
+                dx = u.pos[0] - best.pos[0]
+                dy = u.pos[1] - best.pos[1]
+                norm = math.hypot(dx, dy) or 1.0
+                u.target_pos = [best.pos[0] + dx / norm * kite_dist, best.pos[1] + dy / norm * kite_dist]
+                action = "kite" if best_dist < kite_dist * 0.75 else "approach"
+            else:
+                u.target_pos = None
+                action = "attack"
+        else:
+            u.target_pos = None if best_dist < attack_range else list(best.pos)
+            action = "attack" if best_dist < attack_range else "approach"
+
+        u.hold_skill = self.should_hold_skill(u, best, candidates)
+        self.record(u, best, best_score, action, t0)
+
+    def should_hold_skill(self, u, target, candidates):
+        """判断技能是否值得暂缓到更好的时机"""
+        if not u.skill or not u.skill_ready:
+            self.hold_time.pop(id(u), None)
+            return False
+        held = self.hold_time.setdefault(id(u), 0.0)
+        if held >= self.MAX_SKILL_HOLD:
+            self.hold_time.pop(id(u), None)
+            return False
+
+        effect = u.skill.get("effect")
+        if effect == "volley":
+            # 至少能覆盖两个敌人再放
+            radius = u.skill.get("range", 100)
+            clustered = sum(1 for e in candidates if math.dist(e.pos, target.pos) < radius)
+            good = clustered >= 2
+        elif effect == "charge":
+            # 自身掉血或打克制目标时冲锋
+            good = u.hp < u.max_hp * 0.6 or get_multiplier(u.type, target.type) > 1.0
+        elif effect == "pierce":
+            # 不对已被击晕的目标浪费击晕机会
+            good = not target.stunned
+        else:
+            good = True
+        if good:
+            self.hold_time.pop(id(u), None)
+        return not good
+
+    def record(self, u, target, score, action, t0):
+        cost = time.perf_counter_ns() - t0
+        self.decisions.append(AutoDecision(u.name, target.name if target else None, round(score, 3),
+                                           action, u.hold_skill, cost))
+        self.stats["decisions"] += 1
+
+
 # 主遊戲
-class GameWindow:
-    def __init__(self, root, player: PlayerData, team_cards: list[Card], **kwargs):
-        self.root = root
-        self.root.title("⚔ 三國戰爭 - 戰鬥")
-        self.root.geometry("1000x600")
-        self.root.configure(bg=BG_MAIN)
+def chapter_rewards(chapter):
+    """关卡通关奖励：(金币, 钻石, 每名存活武将获得的经验)"""
+    reward_gold = 500 + (chapter - 1) * 100
+    reward_gems = 100 + (chapter - 1) * 20
+    base_exp = 80 + (chapter - 1) * 20  # More exp for higher chapters
+    return reward_gold, reward_gems, base_exp
+
+
+def roll_equipment_drop(chapter):
+    """按章节掉落池随机掉落装备（60%概率），返回 (槽位, 装备数据) 或 None"""
+    if random.random() >= 0.6:
+        return None
+    # Select random equipment based on chapter
+    if chapter >= 3:
+        rarity_pool = ["SR", "SR", "R", "R", "C"]
+    elif chapter >= 2:
+        rarity_pool = ["R", "R", "R", "C", "C"]
+    else:
+        rarity_pool = ["R", "C", "C", "C"]
+    
+    drop_rarity = random.choice(rarity_pool)
+    slot = random.choice(["weapon", "horse", "book"])
+    available = equipment_data().by_rarity.get((slot, drop_rarity))
+    if not available:
+        return None
+    return slot, random.choice(available)
+
+
+# --- 波间事件注册表 ---
+# 效果 ID -> (处理函数, 记入 active_buffs/active_curses 的类别)；处理函数签名 fn(sim, event, source)，
+# 属性改动通过 sim.add_modifier 挂到单位的修正堆叠上，source 相同的改动可以用 sim.revert_modifiers 撤销
+EVENT_HANDLERS = {}
+
+
+def event_handler(effect, track=None):
+    def register(fn):
+        EVENT_HANDLERS[effect] = (fn, track)
+        return fn
+    return register
+
+
+@event_handler("heal")
+def _event_heal(sim, event, source):
+    # 恢复所有单位25% HP
+    for u in sim.player_units:
+        if u.hp > 0:
+            u.hp = min(u.max_hp, u.hp + u.max_hp * 0.25)
+
+
+@event_handler("curse")
+def _event_enemy_atk_down(sim, event, source):
+    # 敌方下波攻击降低20%
+    for u in sim.all_enemies:
+        sim.add_modifier(source, u, "atk", "mul", 0.8)
+
+
+@event_handler("fewer_enemies")
+def _event_fewer_enemies(sim, event, source):
+    # 下波敌人减少1个
+    if sim.all_enemies:
+        sim.all_enemies.pop()
+
+
+@event_handler("slow")
+def _event_slow(sim, event, source):
+    # 所有单位速度降低30%
+    for u in sim.player_units + sim.all_enemies:
+        sim.add_modifier(source, u, "speed", "mul", 0.7)
+
+
+@event_handler("atk_speed", track="buff")
+def _event_atk_speed(sim, event, source):
+    # 单位每帧攻击一次，没有攻击间隔可缩短，按输出+30%折算到攻击力
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "atk", "mul", 1.3)
+
+
+@event_handler("crit", track="buff")
+def _event_crit(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "crit_chance", "add", 0.25)
+
+
+@event_handler("move_speed", track="buff")
+def _event_move_speed(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "speed", "mul", 1.4)
+
+
+@event_handler("lifesteal", track="buff")
+def _event_lifesteal(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "lifesteal", "add", 0.15)
+
+
+@event_handler("armor", track="buff")
+def _event_armor(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "damage_reduction", "add", 0.25)
 
+
+@event_handler("cooldown", track="buff")
+def _event_cooldown(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "cooldown_mult", "mul", 0.6)
+
+
+@event_handler("weakness", track="curse")
+def _event_weakness(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "atk", "mul", 0.7)
+
+
+@event_handler("curse_slow", track="curse")
+def _event_curse_slow(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "speed", "mul", 0.5)
+
+
+@event_handler("curse_fragile", track="curse")
+def _event_curse_fragile(sim, event, source):
+    for u in sim.player_units:
+        sim.add_modifier(source, u, "damage_reduction", "add", -0.4)
+
+
+@event_handler("trade_double_buff")
+def _event_trade_double_buff(sim, event, source):
+    # 花费金币获得2个随机增益
+    if sim.player.gold >= event["cost"]:
+        sim.player.gold -= event["cost"]
+        for buff in random.sample(ROGUELITE_BUFFS, min(2, len(ROGUELITE_BUFFS))):
+            sim.apply_event(buff)
+
+
+@event_handler("trade_remove_curse")
+def _event_trade_remove_curse(sim, event, source):
+    # 花费金币移除最早的诅咒，按记录撤销它的全部改动
+    if sim.player.gold >= event["cost"] and sim.active_curses:
+        sim.player.gold -= event["cost"]
+        sim.revert_modifiers(sim.active_curses.pop(0))
+
+
+@event_handler("trade_gamble")
+def _event_trade_gamble(sim, event, source):
+    # 花费金币随机获得增益或诅咒
+    if sim.player.gold >= event["cost"]:
+        sim.player.gold -= event["cost"]
+        pool = ROGUELITE_BUFFS if random.random() < 0.5 else ROGUELITE_CURSES
+        sim.apply_event(random.choice(pool))
+
+
+class EventPool:
+    """预编译的加权事件池：累积权重 + bisect 抽样"""
+
+    def __init__(self, events, weights):
+        missing = sorted({e["effect"] for e in events} - set(EVENT_HANDLERS))
+        if missing:
+            raise ValueError(f"事件效果没有处理函数: {missing}")
+        pairs = [(e, w) for e, w in zip(events, weights) if w > 0]
+        self.events = tuple(e for e, _ in pairs)
+        self.cum_weights = tuple(itertools.accumulate(w for _, w in pairs))
+
+    def __len__(self):
+        return len(self.events)
+
+    def pick(self):
+        r = random.random() * self.cum_weights[-1]
+        return self.events[bisect.bisect_right(self.cum_weights, r)]
+
+    def sample(self, k):
+        """按权重不放回抽取 k 个事件，按抽中的先后顺序返回（超时自动选第一个，不能偏向靠前的事件）"""
+        weights = [b - a for a, b in zip((0,) + self.cum_weights, self.cum_weights)]
+        total = self.cum_weights[-1] if self.cum_weights else 0
+        picked = []
+        for _ in range(min(k, len(self.events))):
+            # 每抽中一个就把它的权重移出，剩下的按权重重新抽，不会因为重复命中而反复重抽
+            r = random.random() * total
+            index = 0
+            for index, w in enumerate(weights):
+                if w and r < w:
+                    break
+                r -= w
+            else:
+                # 浮点误差落在末尾时取最后一个还有权重的事件
+                index = max(i for i, w in enumerate(weights) if w)
+            picked.append(self.events[index])
+            total -= weights[index]
+            weights[index] = 0
+        return picked
+
+
+@functools.lru_cache(maxsize=None)
+def chapter_event_pools(chapter):
+    """章节的 (波间事件池, 交易池)，首次用到时编译；章节 event_weights 可覆盖单个效果的权重（0=不出现）"""
+    overrides = chapter_config(CATALOG, chapter).get("event_weights", {})
+
+    def build(events):
+        return EventPool(events, [overrides.get(e["effect"], e["weight"]) for e in events])
+
+    return build(WAVE_EVENTS + ROGUELITE_BUFFS + ROGUELITE_CURSES), build(ROGUELITE_TRADE)
+
+
+class BattleSimulation:
+    """战斗规则（无界面）：GameWindow 在此基础上加渲染和输入，离线结算直接使用"""
+    def __init__(self, player: PlayerData, team_cards: list[Card], **kwargs):
         self.player = player
         self.team_cards = team_cards  # Store cards to award exp
         self.chapter = kwargs.get('chapter', 1)  # 当前章节
-        self.stage_config = next((c for c in CHAPTER_CONFIGS if c['chapter'] == self.chapter), CHAPTER_CONFIGS[0])
+        self.stage_config = chapter_config(CATALOG, self.chapter)
         self.max_waves = self.stage_config['waves']
+        # 无界面模式下每步清空伤害数字和粒子，避免无人消费时堆积
+        self.headless = kwargs.get('headless', False)
 
-        # 创建渐变背景效果
-        self.canvas = Canvas(self.root, width=1000, height=600, bg="#0F1419")
-        self.canvas.pack()
-        self.canvas.bind("<Button-1>", self.on_click)
-        self.canvas.bind("<Button-3>", self.on_right_click)
-        self.canvas.bind("<ButtonRelease-1>", self.on_release)
-        self.canvas.bind("<Motion>", self.on_motion)
+        # 战场世界尺寸（大于画布时由 GameWindow 的摄影机平移显示）
+        self.world_width = self.stage_config.get('width', 1000)
+        self.world_height = self.stage_config.get('height', 600)
+        self.bounds = arena_bounds(self.world_width, self.world_height)
+        # 双方阵型按 1000x600 设计：水平居中，玩家一方贴着战场底部
+        self.formation_dx = (self.world_width - 1000) / 2
+        player_dy = self.world_height - 600
 
         # 城堡位置：玩家下方，敌人上方
-        self.player_castle = Castle(500, 550, 0)
+        self.player_castle = Castle(self.world_width / 2, self.world_height - 50, 0)
         
         # 如果是Boss关卡，创建Boss城堡
         is_boss_stage = self.stage_config.get('has_boss', False)
-        self.enemy_castle = Castle(500, 100, 1, is_boss=is_boss_stage)
-        self.boss_skill_cooldown = 0.0  # Boss技能冷却
+        boss_config = BOSS_CONFIGS[self.stage_config['boss']] if is_boss_stage else None
+        self.enemy_castle = Castle(self.world_width / 2, 100, 1, is_boss=is_boss_stage, boss_config=boss_config)
+        # 敌方全部城堡（主城/主Boss + 章节配置的额外Boss），全部摧毁才算胜利
+        self.enemy_castles = [self.enemy_castle]
+        for spawn in self.stage_config.get('extra_bosses', ()):
+            self.enemy_castles.append(Castle(spawn['x'], spawn['y'], 1, is_boss=True,
+                                             boss_config=BOSS_CONFIGS[spawn['id']]))
+        boss_range = math.hypot(self.world_width, self.world_height)
+        self.boss_engines = [BossAbilityEngine(c, c.boss_config, boss_range)
+                             for c in self.enemy_castles if c.is_boss]
+        # 地形：章节地图的障碍和流场寻路（没有地图时为 None，单位直线移动）
+        map_name = self.stage_config.get('map')
+        self.nav = (nav_grid(map_name, BATTLE_MAPS.get(map_name), self.world_width, self.world_height)
+                    if map_name else None)
+        if self.nav is not None:
+            for castle in [self.player_castle] + self.enemy_castles:
+                self.nav.field(self.nav.cell_index(castle.pos))  # 预先算好走向各城堡的流场
+        self.unit_grid = SpatialHash(cell_size=100)  # 每帧重建的单位空间索引
+        self.projectiles = ProjectilePool()  # 飞行中的箭矢
         
         # Build units from cards - 玩家单位在下方
         self.player_units = []
-        x_positions = [300, 500, 700]  # 水平分布
+        x_positions = [300 + self.formation_dx, 500 + self.formation_dx, 700 + self.formation_dx]  # 水平分布
         for i, card in enumerate(team_cards[:3]):
             max_hp, atk, speed = card.stats()
             # 玩家隊伍比敵人強5%
@@ -953,29 +1493,28 @@ class GameWindow:
             atk = int(atk * 1.05)
             # 攻城傷害 = 攻擊力的70% (減少攻城能力以保持平衡)
             siege_atk = int(atk * 0.7)
-            self.player_units.append(Unit(f"{card.name} Lv{card.level}", x_positions[i], 480, 0, card.unit_type, hp=max_hp, atk=atk, speed=speed, siege_atk=siege_atk))
+            self.player_units.append(Unit(f"{card.name} Lv{card.level}", x_positions[i], 480 + player_dy, 0, card.unit_type, hp=max_hp, atk=atk, speed=speed, siege_atk=siege_atk, hero=card.name))
 
         # Add friend assist unit if selected - 放在中间位置
         if hasattr(self.player, 'selected_friend') and self.player.selected_friend and self.player.selected_friend != "无":
             friend_config = next((f for f in FRIEND_ASSIST_UNITS if f['name'] == self.player.selected_friend), None)
             if friend_config:
-                self.player_units.append(Unit(f"{friend_config['name']}", 500, 500, 0, friend_config['type'], 
-                                             hp=friend_config.get('hp', 400), atk=friend_config.get('atk', 50), 
-                                             speed=friend_config.get('speed', 80)))
+                hp, atk, speed = friend_unit_stats(friend_config)
+                self.player_units.append(Unit(f"{friend_config['name']}", 500 + self.formation_dx, 500 + player_dy, 0,
+                                             friend_config['type'], 
+                                             hp=hp, atk=atk, speed=speed))
 
         self.all_enemies = []
         self.enemy_units = []  # 當前活躍的敵人單位列表
         self.wave = 1
         self.running = True
-        self.selected_unit = None
         self.damage_texts = []
         self.particles = []  # Particle effects system
-        self.last_time = time.time()
-        self._after_id = None
-        # UI/UX 新增
-        self.game_speed = 1.0  # 游戏速度倍率 (1.0, 2.0, 3.0)
-        self.auto_battle = False  # 自动战斗开关
-        self.show_ranges = False  # 显示攻击范围
+        self.combat = DamagePipeline()  # 伤害结算管线
+        self.profiler = kwargs.get('profiler')  # FrameProfiler，None 表示不计时
+        self.auto_battle = kwargs.get('auto_battle', False)  # 自动战斗开关
+        self.auto_planner = AutoBattlePlanner(replan_interval=kwargs.get('auto_replan_interval', 0.25),
+                                              budget_us=kwargs.get('auto_budget_us', 500))
         self.wave_start_time = time.time()  # 波次开始时间
         
         # 波间事件系统
@@ -985,84 +1524,43 @@ class GameWindow:
         self.event_choices = []  # 波间事件选择
         self.waiting_for_event = False  # 等待事件选择
         self.current_event = None  # 当前选中的事件
+        self.modifier_seq = 0  # 用于生成修正来源标签
+        self.battle_time = 0.0  # 战斗时钟（秒），修正到期以此为准
         
         # Roguelite状态
         self.active_buffs = []  # 激活的Buff列表
         self.active_curses = []  # 激活的诅咒列表
-        self.crit_chance = 0.0  # 暴击概率
-        self.damage_reduction = 0.0  # 伤害减免
-        self.lifesteal_rate = 0.0  # 吸血率
         
         # 战斗商店状态
         self.shop_items = []  # 当前波次的商店物品（刷新）
         self.shop_locked = []  # 锁定的物品索引
         self.temp_buffs = {}  # 临时增益 {unit_id: [buff_list]}
         self.refresh_count = 0  # 商店刷新次数
-        
-        # Ensure safe close cancels timers
-        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
-        # Defer starting loop until window is fully initialized
-        self._after_id = self.root.after(16, self.update_game)
-    
-    def on_click(self, event):
-        if not self.running:
-            return
-        for u in self.player_units:
-            dist = math.sqrt((event.x - u.pos[0])**2 + (event.y - u.pos[1])**2)
-            if u.hp > 0 and dist < 30:
-                self.selected_unit = u
-                u.selected = True
-            else:
-                u.selected = False
     
-    def on_right_click(self, event):
-        """右鍵點擊敵人單位，設置為攻擊目標"""
-        if not self.running or not self.selected_unit:
-            return
-        # 檢查點擊的是否是敵人單位
-        for u in self.player_units + self.enemy_units:
-            if u.team == 1 and u.hp > 0:  # 敵人
-                dist = math.sqrt((event.x - u.pos[0])**2 + (event.y - u.pos[1])**2)
-                if dist < 30:
-                    # 設置為攻擊目標
-                    self.selected_unit.target_enemy = u
-                    self.selected_unit.target_pos = None  # 清除移動目標
-                    return
-    
-    def on_release(self, event):
-        if self.selected_unit:
-            self.selected_unit.target_pos = [event.x, event.y]
-            self.selected_unit = None
-    
-    def on_motion(self, event):
-        pass
-    
-    def update_game(self):
-        # Guard against destroyed widgets or stopped loop
-        if not self.running or not self.canvas.winfo_exists():
-            return
-        
-        current_time = time.time()
-        dt = (current_time - self.last_time) * self.game_speed
-        self.last_time = current_time
-        
+    def spawn_wave_enemies(self):
+        """按章节阵型生成当前波次的敌人"""
+        cfg = self.stage_config
+        base_hp = cfg['base_hp'] + (self.wave - 1) * cfg['hp_per_wave']
+        base_atk = cfg['base_atk'] + (self.wave - 1) * cfg['atk_per_wave']
+        return [
+            Unit(f"{slot['name']}{self.wave}", slot['x'] + self.formation_dx, slot['y'], 1, slot['type'],
+                 hp=int(base_hp * slot['hp_mult']), atk=int(base_atk * slot['atk_mult']))
+            for slot in ENEMY_FORMATIONS[cfg['formation']]
+        ]
+
+    def step(self, dt):
+        """推进一帧战斗逻辑；全部波次结束时返回 False"""
+        prof = self.profiler
         # 產生新波敵人
         current_enemy_units = [u for u in self.all_enemies if u.hp > 0]
         if not current_enemy_units:
             # 检查是否完成所有波次
             if self.wave > self.max_waves:
                 self.running = False
-                return
+                return False
             
-            # 生成敌人（基于章节配置） - 在上方水平分布
-            base_hp = self.stage_config['base_hp'] + (self.wave - 1) * 20
-            base_atk = self.stage_config['base_atk'] + (self.wave - 1) * 3
-            
-            self.all_enemies = [
-                Unit(f"敵槍{self.wave}", 300, 150, 1, 0, hp=int(base_hp * 0.56), atk=int(base_atk * 0.7)),
-                Unit(f"敵騎{self.wave}", 500, 150, 1, 1, hp=int(base_hp * 0.7), atk=int(base_atk * 0.7)),
-                Unit(f"敵弓{self.wave}", 700, 150, 1, 2, hp=int(base_hp * 0.49), atk=int(base_atk * 0.7))
-            ]
+            # 生成敌人（基于章节配置的阵型） - 在上方水平分布
+            self.all_enemies = self.spawn_wave_enemies()
             self.enemy_units = self.all_enemies  # 更新當前敵人列表
             
             # 只在第2波及以後才觸發波間準備階段
@@ -1072,23 +1570,22 @@ class GameWindow:
                 self.wave_start_time = time.time()
                 self.prep_countdown = self.prep_time
                 self.waiting_for_event = True
-                # Mix base events with Roguelite buffs and curses
-                base_events = list(WAVE_EVENTS)
-                buff_options = random.sample(ROGUELITE_BUFFS, min(2, len(ROGUELITE_BUFFS)))
-                curse_options = random.sample(ROGUELITE_CURSES, min(1, len(ROGUELITE_CURSES)))
-                all_options = base_events + buff_options + curse_options
-                self.event_choices = random.sample(all_options, min(3, len(all_options)))
-                # Possibly add a trade option if player has enough gold
-                if random.random() < 0.4 and self.player.gold >= 50:
-                    trade_opt = random.choice(ROGUELITE_TRADE)
-                    if len(self.event_choices) > 0:
-                        self.event_choices[random.randint(0, len(self.event_choices) - 1)] = trade_opt
+                event_pool, trade_pool = chapter_event_pools(self.chapter)
+                self.event_choices = event_pool.sample(3)
+                # 金币足够时随机替换一个选项为交易
+                if trade_pool and self.event_choices and random.random() < 0.4 \
+                        and self.player.gold >= min(e["cost"] for e in trade_pool.events):
+                    self.event_choices[random.randrange(len(self.event_choices))] = trade_pool.pick()
             else:
                 # 第一波直接開始
                 self.wave += 1
                 self.wave_start_time = time.time()
         
         units = self.player_units + self.all_enemies
+        self.battle_time += 0.016
+        for u in units:
+            u.stats.expire(self.battle_time)
+        self.unit_grid.rebuild(units)
         
         # 处理波间准备逻辑
         if self.waiting_for_event:
@@ -1099,26 +1596,30 @@ class GameWindow:
                 if self.event_choices:
                     self.apply_event(self.event_choices[0])
         
-        # 自动战斗：让玩家单位自动向上方前进
+        if prof:
+            prof.lap("spawn")
+        
+        # 自动战斗：AI按节奏规划目标、走位和技能时机
         if self.auto_battle and not self.waiting_for_event:
-            for u in self.player_units:
-                if u.hp > 0 and not u.target_pos:
-                    # 向敌方城堡方向移动（上方）
-                    u.target_pos = [u.pos[0], self.enemy_castle.pos[1] + 80]
+            self.auto_planner.update(0.016, self)
         
-        # 更新單位
+        # 更新單位（命中登记到 self.combat，帧末统一结算）
+        castles = [self.player_castle] + self.enemy_castles
         for u in units:
             if u.hp > 0:
-                dmg = u.update(units, [self.player_castle, self.enemy_castle], self)
-                if dmg > 0:
-                    target = u.target_enemy if u.target_enemy else self.enemy_castle
-                    self.damage_texts.append((target.pos[:], dmg, 30))
-                    # Emit particle on hit
-                    self.particles.append(Particle(target.pos[0], target.pos[1], RED if target.team == 1 else BLUE, life=0.8, vx=0, vy=-30))
+                u.update(units, castles, self)
+        # 箭矢飞行，落地的命中同样登记到 self.combat
+        self.projectiles.update(0.016, self.unit_grid, self.combat)
+        # 同队单位互相推开，避免叠成一团
+        separate(units, self.unit_grid, self.bounds,
+                 passable=self.nav.passable if self.nav is not None else None)
+        
+        if prof:
+            prof.lap("units")
         
         # 攻擊城堡（當周圍沒有可攻擊的敵人時，優先攻城）
         for u in units:
-            if u.hp > 0:
+            if u.hp > 0 and not u.hold_siege:
                 attack_range = get_attack_range(u.type)
                 # 是否有敵人在攻擊範圍內
                 has_enemy_in_range = False
@@ -1130,57 +1631,234 @@ class GameWindow:
 
                 if not has_enemy_in_range:
                     if u.team == 0:
-                        if math.dist(u.pos, self.enemy_castle.pos) < attack_range:
-                            # 使用攻城傷害值（較低於普通攻擊）
-                            damage = int(u.siege_atk)
-                            self.enemy_castle.hp -= damage
-                            self.damage_texts.append((self.enemy_castle.pos[:], damage, 30))
-                            self.particles.append(Particle(self.enemy_castle.pos[0], self.enemy_castle.pos[1], RED, life=0.8, vx=0, vy=-30))
+                        for castle in self.enemy_castles:
+                            if castle.hp > 0 and math.dist(u.pos, castle.pos) < attack_range:
+                                # 使用攻城傷害值（較低於普通攻擊）
+                                u.deal_damage(self, castle, int(u.siege_atk), kind=HIT_SIEGE)
+                                break
                     else:
                         if math.dist(u.pos, self.player_castle.pos) < attack_range:
                             # 使用攻城傷害值（較低於普通攻擊）
-                            damage = int(u.siege_atk)
-                            self.player_castle.hp -= damage
-                            self.damage_texts.append((self.player_castle.pos[:], damage, 30))
-                            self.particles.append(Particle(self.player_castle.pos[0], self.player_castle.pos[1], BLUE, life=0.8, vx=0, vy=-30))
+                            u.deal_damage(self, self.player_castle, int(u.siege_atk), kind=HIT_SIEGE)
+        
+        if prof:
+            prof.lap("siege")
         
         # Boss技能攻击
-        if self.enemy_castle.is_boss:
-            self.enemy_castle.update_boss_phase()
-            self.boss_skill_cooldown -= 0.016
-            
-            if self.boss_skill_cooldown <= 0:
-                # 获取当前阶段Boss技能
-                current_phase = self.enemy_castle.boss_phase
-                boss_abilities = [a for a in BOSS_CONFIG['abilities'] if a['phase'] == current_phase]
-                
-                if boss_abilities:
-                    ability = boss_abilities[0]
-                    ability_damage = BOSS_CONFIG['base_atk'] * ability.get('damage', 1.0)
-                    
-                    if ability['effect'] == 'aoe':
-                        # 范围攻击所有玩家单位
-                        for u in self.player_units:
-                            if u.hp > 0:
-                                u.hp -= ability_damage
-                                self.damage_texts.append((u.pos[:], int(ability_damage), 30))
-                    
-                    elif ability['effect'] == 'execute':
-                        # 对低血量单位造成额外伤害
-                        threshold = ability.get('threshold', 0.3)
-                        for u in self.player_units:
-                            if u.hp > 0 and (u.hp / u.max_hp) < threshold:
-                                u.hp -= ability_damage * 2  # 对低血量目标伤害翻倍
-                                self.damage_texts.append((u.pos[:], int(ability_damage * 2), 30))
-                    
-                    else:
-                        # 普通单体攻击
-                        if self.player_units:
-                            target = random.choice([u for u in self.player_units if u.hp > 0])
-                            target.hp -= ability_damage
-                            self.damage_texts.append((target.pos[:], int(ability_damage), 30))
-                    
-                    self.boss_skill_cooldown = ability.get('cooldown', 3.0)
+        for engine in self.boss_engines:
+            engine.update(0.016, self.unit_grid, self)
+        
+        # 统一结算本帧的全部命中（渲染/任务/统计通过 combat.listeners 和累计数据读取）
+        self.combat.resolve(heal_castle=self.player_castle)
+        if prof:
+            prof.lap("boss")
+        if self.headless:
+            self.damage_texts.clear()
+            self.particles.clear()
+        return True
+
+    def battle_outcome(self):
+        """None=进行中，"defeat"=城堡失守，"chapter_clear"=完成全部波次，"victory"=提前攻破城堡"""
+        if self.player_castle.hp <= 0:
+            return "defeat"
+        if all(castle.hp <= 0 for castle in self.enemy_castles):
+            return "chapter_clear" if self.wave > self.max_waves else "victory"
+        return None
+
+    def grant_chapter_rewards(self):
+        """发放关卡奖励（金币/钻石/存活武将经验/装备掉落），不保存存档"""
+        reward_gold, reward_gems, base_exp = chapter_rewards(self.chapter)
+        
+        # Award experience to surviving team members
+        exp_gains = []
+        level_ups = []
+        for i, card in enumerate(self.team_cards[:3]):
+            # Check if unit survived (corresponding player_unit still has hp > 0)
+            if i < len(self.player_units) and self.player_units[i].hp > 0:
+                leveled_up = card.add_exp(base_exp)
+                exp_gains.append(f"{card.name} +{base_exp}經驗")
+                if leveled_up:
+                    self.player.roster.update(card)
+                    level_ups.append(f"{card.name} 升級至 Lv{card.level}！")
+        
+        self.player.gold += reward_gold
+        self.player.gems += reward_gems
+        
+        # Award equipment drops (random chance)
+        equipment_drops = []
+        drop = roll_equipment_drop(self.chapter)
+        if drop:
+            slot, dropped = drop
+            self.player.equipment_inventory.append({
+                "id": dropped["id"],
+                "slot": slot,
+                "equipped_to": None
+            })
+            equipment_drops.append(f"[{dropped['rarity']}] {dropped['name']}")
+        return reward_gold, reward_gems, exp_gains, level_ups, equipment_drops
+
+    def select_event(self, idx):
+        """选择波间事件"""
+        if 0 <= idx < len(self.event_choices):
+            self.apply_event(self.event_choices[idx])
+            self.waiting_for_event = False
+    
+    def apply_event(self, event):
+        """应用波间事件效果（按效果 ID 分派到 EVENT_HANDLERS）"""
+        handler, track = EVENT_HANDLERS[event['effect']]
+        source = self.new_modifier_source(event['effect'])
+        if track == "buff":
+            self.active_buffs.append(source)
+        elif track == "curse":
+            self.active_curses.append(source)
+        handler(self, event, source)
+        self.current_event = event
+
+    def new_modifier_source(self, tag):
+        """生成唯一的修正来源标签"""
+        self.modifier_seq += 1
+        return f"{tag}#{self.modifier_seq}"
+
+    def add_modifier(self, source, unit, stat, op, value, duration=None):
+        """给单位挂一个属性修正（op 为 "add" 或 "mul"），duration 秒后按战斗时钟到期"""
+        expires = self.battle_time + duration if duration else None
+        unit.stats.add(source, stat, op, value, expires)
+
+    def revert_modifiers(self, source):
+        """撤销 source 挂上的全部修正"""
+        for u in self.player_units + self.all_enemies:
+            u.stats.remove(source)
+
+# 主遊戲
+class GameWindow(BattleSimulation):
+    def __init__(self, root, player: PlayerData, team_cards: list[Card], **kwargs):
+        self.root = root
+        self.root.title("⚔ 三國戰爭 - 戰鬥")
+        self.root.geometry("1000x600")
+        self.root.configure(bg=BG_MAIN)
+
+        super().__init__(player, team_cards, **kwargs)
+        self.combat.listeners.append(self.show_hits)
+        # 分阶段帧计时：设置 SANGUO_PROFILE=1 启动时开启，或在战斗中按 F3 开启并切换叠加层
+        if self.profiler is None and os.environ.get("SANGUO_PROFILE"):
+            self.profiler = FrameProfiler()
+        self.show_profiler = self.profiler is not None
+        self.root.bind("<F3>", lambda e: self.toggle_profiler())
+        # 帧率上限：fps 参数或 SANGUO_FPS 环境变量，0 为不限；战斗中按 F4 切换
+        self.scheduler = FrameScheduler(fps=kwargs.get('fps', int(os.environ.get("SANGUO_FPS", FPS_CAPS[0]))))
+        self.sim_clock = SimClock()  # 固定步长推进模拟，帧率上限只影响绘制
+        self.root.bind("<F4>", lambda e: self.cycle_fps_cap())
+        # 摄影机：战场大于画布时用方向键、中键拖动或点击小地图平移视角，开场对准己方城堡
+        self.camera = Camera(self.world_width, self.world_height)
+        self.camera.center_on(*self.player_castle.pos)
+        self.minimap = Minimap(self.world_width, self.world_height) if self.camera.scrollable else None
+        self.minimap_origin = (840, 80)  # 小地图左上角（画布座标）
+        self._pan_anchor = (0, 0)
+        for key, (dx, dy) in {"<Left>": (-1, 0), "<Right>": (1, 0), "<Up>": (0, -1), "<Down>": (0, 1)}.items():
+            self.root.bind(key, lambda e, dx=dx, dy=dy: self.camera.pan(dx * PAN_STEP, dy * PAN_STEP))
+
+        # 创建渐变背景效果
+        self.canvas = Canvas(self.root, width=1000, height=600, bg="#0F1419")
+        self.canvas.pack()
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<Button-3>", self.on_right_click)
+        self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<Motion>", self.on_motion)
+        self.canvas.bind("<Button-2>", self.on_pan_start)
+        self.canvas.bind("<B2-Motion>", self.on_pan_drag)
+
+        self.selected_unit = None
+        self.last_time = time.time()
+        self._after_id = None
+        # UI/UX 新增
+        self.game_speed = 1.0  # 游戏速度倍率 (1.0, 2.0, 3.0)
+        self.show_ranges = False  # 显示攻击范围
+        self.lod = DetailPolicy()  # 单位多/帧耗时高时省略名字、仇恨线等装饰
+        
+        # Ensure safe close cancels timers
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # Defer starting loop until window is fully initialized
+        self._after_id = self.root.after(16, self.update_game)
+    
+    def on_click(self, event):
+        if not self.running:
+            return
+        if self.minimap is not None and self.minimap.contains(self.minimap_origin, event.x, event.y):
+            # 点击小地图：视角移到该处
+            self.camera.center_on(*self.minimap.to_world(self.minimap_origin, event.x, event.y))
+            return
+        x, y = self.camera.to_world(event.x, event.y)
+        for u in self.player_units:
+            dist = math.sqrt((x - u.pos[0])**2 + (y - u.pos[1])**2)
+            if u.hp > 0 and dist < 30:
+                self.selected_unit = u
+                u.selected = True
+            else:
+                u.selected = False
+    
+    def on_right_click(self, event):
+        """右鍵點擊敵人單位，設置為攻擊目標"""
+        if not self.running or not self.selected_unit:
+            return
+        # 檢查點擊的是否是敵人單位
+        x, y = self.camera.to_world(event.x, event.y)
+        for u in self.player_units + self.enemy_units:
+            if u.team == 1 and u.hp > 0:  # 敵人
+                dist = math.sqrt((x - u.pos[0])**2 + (y - u.pos[1])**2)
+                if dist < 30:
+                    # 設置為攻擊目標
+                    self.selected_unit.target_enemy = u
+                    self.selected_unit.target_pos = None  # 清除移動目標
+                    return
+    
+    def on_release(self, event):
+        if self.selected_unit:
+            x, y = self.camera.to_world(event.x, event.y)
+            if event.state & 0x0001:
+                # Shift：全队（三名武将+好友助战）以落点为中心排成阵型移动
+                for u, slot in formation_slots(self.player_units, (x, y), RANGED_TYPES, self.bounds):
+                    u.target_pos = slot
+            else:
+                self.selected_unit.target_pos = [x, y]
+            self.selected_unit = None
+    
+    def on_motion(self, event):
+        pass
+
+    def on_pan_start(self, event):
+        self._pan_anchor = (event.x, event.y)
+
+    def on_pan_drag(self, event):
+        """中键拖动平移视角（画面跟着鼠标走）"""
+        ax, ay = self._pan_anchor
+        self.camera.pan(ax - event.x, ay - event.y)
+        self._pan_anchor = (event.x, event.y)
+    
+    def update_game(self):
+        # Guard against destroyed widgets or stopped loop
+        if not self.running or not self.canvas.winfo_exists():
+            return
+        
+        current_time = time.time()
+        dt = (current_time - self.last_time) * self.game_speed  # 粒子等纯视觉效果按真实帧间隔推进
+        self.last_time = current_time
+        steps = self.sim_clock.advance(dt)
+        render = self.scheduler.begin_frame()
+        frame_t0 = time.perf_counter()
+        prof = self.profiler
+        if prof:
+            prof.begin()
+        
+        for _ in range(steps):
+            if not self.step(SIM_DT):
+                return
+            if self.battle_outcome() is not None:
+                break
+        if not render:
+            # 落后于截止时间：只推进模拟，本帧不绘制
+            self._after_id = self.root.after(self.scheduler.end_frame(), self.update_game)
+            return
+        units = self.player_units + self.all_enemies
         
         # 畫面
         try:
@@ -1189,19 +1867,37 @@ class GameWindow:
             # Canvas may have been destroyed; stop updating
             return
         
+        # 以下战场内容按世界座标绘制，只画视口（外扩 CULL_MARGIN）内的，画完整体平移到视口
+        camera = self.camera
+        view = camera.rect(CULL_MARGIN)
         # 背景 - 绘制战场分界线
-        self.canvas.create_rectangle(0, 0, 1000, 600, fill="#0F1419")
+        self.canvas.create_rectangle(camera.x, camera.y, camera.x + camera.view_width, camera.y + camera.view_height,
+                                     fill="#0F1419")
         # 中线（战场中间）
-        self.canvas.create_line(0, 300, 1000, 300, fill=DARK_GOLD, width=2, dash=(10, 5))
-        self.canvas.create_text(500, 300, text="═══ 战场中线 ═══", fill=DARK_GOLD, font=("Arial", 10, "italic"))
+        mid_x, mid_y = camera.x + camera.view_width / 2, self.world_height / 2
+        self.canvas.create_line(view[0], mid_y, view[2], mid_y, fill=DARK_GOLD, width=2, dash=(10, 5))
+        self.canvas.create_text(mid_x, mid_y, text="═══ 战场中线 ═══", fill=DARK_GOLD, font=("Arial", 10, "italic"))
+        # 地形障碍（河流/城墙在下，桥和城门覆盖在上）
+        if self.nav is not None:
+            for ob in sorted(self.nav.obstacles, key=lambda o: o["kind"] in PASSABLE):
+                if ob["x1"] >= view[0] and ob["x0"] <= view[2] and ob["y1"] >= view[1] and ob["y0"] <= view[3]:
+                    self.canvas.create_rectangle(ob["x0"], ob["y0"], ob["x1"], ob["y1"],
+                                                 fill=OBSTACLE_COLORS.get(ob["kind"], GRAY), outline="")
+        if prof:
+            prof.lap("clear")
         
         # 城堡
-        self.player_castle.draw(self.canvas)
-        self.enemy_castle.draw(self.canvas)
-        
-        # 單位
-        for u in units:
+        for castle in [self.player_castle] + self.enemy_castles:
+            if (castle is self.player_castle or castle is self.enemy_castle or castle.hp > 0) \
+                    and camera.contains(castle.pos[0], castle.pos[1], CULL_MARGIN + 40):
+                castle.draw(self.canvas)
+        
+        # 單位：空间索引按视口矩形取出，按 y 排序让靠下的单位画在上层
+        visible = sorted(self.unit_grid.query_rect(*view), key=lambda u: u.pos[1])
+        detail = self.lod.detail(len(visible))
+        for u in visible:
             if u.hp > 0:
+                focused = u is self.selected_unit
                 # 显示选中单位的高亮圈
                 if self.selected_unit == u:
                     self.canvas.create_oval(
@@ -1211,7 +1907,7 @@ class GameWindow:
                     )
                 
                 # 显示攻击范围（如果开启） - 使用兵种攻击范围
-                if self.show_ranges:
+                if self.show_ranges and (detail.ranges or focused):
                     range_color = "#4040FF" if u.team == 0 else "#FF4040"
                     attack_range = get_attack_range(u.type)
                     self.canvas.create_oval(
@@ -1220,41 +1916,58 @@ class GameWindow:
                         outline=range_color, width=2, dash=(3, 3)
                     )
                 # 显示仇恨线
-                if u.target_enemy and u.target_enemy.hp > 0:
+                if (detail.aggro or focused) and u.target_enemy and u.target_enemy.hp > 0:
                     line_color = BLUE if u.team == 0 else RED
                     self.canvas.create_line(
                         u.pos[0], u.pos[1],
                         u.target_enemy.pos[0], u.target_enemy.pos[1],
                         fill=line_color, width=1, dash=(2, 2), arrow=tk.LAST
                     )
-                u.draw(self.canvas)
-        
-        # 傷害數字
-        new_damage_texts = []
-        for pos, dmg, t in self.damage_texts:
+                u.draw(self.canvas, detail)
+        
+        # 箭矢
+        if detail.projectiles:
+            for hx, hy, tx, ty, team in self.projectiles.segments():
+                if camera.contains(hx, hy, CULL_MARGIN):
+                    self.canvas.create_line(tx, ty, hx, hy, fill=CYAN if team == 0 else ACCENT, width=2)
+        
+        # 傷害數字（LOD 较高时按区域合并或不画，但照常老化）
+        on_screen = [d for d in self.damage_texts if camera.contains(d[0][0], d[0][1], CULL_MARGIN)]
+        if detail.damage == "merge":
+            shown = merge_damage_texts(on_screen)
+        else:
+            shown = on_screen if detail.damage else ()
+        for pos, dmg, t in shown:
             self.canvas.create_text(
                 pos[0], pos[1] - (30 - t),
                 text=str(dmg),
                 fill=YELLOW,
                 font=("Arial", 10)
             )
-            if t > 1:
-                new_damage_texts.append((pos, dmg, t - 1))
-        self.damage_texts = new_damage_texts
+        self.damage_texts = [(pos, dmg, t - 1) for pos, dmg, t in self.damage_texts if t > 1]
+        if prof:
+            prof.lap("draw")
         
         # Update and render particles
         new_particles = []
         for particle in self.particles:
             particle.update(dt)
             if particle.life > 0:
-                # Calculate alpha for fade effect
-                alpha_ratio = particle.life / particle.max_life
-                particle.draw(self.canvas, int(255 * alpha_ratio))
+                if camera.contains(particle.x, particle.y, CULL_MARGIN):
+                    # Calculate alpha for fade effect
+                    alpha_ratio = particle.life / particle.max_life
+                    particle.draw(self.canvas, int(255 * alpha_ratio))
                 new_particles.append(particle)
         self.particles = new_particles
+        # 战场内容平移到视口，之后的 HUD 按画布座标绘制
+        if camera.x or camera.y:
+            self.canvas.move("all", -camera.x, -camera.y)
+        if prof:
+            prof.lap("particles")
         
         # 檢查勝負
-        if self.player_castle.hp <= 0:
+        outcome = self.battle_outcome()
+        if outcome == "defeat":
             self.canvas.create_text(500, 300, text="失敗！", fill=RED, font=("Arial", 40))
             self.canvas.update()
             # Reward small consolation
@@ -1262,57 +1975,16 @@ class GameWindow:
             self.player.save()
             self.root.after(1500, self.on_close)
             return
-        elif self.enemy_castle.hp <= 0:
+        elif outcome is not None:
             # 检查是否完成全部波次
-            if self.wave > self.max_waves:
+            if outcome == "chapter_clear":
                 # 关卡完成
                 self.canvas.delete("all")
                 self.canvas.create_rectangle(0, 0, 1000, 600, fill=GRAY)
                 self.canvas.create_text(500, 200, text="關卡完成！", fill=YELLOW, font=("Arial", 48, "bold"))
-                reward_gold = 500 + (self.chapter - 1) * 100
-                reward_gems = 100 + (self.chapter - 1) * 20
-                
-                # Award experience to surviving team members
-                base_exp = 80 + (self.chapter - 1) * 20  # More exp for higher chapters
-                exp_gains = []
-                level_ups = []
-                for i, card in enumerate(self.team_cards[:3]):
-                    # Check if unit survived (corresponding player_unit still has hp > 0)
-                    if i < len(self.player_units) and self.player_units[i].hp > 0:
-                        exp_to_give = base_exp
-                        leveled_up = card.add_exp(exp_to_give)
-                        exp_gains.append(f"{card.name} +{exp_to_give}經驗")
-                        if leveled_up:
-                            level_ups.append(f"{card.name} 升級至 Lv{card.level}！")
-                
-                self.player.gold += reward_gold
-                self.player.gems += reward_gems
-                
-                # Award equipment drops (random chance)
-                from data import EQUIPMENT_CATALOG
-                equipment_drops = []
-                if random.random() < 0.6:  # 60% chance to drop equipment
-                    # Select random equipment based on chapter
-                    if self.chapter >= 3:
-                        rarity_pool = ["SR", "SR", "R", "R", "C"]
-                    elif self.chapter >= 2:
-                        rarity_pool = ["R", "R", "R", "C", "C"]
-                    else:
-                        rarity_pool = ["R", "C", "C", "C"]
-                    
-                    drop_rarity = random.choice(rarity_pool)
-                    slot = random.choice(["weapon", "horse", "book"])
-                    available = [e for e in EQUIPMENT_CATALOG[slot] if e["rarity"] == drop_rarity]
-                    
-                    if available:
-                        dropped = random.choice(available)
-                        self.player.equipment_inventory.append({
-                            "id": dropped["id"],
-                            "slot": slot,
-                            "equipped_to": None
-                        })
-                        equipment_drops.append(f"[{dropped['rarity']}] {dropped['name']}")
-                
+                reward_gold, reward_gems, exp_gains, level_ups, equipment_drops = self.grant_chapter_rewards()
+                if self.combat.boss_kills:
+                    self.player.update_quest_progress("weekly", "weekly_3")
                 self.player.save()
                 
                 # Display rewards
@@ -1340,6 +2012,10 @@ class GameWindow:
                         self.canvas.create_text(500, y_offset, text=f"⭐ {lv_msg}", fill=YELLOW, font=("Arial", 13, "bold"))
                         y_offset += 25
                 
+                top = self.combat.top_damage(1)
+                if top:
+                    self.canvas.create_text(500, 455, text=f"🗡 输出最高: {top[0][0]} ({int(top[0][1])})",
+                                           fill=LIGHT_GRAY, font=("Arial", 11))
                 self.canvas.create_text(500, 480, text=f"第 {self.chapter} 章完成！", fill=YELLOW, font=("Arial", 14))
                 self.canvas.update()
                 self.root.after(3500, self.on_close)
@@ -1380,16 +2056,28 @@ class GameWindow:
         self.canvas.create_rectangle(780, 35, 780 + 200*enemy_hp_pct, 52, fill=RED, outline="")
         self.canvas.create_text(880, 43, text=f"{max(0, int(self.enemy_castle.hp))}/{self.enemy_castle.max_hp}", 
                                fill=WHITE, font=("Arial", 10, "bold"))
+        # 当前细节层级
+        self.canvas.create_text(980, 62, text=f"{self.lod.hud_text()} · {self.scheduler.hud_text()}", fill=YELLOW if self.lod.level else LIGHT_GRAY,
+                                font=("Arial", 8), anchor="ne")
         
         # 底部控制栏
         if not self.waiting_for_event:
             self.draw_controls()
         else:
             self.draw_wave_prep()
+        if self.minimap is not None:
+            self.draw_minimap(units)
+        if self.show_profiler and prof:
+            self.draw_profiler_overlay()
+        if prof:
+            prof.lap("hud")
         
         self.canvas.update()
-        # Schedule next frame safely
-        self._after_id = self.root.after(16, self.update_game)  # 60 FPS
+        if prof:
+            prof.lap("present")
+        self.lod.record((time.perf_counter() - frame_t0) * 1000)
+        # 按目标帧周期的截止时间排下一帧（扣除本帧耗时）
+        self._after_id = self.root.after(self.scheduler.end_frame(), self.update_game)
     def draw_wave_prep(self):
         """绘制波间准备界面"""
         # 控制栏背景
@@ -1509,6 +2197,24 @@ class GameWindow:
         else:
             messagebox.showwarning("金币不足", "刷新需要50金币！")
     
+    def show_hits(self, batch):
+        """把本帧结算的命中批次转成伤害数字、克制提示和粒子"""
+        for hit in batch:
+            target = hit.target
+            pos = target.pos
+            self.damage_texts.append((pos[:], int(hit.damage), 30))
+            if hit.kind == HIT_ATTACK:
+                # 显示类型优势反馈（SanZhenZhi 风格）
+                if hit.multiplier > 1.0:
+                    self.damage_texts.append((pos[:], "⭐克制!", 60))
+                elif hit.multiplier < 1.0:
+                    self.damage_texts.append((pos[:], "✗劣势", 60))
+            if hit.kind == HIT_SKILL:
+                color = SKILL_HIT_COLORS.get(hit.source.skill.get("effect"), YELLOW)
+                self.particles.append(Particle(pos[0], pos[1], color, life=1.0, vx=0, vy=-40))
+            elif hit.kind != HIT_BOSS:
+                self.particles.append(Particle(pos[0], pos[1], RED if target.team == 1 else BLUE, life=0.8, vx=0, vy=-30))
+
     def use_shop_item(self, item):
         """使用商店物品"""
         effect = item['effect']
@@ -1520,144 +2226,32 @@ class GameWindow:
                     u.hp = min(u.max_hp, u.hp + item['value'])
         
         elif effect == 'atk_boost':
-            # 临时攻击力增益
+            # 临时攻击力增益（持续 duration 秒）
+            source = self.new_modifier_source(effect)
             for u in self.player_units:
-                u.atk = int(u.atk * (1 + item['value']))
+                self.add_modifier(source, u, "atk", "mul", 1 + item['value'], item.get('duration'))
         
         elif effect == 'def_boost':
             # 临时防御增益
-            self.damage_reduction += item['value']
+            source = self.new_modifier_source(effect)
+            for u in self.player_units:
+                self.add_modifier(source, u, "damage_reduction", "add", item['value'], item.get('duration'))
         
         elif effect == 'speed_boost':
             # 移动速度增益
+            source = self.new_modifier_source(effect)
             for u in self.player_units:
-                u.speed *= (1 + item['value'])
+                self.add_modifier(source, u, "speed", "mul", 1 + item['value'], item.get('duration'))
         
         elif effect == 'super_potion':
             # 超级药水
+            source = self.new_modifier_source(effect)
             for u in self.player_units:
                 u.hp = min(u.max_hp, u.hp + item['value'])
-                u.atk = int(u.atk * 1.3)
+                self.add_modifier(source, u, "atk", "mul", 1.3, item.get('duration'))
         
         messagebox.showinfo("购买成功", f"已购买: {item['name']}")
     
-    def select_event(self, idx):
-        """选择波间事件"""
-        if 0 <= idx < len(self.event_choices):
-            self.apply_event(self.event_choices[idx])
-            self.waiting_for_event = False
-    
-    def apply_event(self, event):
-        """应用波间事件效果"""
-        effect = event['effect']
-        
-        # 基础波间事件
-        if effect == 'heal':
-            # 恢复所有单位25% HP
-            for u in self.player_units:
-                if u.hp > 0:
-                    u.hp = min(u.max_hp, u.hp + u.max_hp * 0.25)
-        
-        elif effect == 'curse':
-            # 敌方下波攻击降低20%
-            for u in self.all_enemies:
-                u.atk *= 0.8
-        
-        elif effect == 'fewer_enemies':
-            # 下波敌人减少1个
-            if self.all_enemies:
-                self.all_enemies.pop()
-        
-        elif effect == 'slow':
-            # 所有单位速度降低30%
-            for u in self.player_units + self.all_enemies:
-                u.speed *= 0.7
-        
-        # Roguelite增益效果
-        elif 'type' in event and event['type'] == 'buff':
-            buff_name = event['name']
-            self.active_buffs.append(buff_name)
-            
-            if buff_name == 'atk_speed':
-                # 攻击速度+30%（缩短攻击间隔）
-                for u in self.player_units:
-                    u.attack_interval *= 0.7
-            elif buff_name == 'crit':
-                # 暴击率+25%
-                self.crit_chance = 0.25
-            elif buff_name == 'move_speed':
-                # 移动速度+40%
-                for u in self.player_units:
-                    u.speed *= 1.4
-            elif buff_name == 'lifesteal':
-                # 生命偷取+15%
-                self.lifesteal_rate = 0.15
-            elif buff_name == 'armor':
-                # 护甲+25%
-                self.damage_reduction = 0.25
-            elif buff_name == 'cooldown':
-                # 技能冷却-40%
-                for u in self.player_units:
-                    if hasattr(u, 'cooldown'):
-                        u.cooldown *= 0.6
-        
-        # Roguelite诅咒效果
-        elif 'type' in event and event['type'] == 'curse':
-            curse_name = event['name']
-            self.active_curses.append(curse_name)
-            
-            if curse_name == 'weakness':
-                # 攻击力-30%
-                for u in self.player_units:
-                    u.atk *= 0.7
-            elif curse_name == 'curse_slow':
-                # 移动速度-50%
-                for u in self.player_units:
-                    u.speed *= 0.5
-            elif curse_name == 'curse_fragile':
-                # 受伤增加40%
-                self.damage_reduction = -0.4
-        
-        # Roguelite交易效果
-        elif 'type' in event and event['type'] == 'trade':
-            trade_name = event['name']
-            
-            if trade_name == 'trade_double_buff':
-                # 花费100金币获得2个随机增益
-                if self.player.gold >= 100:
-                    self.player.gold -= 100
-                    buffs = random.sample(ROGUELITE_BUFFS, min(2, len(ROGUELITE_BUFFS)))
-                    for buff in buffs:
-                        self.apply_event(buff)
-            
-            elif trade_name == 'trade_remove_curse':
-                # 花费80金币移除一个诅咒
-                if self.player.gold >= 80 and self.active_curses:
-                    self.player.gold -= 80
-                    removed_curse = self.active_curses.pop(0)
-                    # 还原诅咒效果
-                    if removed_curse == 'weakness':
-                        for u in self.player_units:
-                            u.atk /= 0.7
-                    elif removed_curse == 'curse_slow':
-                        for u in self.player_units:
-                            u.speed /= 0.5
-                    elif removed_curse == 'curse_fragile':
-                        self.damage_reduction = 0
-            
-            elif trade_name == 'trade_gamble':
-                # 花费50金币随机获得增益或诅咒
-                if self.player.gold >= 50:
-                    self.player.gold -= 50
-                    if random.random() < 0.5:
-                        buff = random.choice(ROGUELITE_BUFFS)
-                        self.apply_event(buff)
-                    else:
-                        curse = random.choice(ROGUELITE_CURSES)
-                        self.apply_event(curse)
-        
-        self.current_event = event
-
     def draw_controls(self):
         """绘制底部控制栏"""
         # 控制栏背景 - 更美观的设计
@@ -1670,7 +2264,7 @@ class GameWindow:
                               fill=CYAN, font=("Arial", 9, "bold"), anchor="w")
         
         # 显示兵种相克提示（SanZhenZhi 风格）
-        matchup_text = "槍克弓 | 弓克騎 | 騎克槍"
+        matchup_text = "槍克弓 | 弓克騎 | 騎克槍 | Shift+拖动: 全队阵型移动"
         self.canvas.create_text(10, 568, text=matchup_text, fill=YELLOW, 
                               font=("Arial", 8), anchor="w")
         
@@ -1746,13 +2340,63 @@ class GameWindow:
     def toggle_auto(self):
         """切换自动战斗"""
         self.auto_battle = not self.auto_battle
+        if not self.auto_battle:
+            self.auto_planner.reset(self.player_units)
     
     def toggle_ranges(self):
         """切换显示攻击范围"""
         self.show_ranges = not self.show_ranges
     
+    def toggle_profiler(self):
+        """切换帧计时叠加层（首次切换时开始计时）"""
+        if self.profiler is None:
+            self.profiler = FrameProfiler()
+        self.show_profiler = not self.show_profiler
+    
+    def cycle_fps_cap(self):
+        """切换帧率上限 60 → 30 → 不限"""
+        caps = list(FPS_CAPS)
+        current = caps.index(self.scheduler.fps) if self.scheduler.fps in caps else -1
+        self.scheduler.set_fps(caps[(current + 1) % len(caps)])
+    
+    def draw_minimap(self, units):
+        """右上角小地图：降采样的双方分布、城堡和当前视口框"""
+        self.minimap.update(units)
+        self.minimap.draw(self.canvas, self.minimap_origin, self.camera, [self.player_castle] + self.enemy_castles,
+                          colors=(BLUE, RED, YELLOW))
+        ox, oy = self.minimap_origin
+        self.canvas.create_text(ox, oy + self.minimap.height + 4, text="方向键/中键拖动: 平移视角",
+                                fill=LIGHT_GRAY, font=("Arial", 8), anchor="nw")
+
+    def draw_profiler_overlay(self):
+        """左上角显示各阶段 p50/p95/p99 耗时"""
+        lines = self.profiler.overlay_lines()
+        self.canvas.create_rectangle(10, 70, 290, 78 + 15 * len(lines), fill=BLACK, outline=DARK_GOLD, stipple="gray50")
+        for i, line in enumerate(lines):
+            self.canvas.create_text(18, 76 + 15 * i, text=line, fill=YELLOW if i == 0 else WHITE,
+                                    font=("Courier", 9), anchor="nw")
+    
+    def dump_profile(self):
+        """把帧计时结果写到存档目录下的 JSON"""
+        if self.profiler is None or not self.profiler.frames:
+            return None
+        path = os.path.join(os.path.dirname(os.path.abspath(self.player.path)),
+                            f"frame_profile_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            return self.profiler.dump(path, chapter=self.chapter, game_speed=self.game_speed,
+                                      units=len(self.player_units) + len(self.all_enemies),
+                                      scheduler=self.scheduler.stats())
+        except OSError:
+            return None
+    
     def on_close(self):
         # Stop loop and close window safely
+        if self.running and self.auto_battle and self.battle_outcome() is None:
+            # 自动战斗未分胜负时离开：记录章节和时间，退出游戏后到下次登录的时间离线结算
+            self.player.offline_chapter = self.chapter
+            self.player.last_active = time.time()
+            self.player.save()
+        self.dump_profile()
         self.running = False
         try:
             if self._after_id is not None:
@@ -1764,16 +2408,87 @@ class GameWindow:
         except Exception:
             pass
 
+UNIT_TYPE_NAMES = ["槍", "騎", "弓"]
+
+
+def hero_row(c):
+    return f"[{c.rarity}] {c.name} Lv{c.level} {'★' * c.stars + '☆' * (5 - c.stars)}"
+
+
+def roster_row(c):
+    return f"[{c.rarity}] {c.name} Lv{c.level} ({UNIT_TYPE_NAMES[c.unit_type]})"
+
+
+def card_list(parent, format_row=hero_row, **list_kw):
+    """武將列表（篩選/排序條 + 只格式化可見行的虛擬列表）"""
+    list_kw.setdefault("bg", LIGHT_GRAY)
+    list_kw.setdefault("fg", BLACK)
+    return CardList(parent, format_row, RARITY_ORDER, UNIT_TYPE_NAMES, bar_bg=BG_MAIN, bar_fg=TEXT_MAIN, **list_kw)
+
+
+def place_team_suggestion(parent, player, x, y, on_applied):
+    """推荐阵容：目标章节选择 + 一键按钮；写入 player.team 后调用 on_applied(suggestion)"""
+    chapters = [f"第 {cfg['chapter']} 章" for cfg in CHAPTER_CONFIGS]
+    chapter_var = tk.StringVar(value=chapters[0])
+    tk.OptionMenu(parent, chapter_var, *chapters).place(x=x, y=y, width=100)
+
+    def apply(chapter, label):
+        from teambuilder import suggest_team
+        suggestion = suggest_team(player.roster, chapter)
+        if not suggestion.cards:
+            messagebox.showinfo("提示", "沒有可用的武將")
+            return
+        player.team = [c.id for c in suggestion.cards]
+        on_applied(suggestion)
+        names = "、".join(c.name for c in suggestion.cards)
+        messagebox.showinfo("推荐阵容", f"{label}: {names}\n好友助戰: {suggestion.friend}\n"
+                                        f"預估勝率: {suggestion.win_chance:.0%}")
+
+    def suggest():
+        from teambuilder import cached_calibration, calibrate_in_background, store_calibration
+        label = chapter_var.get()
+        chapter = CHAPTER_CONFIGS[chapters.index(label)]['chapter']
+        if cached_calibration(chapter) is not None:
+            apply(chapter, label)
+            return
+        # 该章首次推荐要跑一批无界面战斗校准，放到子进程里，窗口保持响应
+        button.config(state=tk.DISABLED, text="⏳ 校准中…")
+        future = calibrate_in_background(chapter)
+
+        def poll():
+            if not future.done():
+                button.after(100, poll)
+                return
+            try:
+                store_calibration(chapter, future.result())
+            except Exception as e:
+                messagebox.showerror("错误", f"阵容校准失败: {e}")
+                return
+            finally:
+                if button.winfo_exists():
+                    button.config(state=tk.NORMAL, text="⚡ 推荐阵容")
+            if button.winfo_exists():
+                apply(chapter, label)
+
+        button.after(100, poll)
+
+    button = tk.Button(parent, text="⚡ 推荐阵容", command=suggest, bg=PURPLE, fg=WHITE,
+                       font=("Arial", 10, "bold"), relief=tk.RAISED, bd=1)
+    button.place(x=x + 110, y=y, width=120)
+
+
 class MainMenu:
-    def __init__(self, root):
+    def __init__(self, root, startup_timer=None):
         self.root = root
         self.root.title("三國戰爭")
         self.root.geometry("1000x600")
         self.root.configure(bg=BG_MAIN)
+        self.startup_timer = startup_timer
 
         self.save_path = get_save_path()
+        # 存档在主选单首次绘制后才读取（见 finish_startup）
         self.player = PlayerData(self.save_path)
-        self.player.load()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_quit)
         
         # Current view tracking
         self.current_view = None
@@ -1804,8 +2519,60 @@ class MainMenu:
         #     self.player.save()
 
         self.show_main_menu()
+        # 排在建窗产生的重绘之后执行
+        self.root.after_idle(self.finish_startup)
+    
+    def finish_startup(self):
+        """首帧画出后读取存档、刷新货币栏，并安排离线结算"""
+        timer = self.startup_timer
+        self.root.update_idletasks()
+        if timer:
+            timer.mark("主选单首帧")
+        self.player.load()
+        if timer:
+            timer.mark("读取存档")
         self.refresh_currency()
+        if timer:
+            timer.mark("刷新货币栏")
+            timer.report()
+        self.root.after(100, self.settle_offline_progress)
+    
+    def settle_offline_progress(self):
+        """登录时结算离线挂机收益"""
+        if not self.player.offline_chapter or not self.player.last_active:
+            return
+        from offline import settle_offline
+        id_map = self.player.cards_by_id()
+        team_cards = [id_map[cid] for cid in self.player.team if cid in id_map]
+        idle_seconds = time.time() - self.player.last_active
+        chapter = self.player.offline_chapter
+        self.player.offline_chapter = None
+        self.player.last_active = None
+        if team_cards and idle_seconds > 0:
+            report = settle_offline(self.player, team_cards, chapter, idle_seconds)
+            self.player.save()
+            self.refresh_currency()
+            if report.battles:
+                lines = [f"離線 {int(report.idle_seconds // 3600)} 小時 {int(report.idle_seconds % 3600 // 60)} 分",
+                         f"自動戰鬥 {report.battles} 場，通關 {report.wins} 場",
+                         f"金幣 {report.gold:+}  鑽石 +{report.gems}",
+                         f"裝備掉落 {len(report.equipment)} 件"]
+                for name, old_level, new_level in report.level_ups:
+                    lines.append(f"{name} Lv{old_level} → Lv{new_level}")
+                messagebox.showinfo("離線收益", "\n".join(lines))
+                return
+        self.player.save()
     
+    def on_quit(self):
+        """退出游戏：有挂机记录时把离开时间改为现在，留在菜单里的时间不算离线"""
+        if self.player.offline_chapter:
+            self.player.last_active = time.time()
+            try:
+                self.player.save()
+            except OSError:
+                pass
+        self.root.destroy()
+
     def clear_content(self):
         """清空內容區域"""
         for widget in self.content_frame.winfo_children():
@@ -1872,7 +2639,7 @@ class MainMenu:
         """打开关卡选择菜单"""
         stage_win = tk.Toplevel(self.root)
         stage_win.title("選擇關卡")
-        stage_win.geometry("500x400")
+        stage_win.geometry("500x480")
         stage_win.configure(bg=GRAY)
         
         tk.Label(stage_win, text="選擇要挑戰的關卡", fg=YELLOW, bg=GRAY, font=("Arial", 14, "bold")).pack(pady=20)
@@ -1891,6 +2658,9 @@ class MainMenu:
     def start_stage(self, team_cards, chapter, stage_win):
         """开始关卡"""
         stage_win.destroy()
+        # 玩家回来继续打了：之前留下的挂机记录作废
+        self.player.offline_chapter = None
+        self.player.last_active = None
         w = tk.Toplevel(self.root)
         game = GameWindow(w, self.player, team_cards, chapter=chapter)
         self.root.wait_window(w)
@@ -1971,7 +2741,7 @@ class MainMenu:
         tk.Label(left_frame, text="武將列表", fg=DARK_GOLD, bg=BG_MAIN,
                 font=("Arial", 13, "bold")).pack(pady=5)
         
-        list_heroes = tk.Listbox(left_frame, bg=LIGHT_GRAY, fg=BLACK, font=("Arial", 10))
+        list_heroes = card_list(left_frame)
         list_heroes.pack(fill=tk.BOTH, expand=True, pady=5)
         
         # 右側：詳情面板
@@ -1979,20 +2749,15 @@ class MainMenu:
         right_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Populate hero list and setup selection
-        for c in self.player.roster:
-            stars_display = "★" * c.stars + "☆" * (5 - c.stars)
-            display = f"[{c.rarity}] {c.name} Lv{c.level} {stars_display}"
-            list_heroes.insert(tk.END, display)
-        
+        list_heroes.set_cards(self.player.roster)
         if self.player.roster:
-            list_heroes.selection_set(0)
+            list_heroes.select(self.player.roster[0])
             self._show_hero_detail_inline(self.player.roster[0], right_frame, list_heroes)
         
         def on_select(event):
-            sel = list_heroes.curselection()
+            sel = list_heroes.selected()
             if sel:
-                idx = sel[0]
-                self._show_hero_detail_inline(self.player.roster[idx], right_frame, list_heroes)
+                self._show_hero_detail_inline(sel[0], right_frame, list_heroes)
         
         list_heroes.bind("<<ListboxSelect>>", on_select)
     
@@ -2061,9 +2826,10 @@ class MainMenu:
         for _ in range(steps):
             card.add_exp(card.exp_needed())
         self.player.gold -= gold_used
+        self.player.roster.update(card)
         self.player.save()
         self.refresh_currency()
-        self._refresh_hero_list(list_widget)
+        list_widget.card_changed(card)
         self._show_hero_detail_inline(card, parent_frame, list_widget)
         messagebox.showinfo("成功", f"升級{steps}級，消耗{gold_used}金")
     
@@ -2076,19 +2842,13 @@ class MainMenu:
             messagebox.showinfo("提示", f"碎片不足！需要{needed}碎片，目前有{card.shards}碎片")
             return
         card.rank_up()
+        self.player.roster.update(card)
         self.player.save()
         self.refresh_currency()
-        self._refresh_hero_list(list_widget)
+        list_widget.card_changed(card)
         self._show_hero_detail_inline(card, parent_frame, list_widget)
         messagebox.showinfo("成功", f"{card.name} 升至 {card.stars}星！")
     
-    def _refresh_hero_list(self, list_widget):
-        list_widget.delete(0, tk.END)
-        for c in self.player.roster:
-            stars_display = "★" * c.stars + "☆" * (5 - c.stars)
-            display = f"[{c.rarity}] {c.name} Lv{c.level} {stars_display}"
-            list_widget.insert(tk.END, display)
-    
     def show_gacha_view(self):
         frame = tk.Frame(self.content_frame, bg=BG_MAIN)
         frame.pack(fill=tk.BOTH, expand=True)
@@ -2137,43 +2897,7 @@ class MainMenu:
                 messagebox.showwarning("鑽石不足", "鑽石不足，無法抽卡。")
                 return
             self.player.gems -= cost
-            pulls = []
-            shard_conversions = []
-            equipment_bonus = []
-
-            for _ in range(count):
-                rarity = choose_weighted(RARITY_WEIGHTS)
-                hero = random.choice(HERO_POOL)
-                existing_card = next((c for c in self.player.roster if c.name == hero["name"]), None)
-                if existing_card:
-                    shard_amount = 10
-                    if rarity == "SSR":
-                        shard_amount = 30
-                    elif rarity == "SR":
-                        shard_amount = 20
-                    elif rarity == "R":
-                        shard_amount = 15
-                    existing_card.shards += shard_amount
-                    shard_conversions.append((hero["name"], shard_amount, rarity))
-                else:
-                    c = Card(hero["name"], hero["type"], rarity, level=1,
-                             base_hp=hero["base_hp"], base_atk=hero["base_atk"], base_speed=hero["base_speed"])
-                    self.player.add_card(c)
-                    pulls.append(c)
-
-            if count == 10:
-                from data import EQUIPMENT_CATALOG
-                bonus_rarity = random.choices(["SR", "R", "R", "C"], weights=[15, 40, 30, 15])[0]
-                bonus_slot = random.choice(["weapon", "horse", "book"])
-                available = [e for e in EQUIPMENT_CATALOG[bonus_slot] if e["rarity"] == bonus_rarity]
-                if available:
-                    bonus_equip = random.choice(available)
-                    self.player.equipment_inventory.append({
-                        "id": bonus_equip["id"],
-                        "slot": bonus_slot,
-                        "equipped_to": None
-                    })
-                    equipment_bonus.append(f"[{bonus_equip['rarity']}] {bonus_equip['name']}")
+            pulls, shard_conversions, equipment_bonus = summon_pulls(self.player, count)
 
             self.player.save()
             self.refresh_currency()
@@ -2193,16 +2917,13 @@ class MainMenu:
         tk.Label(frame, text="⚔ 出戰隊伍 (最多3)", fg=DARK_GOLD, bg=BG_MAIN,
                  font=("Arial", 14, "bold")).place(x=470, y=10)
 
-        list_roster = tk.Listbox(frame, width=40, height=22, selectmode=tk.MULTIPLE,
-                                 bg=LIGHT_GRAY, fg=BLACK, font=("Arial", 10))
+        list_roster = card_list(frame, roster_row, width=40, height=20, selectmode=tk.MULTIPLE)
         list_roster.place(x=20, y=40)
+        list_roster.set_cards(self.player.roster)
         list_team = tk.Listbox(frame, width=40, height=10, bg=CREAM, fg=BLACK, font=("Arial", 10))
         list_team.place(x=470, y=40)
 
         def refresh_lists():
-            list_roster.delete(0, tk.END)
-            for c in self.player.roster:
-                list_roster.insert(tk.END, f"[{c.rarity}] {c.name} Lv{c.level} ({['槍','騎','弓'][c.unit_type]})")
             list_team.delete(0, tk.END)
             id_map = self.player.cards_by_id()
             for cid in self.player.team:
@@ -2211,11 +2932,10 @@ class MainMenu:
                     list_team.insert(tk.END, f"[{c.rarity}] {c.name} Lv{c.level}")
 
         def add_to_team():
-            sel = list_roster.curselection()
+            sel = list_roster.selected()
             if not sel:
                 return
-            idx = sel[0]
-            card = self.player.roster[idx]
+            card = sel[0]
             if card.id in self.player.team:
                 messagebox.showinfo("提示", "此武將已在隊伍中")
                 return
@@ -2226,13 +2946,12 @@ class MainMenu:
             refresh_lists()
 
         def add_to_team_multi():
-            sel = list_roster.curselection()
+            sel = list_roster.selected()
             if not sel:
                 messagebox.showinfo("提示", "請選擇至少一名武將")
                 return
             added_count = 0
-            for idx in sel:
-                card = self.player.roster[idx]
+            for card in sel:
                 if card.id not in self.player.team and len(self.player.team) < 3:
                     self.player.team.append(card.id)
                     added_count += 1
@@ -2278,6 +2997,11 @@ class MainMenu:
         tk.Label(frame, text="戰鬥中的輔助單位", fg=TEXT_MAIN, bg=BG_MAIN,
                  font=("Arial", 9)).place(x=470, y=385)
 
+        def apply_suggestion(suggestion):
+            self.friend_combo.set(suggestion.friend)  # 触发保存
+            refresh_lists()
+        place_team_suggestion(frame, self.player, 470, 420, apply_suggestion)
+
         refresh_lists()
     
     def show_quest_view(self):
@@ -2358,8 +3082,7 @@ class HeroDetailWindow:
         tk.Label(self.win, text="武將列表", fg=DARK_GOLD, bg=BG_MAIN, 
                 font=("Arial", 13, "bold")).place(x=20, y=10)
         
-        self.list_heroes = tk.Listbox(self.win, width=35, height=28,
-                                      bg=LIGHT_GRAY, fg=BLACK, font=("Arial", 10))
+        self.list_heroes = card_list(self.win, width=35, height=25)
         self.list_heroes.place(x=20, y=40)
         self.list_heroes.bind("<<ListboxSelect>>", self.on_select_hero)
         
@@ -2371,25 +3094,23 @@ class HeroDetailWindow:
         self.refresh_hero_list()
     
     def refresh_hero_list(self):
-        """刷新武將列表"""
-        self.list_heroes.delete(0, tk.END)
-        for c in self.player.roster:
-            hp, atk, spd = c.stats()
-            stars_display = "★" * c.stars + "☆" * (5 - c.stars)
-            display = f"[{c.rarity}] {c.name} Lv{c.level} {stars_display}"
-            self.list_heroes.insert(tk.END, display)
-            # Auto-select first hero if list is not empty
-            if self.player.roster:
-                self.list_heroes.selection_set(0)
-                self.selected_card = self.player.roster[0]
-                self.show_hero_detail()
+        """刷新武將列表；已選中的武將只重新格式化其所在行"""
+        if self.selected_card is not None:
+            self.list_heroes.card_changed(self.selected_card)
+            return
+        self.list_heroes.set_cards(self.player.roster)
+        # Auto-select first hero if list is not empty
+        if self.player.roster:
+            self.selected_card = self.player.roster[0]
+            self.list_heroes.select(self.selected_card)
+            self.show_hero_detail()
+
     def on_select_hero(self, event):
         """選中武將時顯示詳情"""
-        sel = self.list_heroes.curselection()
+        sel = self.list_heroes.selected()
         if not sel:
             return
-        idx = sel[0]
-        self.selected_card = self.player.roster[idx]
+        self.selected_card = sel[0]
         self.show_hero_detail()
     
     def show_hero_detail(self):
@@ -2476,7 +3197,7 @@ class HeroDetailWindow:
                 font=("Arial", 11)).pack(pady=2)
         
         # 裝備顯示
-        from data import EQUIPMENT_CATALOG, EQUIPMENT_RARITY_COLOR
+        equip = equipment_data()
         equip_frame = tk.Frame(self.detail_frame, bg=GRAY, relief=tk.RAISED, bd=2)
         equip_frame.pack(pady=10, padx=20, fill=tk.X)
         tk.Label(equip_frame, text="⚔ 裝備", fg=DARK_GOLD, bg=GRAY,
@@ -2494,9 +3215,9 @@ class HeroDetailWindow:
             # Current equipment display
             equip_id = c.equipment.get(slot)
             if equip_id and equip_id != "None":
-                equip_data = next((e for e in EQUIPMENT_CATALOG[slot] if e["id"] == equip_id), None)
+                equip_data = equip.by_id[slot].get(equip_id)
                 if equip_data:
-                    color = EQUIPMENT_RARITY_COLOR.get(equip_data["rarity"], WHITE)
+                    color = equip.rarity_color.get(equip_data["rarity"], WHITE)
                     equip_text = f"[{equip_data['rarity']}] {equip_data['name']}"
                     tk.Label(slot_frame, text=equip_text, fg=color, bg="#34495E",
                             font=("Arial", 9)).pack(side=tk.LEFT, padx=5)
@@ -2512,6 +3233,13 @@ class HeroDetailWindow:
                           font=("Arial", 8), width=6,
                           command=lambda s=slot: self.change_equipment(s))
             btn.pack(side=tk.RIGHT, padx=5)
+
+        auto_row = tk.Frame(equip_frame, bg=GRAY)
+        auto_row.pack(pady=4)
+        tk.Button(auto_row, text="一鍵配裝 (隊伍)", command=lambda: self.auto_equip(team_only=True),
+                  bg=PURPLE, fg=WHITE, font=("Arial", 9, "bold")).pack(side=tk.LEFT, padx=4)
+        tk.Button(auto_row, text="一鍵配裝 (全部武將)", command=lambda: self.auto_equip(team_only=False),
+                  bg=PURPLE, fg=WHITE, font=("Arial", 9, "bold")).pack(side=tk.LEFT, padx=4)
         
         # 操作按鈕
         btn_frame = tk.Frame(self.detail_frame, bg=BG_MAIN)
@@ -2542,13 +3270,35 @@ class HeroDetailWindow:
                                     state=tk.NORMAL if can_rankup else tk.DISABLED)
             btn_rank_up.pack(pady=5)
     
+    def auto_equip(self, team_only=True):
+        """按加權屬性最優分配庫存裝備，一次保存"""
+        from autoequip import auto_equip
+        if team_only:
+            id_map = self.player.cards_by_id()
+            cards = [id_map[cid] for cid in self.player.team if cid in id_map]
+        else:
+            cards = list(self.player.roster)
+        if not cards:
+            messagebox.showinfo("提示", "沒有可配裝的武將")
+            return
+        try:
+            changes = auto_equip(self.player, cards)
+        except OSError as e:
+            messagebox.showerror("錯誤", f"存檔失敗，裝備未變更：{e}")
+            return
+        self.show_hero_detail()
+        if self.on_close:
+            self.on_close()
+        messagebox.showinfo("完成", f"已為 {len({ch.card.id for ch in changes})} 名武將調整 {len(changes)} 件裝備"
+                            if changes else "目前已是最優配裝")
+
     def change_equipment(self, slot):
         """更換裝備的彈窗選擇"""
         c = self.selected_card
         if not c:
             return
         
-        from data import EQUIPMENT_CATALOG, EQUIPMENT_RARITY_COLOR
+        by_id = equipment_data().by_id
         
         # Create selection window
         select_win = tk.Toplevel(self.win)
@@ -2563,32 +3313,21 @@ class HeroDetailWindow:
         list_frame = tk.Frame(select_win, bg=BG_MAIN)
         list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        scrollbar = tk.Scrollbar(list_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        def equip_row(equip_id):
+            if equip_id is None:
+                return "【卸下裝備】"
+            equip_data = by_id[slot][equip_id]
+            status = " (已裝備)" if c.equipment.get(slot) == equip_id else ""
+            return f"[{equip_data['rarity']}] {equip_data['name']} | HP+{equip_data['hp']} ATK+{equip_data['atk']} SPD+{equip_data['speed']}{status}"
         
-        listbox = tk.Listbox(list_frame, bg=GRAY, fg=WHITE, font=("Arial", 10),
-                            selectmode=tk.SINGLE, yscrollcommand=scrollbar.set)
-        listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.config(command=listbox.yview)
-        
-        # Add "卸下裝備" option
-        listbox.insert(tk.END, "【卸下裝備】")
-        equip_list = [None]  # None represents unequip
-        
-        # Get available equipment from inventory
-        available_equipment = [e for e in self.player.equipment_inventory 
-                              if e["slot"] == slot and (e.get("equipped_to") is None or e.get("equipped_to") == c.id)]
-        
-        # Add equipment to list
-        for equip_item in available_equipment:
-            equip_id = equip_item["id"]
-            equip_data = next((e for e in EQUIPMENT_CATALOG[slot] if e["id"] == equip_id), None)
-            if equip_data:
-                is_equipped = c.equipment.get(slot) == equip_id
-                status = " (已裝備)" if is_equipped else ""
-                display_text = f"[{equip_data['rarity']}] {equip_data['name']} | HP+{equip_data['hp']} ATK+{equip_data['atk']} SPD+{equip_data['speed']}{status}"
-                listbox.insert(tk.END, display_text)
-                equip_list.append(equip_id)
+        listbox = VirtualList(list_frame, equip_row, key=lambda equip_id: equip_id, height=12, bg=GRAY, fg=WHITE)
+        listbox.pack(fill=tk.BOTH, expand=True)
+        
+        # None represents unequip; available equipment from inventory (rows formatted only when visible)
+        equip_list = [None] + [e["id"] for e in self.player.equipment_inventory
+                               if e["slot"] == slot and (e.get("equipped_to") is None or e.get("equipped_to") == c.id)
+                               and e["id"] in by_id[slot]]
+        listbox.set_items(equip_list)
         
         # Buttons
         btn_frame = tk.Frame(select_win, bg=BG_MAIN)
@@ -2611,16 +3350,17 @@ class HeroDetailWindow:
                         inv_item["equipped_to"] = None
                         break
             
-            # Equip new equipment
+            # Equip new equipment（同 id 可能有多件，取空閒的一件）
             if selected_equip_id:
                 c.equipment[slot] = selected_equip_id
                 for inv_item in self.player.equipment_inventory:
-                    if inv_item["id"] == selected_equip_id:
+                    if inv_item["id"] == selected_equip_id and inv_item.get("equipped_to") is None:
                         inv_item["equipped_to"] = c.id
                         break
             else:
                 c.equipment[slot] = None
             
+            self.player.roster.update(c)
             self.player.save()
             self.show_hero_detail()
             if self.on_close:
@@ -2661,6 +3401,7 @@ class HeroDetailWindow:
             if c.level >= 50:
                 break
         self.player.gold -= gold_used
+        self.player.roster.update(c)
         self.player.save()
         self.refresh_hero_list()
         self.show_hero_detail()
@@ -2675,6 +3416,7 @@ class HeroDetailWindow:
         success, msg = c.rank_up()
         
         if success:
+            self.player.roster.update(c)
             self.player.save()
             self.refresh_hero_list()
             self.show_hero_detail()
@@ -2723,52 +3465,7 @@ class GachaWindow:
             messagebox.showwarning("鑽石不足", "鑽石不足，無法抽卡。")
             return
         self.player.gems -= cost
-        pulls = []
-        shard_conversions = []  # Track duplicates converted to shards
-        equipment_bonus = []  # Track equipment rewards from 10-pull
-        
-        for _ in range(count):
-            rarity = choose_weighted(RARITY_WEIGHTS)
-            hero = random.choice(HERO_POOL)
-            
-            # Check if player already has this hero
-            existing_card = next((c for c in self.player.roster if c.name == hero["name"]), None)
-            
-            if existing_card:
-                # Duplicate! Convert to shards instead
-                shard_amount = 10  # Base shards per duplicate
-                if rarity == "SSR":
-                    shard_amount = 30
-                elif rarity == "SR":
-                    shard_amount = 20
-                elif rarity == "R":
-                    shard_amount = 15
-                
-                existing_card.shards += shard_amount
-                shard_conversions.append((hero["name"], shard_amount, rarity))
-            else:
-                # New hero! Add to roster
-                c = Card(hero["name"], hero["type"], rarity, level=1,
-                         base_hp=hero["base_hp"], base_atk=hero["base_atk"], base_speed=hero["base_speed"])
-                self.player.add_card(c)
-                pulls.append(c)
-        
-        # 10-pull bonus: guaranteed equipment
-        if count == 10:
-            from data import EQUIPMENT_CATALOG
-            # Higher chance for better equipment in 10-pull
-            bonus_rarity = random.choices(["SR", "R", "R", "C"], weights=[15, 40, 30, 15])[0]
-            bonus_slot = random.choice(["weapon", "horse", "book"])
-            available = [e for e in EQUIPMENT_CATALOG[bonus_slot] if e["rarity"] == bonus_rarity]
-            
-            if available:
-                bonus_equip = random.choice(available)
-                self.player.equipment_inventory.append({
-                    "id": bonus_equip["id"],
-                    "slot": bonus_slot,
-                    "equipped_to": None
-                })
-                equipment_bonus.append(f"[{bonus_equip['rarity']}] {bonus_equip['name']}")
+        pulls, shard_conversions, equipment_bonus = summon_pulls(self.player, count)
         
         self.player.save()
         self.show_results(pulls, shard_conversions, equipment_bonus)
@@ -2850,9 +3547,9 @@ class TeamWindow:
                 font=("Arial", 14, "bold")).place(x=470, y=10)
 
         # 支持多选的列表框
-        self.list_roster = tk.Listbox(self.win, width=40, height=22, selectmode=tk.MULTIPLE,
-                                     bg=LIGHT_GRAY, fg=BLACK, font=("Arial", 10))
+        self.list_roster = card_list(self.win, roster_row, width=40, height=20, selectmode=tk.MULTIPLE)
         self.list_roster.place(x=20, y=40)
+        self.list_roster.set_cards(self.player.roster)
         
         self.list_team = tk.Listbox(self.win, width=40, height=10, 
                                    bg=CREAM, fg=BLACK, font=("Arial", 10))
@@ -2879,13 +3576,11 @@ class TeamWindow:
         friend_menu.place(x=470, y=355, width=200)
         tk.Label(self.win, text="戰鬥中的輔助單位", fg=TEXT_MAIN, bg=BG_MAIN, 
                 font=("Arial", 9)).place(x=470, y=385)
+        place_team_suggestion(self.win, self.player, 470, 420, self.apply_suggestion)
 
         self.refresh_lists()
 
     def refresh_lists(self):
-        self.list_roster.delete(0, tk.END)
-        for c in self.player.roster:
-            self.list_roster.insert(tk.END, f"[{c.rarity}] {c.name} Lv{c.level} ({['槍','騎','弓'][c.unit_type]})")
         self.list_team.delete(0, tk.END)
         id_map = self.player.cards_by_id()
         for cid in self.player.team:
@@ -2895,11 +3590,10 @@ class TeamWindow:
 
     def add_to_team(self):
         """添加单个卡片到队伍"""
-        sel = self.list_roster.curselection()
+        sel = self.list_roster.selected()
         if not sel:
             return
-        idx = sel[0]
-        card = self.player.roster[idx]
+        card = sel[0]
         if card.id in self.player.team:
             messagebox.showinfo("提示", "此武將已在隊伍中")
             return
@@ -2911,14 +3605,13 @@ class TeamWindow:
     
     def add_to_team_multi(self):
         """多选添加卡片到队伍"""
-        sel = self.list_roster.curselection()
+        sel = self.list_roster.selected()
         if not sel:
             messagebox.showinfo("提示", "请选择至少一名武将")
             return
         
         added_count = 0
-        for idx in sel:
-            card = self.player.roster[idx]
+        for card in sel:
             if card.id not in self.player.team and len(self.player.team) < 3:
                 self.player.team.append(card.id)
                 added_count += 1
@@ -2941,6 +3634,10 @@ class TeamWindow:
             del self.player.team[idx]
         self.refresh_lists()
 
+    def apply_suggestion(self, suggestion):
+        self.friend_combo.set(suggestion.friend)  # 觸發保存
+        self.refresh_lists()
+
     def on_friend_changed(self, *args):
         """Save friend selection when changed"""
         self.player.selected_friend = self.friend_combo.get()
@@ -2970,8 +3667,8 @@ class UpgradeWindow:
         frame = tk.Frame(self.win, bg=BG_MAIN)
         frame.pack(fill=tk.BOTH, expand=True)
 
-        self.list_roster = tk.Listbox(frame, width=35, height=18, 
-                                     bg=CREAM, fg=BLACK, font=("Arial", 10))
+        self.list_roster = card_list(frame, lambda c: f"[{c.rarity}] {c.name} Lv{c.level} {'⭐' * c.stars}",
+                                     width=35, height=16, bg=CREAM)
         self.list_roster.pack(side=tk.LEFT, padx=10, pady=10)
         self.info = tk.Label(frame, text="", fg=TEXT_MAIN, bg=BG_MAIN, 
                            justify=tk.LEFT, font=("Arial", 10))
@@ -2988,18 +3685,17 @@ class UpgradeWindow:
 
         self.refresh()
 
-    def refresh(self):
-        self.list_roster.delete(0, tk.END)
-        for c in self.player.roster:
-            stars_str = "⭐" * c.stars
-            self.list_roster.insert(tk.END, f"[{c.rarity}] {c.name} Lv{c.level} {stars_str}")
+    def refresh(self, card=None):
+        """card 不為空時只重新格式化該武將的行"""
+        if card is None:
+            self.list_roster.set_cards(self.player.roster)
+        else:
+            self.list_roster.card_changed(card)
         self.info.config(text=f"金幣: {self.player.gold}")
 
     def _selected_card(self):
-        sel = self.list_roster.curselection()
-        if not sel:
-            return None
-        return self.player.roster[sel[0]]
+        sel = self.list_roster.selected()
+        return sel[0] if sel else None
 
     def show_info(self):
         c = self._selected_card()
@@ -3046,9 +3742,10 @@ class UpgradeWindow:
             return
         self.player.gold -= cost
         c.level += 1
+        self.player.roster.update(c)
         self.player.save()
         self.show_info()
-        self.refresh()
+        self.refresh(c)
 
     def upgrade_stars(self):
         c = self._selected_card()
@@ -3063,10 +3760,11 @@ class UpgradeWindow:
             return
         self.player.gold -= cost
         c.stars += 1
+        self.player.roster.update(c)
         self.player.save()
         messagebox.showinfo("成功", f"{c.name} 升級至 {c.stars} 星！")
         self.show_info()
-        self.refresh()
+        self.refresh(c)
 
     def equip_item(self):
         c = self._selected_card()
@@ -3085,11 +3783,12 @@ class UpgradeWindow:
                 rarity = random.choice(list(RARITY_ORDER))
                 bonus = EQUIPMENT_TYPES[eq_t]["rarity_bonus"].get(rarity, 0)
                 c.equipment[eq_t] = {"name": f"{eq_info['name']} [{rarity}]", "rarity": rarity, "stat": eq_info["stat"], "bonus": bonus}
+                self.player.roster.update(c)
                 self.player.save()
                 messagebox.showinfo("成功", f"為 {c.name} 裝備了 {eq_info['name']} [{rarity}]！")
                 equip_win.destroy()
                 self.show_info()
-                self.refresh()
+                self.refresh(c)
             
             btn_text = f"裝備 {eq_info['name']}"
             tk.Button(equip_win, text=btn_text, width=30, height=2, command=equip_type_func).pack(pady=5)
@@ -3186,9 +3885,21 @@ class QuestWindow:
         self.win.destroy()
 
 
-def main():
+_MODULE_READY = time.perf_counter()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # --profile-startup：在 stderr 输出各启动阶段耗时
+    timer = StartupTimer(_MODULE_T0) if "--profile-startup" in argv else None
+    if timer:
+        timer.mark("导入模块（含数据目录）", _MODULE_READY)
     root = tk.Tk()
-    MainMenu(root)
+    if timer:
+        timer.mark("tk.Tk()")
+    MainMenu(root, startup_timer=timer)
+    if timer:
+        timer.mark("构建主选单")
     root.mainloop()
 
 if __name__ == "__main__":
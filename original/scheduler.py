@@ -0,0 +1,119 @@
+"""按截止時間排程的幀循環：下一幀的喚醒時間由目標幀週期推算，而不是「本幀做完再等 16ms」。
+
+    sched = FrameScheduler(fps=60)
+    def frame():
+        render = sched.begin_frame()
+        ...模擬（每幀都做）...
+        if render:
+            ...繪製...
+        root.after(sched.end_frame(), frame)
+
+截止時間每幀累加一個週期，工作耗時不會讓幀率漂移；落後超過一個週期時本幀只模擬不繪製
+（連續跳過最多 max_skip 幀，保證畫面仍會更新），落後超過 MAX_LAG 秒時放棄追趕、從現在重新對齊。
+fps 為 0 表示不限幀率（做完立即排下一幀）。
+
+模擬與幀率無關：每幀把真實經過的時間累加進 SimClock，按固定步長 SIM_DT 取出要跑的 step() 次數，
+幀率上限只改變繪製頻率，不改變遊戲速度。
+"""
+import time
+from collections import deque
+
+from profiler import percentile
+
+FPS_CAPS = (60, 30, 0)  # F4 依次切換；0 為不限
+MAX_LAG = 0.25
+SIM_DT = 0.016  # 每次 BattleSimulation.step() 推進的遊戲時間
+MAX_SIM_STEPS = 12  # 每幀最多補跑的模擬步數（3 倍速、約 16fps 時仍能跟上）
+
+
+class SimClock:
+    """固定步長累加器：advance(經過秒數) 返回本幀應該跑幾次 step(SIM_DT)"""
+
+    def __init__(self, dt=SIM_DT, max_steps=MAX_SIM_STEPS):
+        self.dt = dt
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+
+    def advance(self, elapsed):
+        # 卡頓（拖動窗口、斷點）超過 MAX_LAG 的部分直接丟棄，不在恢復後快進
+        self.accumulator += min(max(elapsed, 0.0), MAX_LAG)
+        steps = min(int(self.accumulator / self.dt), self.max_steps)
+        self.accumulator -= steps * self.dt
+        if steps == self.max_steps:
+            # 跟不上時放棄追趕，餘量不再累積
+            self.accumulator = min(self.accumulator, self.dt)
+        return steps
+
+
+class FrameScheduler:
+    def __init__(self, fps=60, max_skip=4, window=600):
+        self.max_skip = max_skip
+        self.set_fps(fps)
+        self.intervals = deque(maxlen=window)  # 相鄰兩幀開始的間隔（秒）
+        self.work = deque(maxlen=window)  # 每幀 begin_frame 到 end_frame 的耗時（秒）
+        self.frames = 0
+        self.skipped = 0  # 累計跳過繪製的幀數
+        self.rendering = True
+        self._deadline = None
+        self._frame_start = None
+        self._skip_run = 0
+
+    def set_fps(self, fps):
+        self.fps = fps
+        self.period = 1.0 / fps if fps else 0.0
+        self._deadline = None
+
+    def begin_frame(self, now=None):
+        """標記一幀開始；返回本幀是否應該繪製"""
+        now = time.perf_counter() if now is None else now
+        if self._frame_start is not None:
+            self.intervals.append(now - self._frame_start)
+        self._frame_start = now
+        self.frames += 1
+        behind = self._deadline is not None and self.period and now - self._deadline > self.period
+        if behind and self._skip_run < self.max_skip:
+            self._skip_run += 1
+            self.skipped += 1
+            self.rendering = False
+        else:
+            self._skip_run = 0
+            self.rendering = True
+        return self.rendering
+
+    def end_frame(self, now=None):
+        """標記一幀結束；返回到下一幀截止時間的毫秒數（傳給 root.after）"""
+        now = time.perf_counter() if now is None else now
+        if self._frame_start is not None:
+            self.work.append(now - self._frame_start)
+        if not self.period:
+            self._deadline = now
+            return 0
+        if self._deadline is None:
+            self._deadline = (self._frame_start if self._frame_start is not None else now)
+        self._deadline += self.period
+        if now - self._deadline > MAX_LAG:
+            self._deadline = now + self.period
+        return max(0, int((self._deadline - now) * 1000))
+
+    def stats(self):
+        """{fps, frame_p50_ms, frame_p95_ms, frame_p99_ms, work_p50_ms, work_p95_ms, frames, skipped, cap}"""
+        intervals = sorted(self.intervals)
+        work = sorted(self.work)
+        mean = sum(intervals) / len(intervals) if intervals else 0.0
+        return {
+            "fps": 1.0 / mean if mean else 0.0,
+            "frame_p50_ms": percentile(intervals, 0.50) * 1000,
+            "frame_p95_ms": percentile(intervals, 0.95) * 1000,
+            "frame_p99_ms": percentile(intervals, 0.99) * 1000,
+            "work_p50_ms": percentile(work, 0.50) * 1000,
+            "work_p95_ms": percentile(work, 0.95) * 1000,
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "cap": self.fps,
+        }
+
+    def hud_text(self):
+        intervals = self.intervals
+        fps = len(intervals) / sum(intervals) if intervals and sum(intervals) else 0.0
+        cap = f"/{self.fps}" if self.fps else "/不限"
+        return f"{fps:.0f}{cap} fps"
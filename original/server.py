@@ -0,0 +1,721 @@
+"""本機戰鬥服務：通過 asyncio HTTP / WebSocket 介面提供戰鬥模擬、抽卡、升級和存檔。
+
+    python server.py --port 8765 --workers 4
+
+規則全部沿用 sanguo_prototype（Card、PlayerData、summon_pulls、chapter_rewards 等），不創建任何 Tk 窗口，
+網頁客戶端和機器人都以服務端的結果為準。只用標準庫：在 asyncio.start_server 上實現 HTTP/1.1（keep-alive）
+和 RFC 6455 WebSocket（不分片的文字訊息）。
+
+整場戰鬥模擬是 CPU 密集的，交給 ProcessPoolExecutor，事件循環只負責收發和結算獎勵；抽卡、升級和查詢很快，
+直接在事件循環裡完成。客戶端上報的戰鬥結果（claim）先在事件循環裡做傷害界預篩，抽中的再交給進程池重放。
+claim 的種子必須先由 claim_start 發出，每個只能上報一次；未用的種子和被拒絕過的玩家存在 claims.json。
+同一玩家的操作用 asyncio.Lock 串行，戰鬥期間該玩家的其他請求排隊，不會重複消費。
+修改過的玩家每 SAVE_INTERVAL 秒在執行緒裡批量寫檔（同樣持有該玩家的鎖），save 操作和關閉服務時立即寫入。
+競技場的防守快照庫（arena.py）整體放在記憶體裡，有變動時每 ARENA_SAVE_INTERVAL 秒和關閉服務時寫到 arena.bin。
+
+HTTP 介面（請求和回應都是 JSON，回應帶 "ok"，失敗時帶 "error"）：
+    GET  /api/health
+    GET  /api/players/<id>                 玩家數據（存檔不存在時按新玩家初始化）
+    POST /api/players/<id>/summon          {"count": 1 或 10}
+    POST /api/players/<id>/level_up        {"card_id": ..., "times": 次數（省略時升到滿級或金幣用完）}
+    POST /api/players/<id>/rank_up         {"card_id": ...}
+    POST /api/players/<id>/battle          {"chapter": 章節}（種子由服務端隨機選取）
+    POST /api/players/<id>/claim_start     {"chapter": 章節}，發一個一次性種子：{"seed": ..., "expires_in": 秒數}；
+                                           上一個種子上報或過期之前返回 409
+    POST /api/players/<id>/claim           客戶端本地打完的戰鬥：{"chapter", "seed", "outcome", "frames", "survivors",
+                                           "gold_spent", "auto_battle", "inputs"}，seed 必須是 claim_start 發出且未用過的，
+                                           校驗通過才發放獎勵（見 verify.py）
+    POST /api/players/<id>/arena_defend    把當前隊伍存為競技場防守快照
+    POST /api/players/<id>/arena_match     {"count": 對手數}，按隊伍戰力匹配防守快照
+    POST /api/players/<id>/arena_attack    {"defender": 可選的對手 id（省略時自動匹配）, "seed": 可選的隨機種子}
+    POST /api/players/<id>/save
+    GET  /ws                               WebSocket：每條訊息 {"id": ..., "op": 操作名, "player": id, 參數...}，
+                                           回覆 {"id": ..., "ok": ..., 結果...}；op 為 health 時不需要 player
+其他 GET 路徑返回倉庫根目錄下的網頁客戶端檔案（index.html、game.js 等）。
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from arena import DefenseStore, run_arena, snapshot_units, team_power
+from config import LEVEL_UP_GOLD_COST
+from offline import DEFEAT_GOLD, SIM_DT, BattleResult, simulate_battle
+from sanguo_prototype import (CATALOG, Card, PlayerData, chapter_rewards, roll_equipment_drop, summon_pulls,
+                              write_save)
+from verify import BattleTickets, ClaimSampler, InvalidClaim, parse_claim, plausibility, replay_claim
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WEB_ROOT = os.path.dirname(HERE)
+DEFAULT_DATA_DIR = os.path.join(HERE, "server_saves")
+DEFAULT_PORT = 8765
+
+SUMMON_COSTS = {1: 300, 10: 3000}  # 與抽卡界面一致
+MAX_LEVEL = 50
+SAVE_INTERVAL = 5.0
+ARENA_SAVE_INTERVAL = 60.0
+ARENA_MATCH_MAX = 10
+VERIFY_SAMPLE = 0.1  # 通過預篩的 claim 完整重放的比例
+MAX_BODY = 64 * 1024
+OPS = ("state", "summon", "level_up", "rank_up", "battle", "claim_start", "claim", "arena_defend", "arena_match",
+       "arena_attack", "save")
+PLAYER_ID = re.compile(r"[A-Za-z0-9_-]{1,32}$")
+API_ROUTE = re.compile(r"/api/players/([^/]+)(?:/(\w+))?$")
+
+STATIC_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".png": "image/png",
+    ".svg": "image/svg+xml",
+    ".ico": "image/x-icon",
+}
+JSON_TYPE = "application/json; charset=utf-8"
+HTTP_REASONS = {
+    101: "Switching Protocols", 200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x8, 0x9, 0xA
+WS_CLOSE_UNSUPPORTED = 1003
+
+
+class ApiError(Exception):
+    """請求無法執行：status 為 HTTP 狀態碼，WebSocket 回覆中帶同樣的 status 和 error"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# --- 規則（事件循環內執行，調用方持有玩家的鎖） ---
+
+def card_view(card):
+    hp, atk, speed = card.stats()
+    return {**card.to_dict(), "hp": hp, "atk": atk, "speed": speed, "power": card.power()}
+
+
+def player_view(player):
+    return {
+        "gold": player.gold,
+        "gems": player.gems,
+        "team": list(player.team),
+        "selected_friend": player.selected_friend,
+        "roster": [card_view(c) for c in player.roster],
+        "equipment_inventory": len(player.equipment_inventory),
+    }
+
+
+def run_battle(cards, selected_friend, gold, chapter, seed):
+    """進程池中執行：按卡牌數據重建隊伍，用 seed 跑一場無界面自動戰鬥，返回 offline.BattleResult"""
+    random.seed(seed)
+    player = PlayerData(os.devnull)
+    player.gold = gold
+    player.selected_friend = selected_friend
+    return simulate_battle(player, [Card.from_dict(d) for d in cards], chapter)
+
+
+def apply_battle_result(player, team, chapter, result):
+    """按 GameWindow 的規則把戰鬥結果寫入 player：完成全部波次發放關卡獎勵，城堡失守發放安慰金幣"""
+    gold = -result.gold_spent
+    gems = 0
+    exp = {}
+    level_ups = []
+    equipment = []
+    if result.outcome == "chapter_clear":
+        reward_gold, reward_gems, base_exp = chapter_rewards(chapter)
+        gold += reward_gold
+        gems += reward_gems
+        for card, survived in zip(team, result.survivors):
+            if not survived:
+                continue
+            start_level = card.level
+            if card.add_exp(base_exp):
+                player.roster.update(card)
+                level_ups.append((card.id, start_level, card.level))
+            exp[card.id] = base_exp
+        drop = roll_equipment_drop(chapter)
+        if drop:
+            slot, dropped = drop
+            player.equipment_inventory.append({"id": dropped["id"], "slot": slot, "equipped_to": None})
+            equipment.append(dropped["id"])
+    elif result.outcome == "defeat":
+        gold += DEFEAT_GOLD
+    player.gold += gold
+    player.gems += gems
+    return {"gold": gold, "gems": gems, "exp": exp, "level_ups": level_ups, "equipment": equipment}
+
+
+def _int_param(params, key, default=None):
+    value = params.get(key, default)
+    if value is None and default is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ApiError(400, f"'{key}' 應為整數")
+    return value
+
+
+class BattleService:
+    """玩家數據和遊戲規則；所有操作通過 call(op, 玩家 id, 參數) 進入"""
+
+    def __init__(self, data_dir=DEFAULT_DATA_DIR, workers=None, save_interval=SAVE_INTERVAL,
+                 verify_sample=VERIFY_SAMPLE):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        # spawn：不繼承事件循環和存檔執行緒的狀態
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.save_interval = save_interval
+        self.players = {}
+        self.locks = {}
+        self.dirty = set()
+        self.requests = 0
+        self.battles = 0
+        self.sampler = ClaimSampler(verify_sample)
+        self.claims = {"accepted": 0, "rejected": 0, "replayed": 0}
+        self.tickets = BattleTickets()
+        self.claims_path = os.path.join(data_dir, "claims.json")
+        if os.path.exists(self.claims_path):
+            with open(self.claims_path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.sampler.restore(state.get("flagged", ()))
+            self.tickets.restore(state.get("tickets", {}))
+        self._claims_saved = self._claims_version()
+        self.arena_path = os.path.join(data_dir, "arena.bin")
+        self.arena = DefenseStore.load(self.arena_path) if os.path.exists(self.arena_path) else DefenseStore()
+        self._arena_saved = self.arena.version
+        self._arena_save_at = time.monotonic() + ARENA_SAVE_INTERVAL
+        self.started = time.time()
+        self._autosave = None
+
+    def start(self):
+        self._autosave = asyncio.get_running_loop().create_task(self._autosave_loop())
+
+    async def close(self):
+        if self._autosave is not None:
+            self._autosave.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._autosave
+        await self.flush()
+        await self.save_claims()
+        await self.save_arena()
+        self.pool.shutdown()
+
+    def health(self):
+        return {"players": len(self.players), "requests": self.requests, "battles": self.battles,
+                "claims": {**self.claims, "forfeited": self.tickets.forfeited}, "arena_defenses": len(self.arena),
+                "workers": self.workers,
+                "uptime": round(time.time() - self.started, 1)}
+
+    def lock(self, pid):
+        lock = self.locks.get(pid)
+        if lock is None:
+            lock = self.locks[pid] = asyncio.Lock()
+        return lock
+
+    async def player(self, pid):
+        if not isinstance(pid, str) or not PLAYER_ID.match(pid):
+            raise ApiError(400, "無效的玩家 id")
+        player = self.players.get(pid)
+        if player is None:
+            async with self.lock(pid):
+                player = self.players.get(pid)
+                if player is None:
+                    player = PlayerData(os.path.join(self.data_dir, f"{pid}.json"))
+                    await asyncio.to_thread(player.load)
+                    self.players[pid] = player
+        return player
+
+    async def call(self, op, pid, params):
+        if op not in OPS:
+            raise ApiError(404, f"未知操作 '{op}'")
+        self.requests += 1
+        player = await self.player(pid)
+        async with self.lock(pid):
+            return await getattr(self, f"op_{op}")(pid, player, params)
+
+    # --- 存檔 ---
+    async def _write(self, player):
+        await asyncio.to_thread(write_save, player.path, player.save_data())
+
+    async def flush(self):
+        """寫入所有修改過的玩家"""
+        for pid in list(self.dirty):
+            async with self.lock(pid):
+                if pid in self.dirty:
+                    self.dirty.discard(pid)
+                    await self._write(self.players[pid])
+
+    def _claims_version(self):
+        return self.tickets.version, len(self.sampler.flagged)
+
+    async def save_claims(self):
+        """未用的種子或被標記的玩家有變動時寫 claims.json"""
+        version = self._claims_version()
+        if version == self._claims_saved:
+            return
+        state = {"flagged": self.sampler.state(), "tickets": self.tickets.state()}
+        await asyncio.to_thread(write_save, self.claims_path, state)
+        self._claims_saved = version
+
+    async def save_arena(self):
+        """防守快照庫有變動時寫檔（執行緒裡寫的是當前記錄的副本）"""
+        if self.arena.version == self._arena_saved:
+            return
+        version = self.arena.version
+        snapshot = DefenseStore()
+        snapshot.records = bytes(self.arena.records)
+        snapshot.owners = list(self.arena.owners)
+        snapshot.names = list(self.arena.names)
+        await asyncio.to_thread(snapshot.save, self.arena_path)
+        self._arena_saved = version
+
+    async def _autosave_loop(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.flush()
+                await self.save_claims()
+                if time.monotonic() >= self._arena_save_at:
+                    self._arena_save_at = time.monotonic() + ARENA_SAVE_INTERVAL
+                    await self.save_arena()
+            except OSError as e:
+                print(f"自動存檔失敗: {e}", file=sys.stderr)
+
+    # --- 操作 ---
+    def _card(self, player, params):
+        card = player.cards_by_id().get(params.get("card_id"))
+        if card is None:
+            raise ApiError(404, "找不到該武將")
+        return card
+
+    async def op_state(self, pid, player, params):
+        return player_view(player)
+
+    async def op_summon(self, pid, player, params):
+        count = _int_param(params, "count", 1)
+        cost = SUMMON_COSTS.get(count)
+        if cost is None:
+            raise ApiError(400, "count 只能是 1 或 10")
+        if player.gems < cost:
+            raise ApiError(409, "鑽石不足")
+        player.gems -= cost
+        pulls, shard_conversions, equipment = summon_pulls(player, count)
+        self.dirty.add(pid)
+        return {"cards": [card_view(c) for c in pulls],
+                "shards": [{"name": name, "shards": n, "rarity": rarity} for name, n, rarity in shard_conversions],
+                "equipment": equipment, "gems": player.gems}
+
+    async def op_level_up(self, pid, player, params):
+        card = self._card(player, params)
+        times = _int_param(params, "times")
+        if card.level >= MAX_LEVEL:
+            raise ApiError(409, "已達最高等級")
+        max_steps = MAX_LEVEL - card.level
+        desired = max_steps if times is None else min(times, max_steps)
+        if desired <= 0:
+            raise ApiError(400, "times 必須為正數")
+        steps = min(desired, player.gold // LEVEL_UP_GOLD_COST)
+        if steps <= 0:
+            raise ApiError(409, "金幣不足")
+        start_level = card.level
+        for _ in range(steps):
+            card.add_exp(card.exp_needed())
+            if card.level >= MAX_LEVEL:
+                break
+        gold_used = steps * LEVEL_UP_GOLD_COST
+        player.gold -= gold_used
+        player.roster.update(card)
+        self.dirty.add(pid)
+        return {"card": card_view(card), "levels": card.level - start_level, "gold_used": gold_used,
+                "gold": player.gold}
+
+    async def op_rank_up(self, pid, player, params):
+        card = self._card(player, params)
+        success, msg = card.rank_up()
+        if not success:
+            raise ApiError(409, msg)
+        player.roster.update(card)
+        self.dirty.add(pid)
+        return {"card": card_view(card), "message": msg}
+
+    def _team(self, player):
+        by_id = player.cards_by_id()
+        team = [by_id[cid] for cid in player.team if cid in by_id][:3]
+        if not team:
+            raise ApiError(409, "隊伍為空")
+        return team
+
+    async def op_battle(self, pid, player, params):
+        chapter = _int_param(params, "chapter", 1)
+        if chapter not in CATALOG["chapter_index"]:
+            raise ApiError(404, f"沒有第 {chapter} 章")
+        # 戰鬥是確定性的：發獎勵的戰鬥不接受客戶端給的種子，否則可以反覆重打已知能贏的種子
+        seed = random.getrandbits(32)
+        team = self._team(player)
+        self.battles += 1
+        result = await asyncio.get_running_loop().run_in_executor(
+            self.pool, run_battle, [c.to_dict() for c in team], player.selected_friend, player.gold, chapter, seed)
+        rewards = apply_battle_result(player, team, chapter, result)
+        self.dirty.add(pid)
+        return {"outcome": result.outcome, "seconds": round(result.seconds, 3), "seed": seed,
+                "survivors": list(result.survivors), **rewards}
+
+    async def op_claim_start(self, pid, player, params):
+        chapter = _int_param(params, "chapter", 1)
+        if chapter not in CATALOG["chapter_index"]:
+            raise ApiError(404, f"沒有第 {chapter} 章")
+        self._team(player)
+        seed = self.tickets.issue(pid, chapter)
+        if seed is None:
+            # 上一場的種子上報或過期之前不發新種子，否則客戶端可以本地試打、只上報贏的那些
+            raise ApiError(409, f"上一場戰鬥尚未上報，{math.ceil(self.tickets.retry_after(pid))} 秒後才能重新開始")
+        return {"chapter": chapter, "seed": seed, "expires_in": self.tickets.ttl}
+
+    async def op_claim(self, pid, player, params):
+        try:
+            claim = parse_claim(params)
+        except InvalidClaim as e:
+            raise ApiError(400, str(e)) from e
+        team = self._team(player)
+        # 先作廢種子再校驗：同一種子無論結果如何都不能再次上報
+        reason = self.tickets.consume(pid, claim.seed, claim.chapter)
+        if reason is not None:
+            self.claims["rejected"] += 1
+            raise ApiError(409, reason)
+        reason, min_frames = plausibility(team, player.selected_friend, claim)
+        if reason is None and claim.gold_spent > player.gold:
+            reason = "交易花費超過持有的金幣"
+        replayed = reason is None and self.sampler.should_replay(pid, claim, min_frames)
+        if replayed:
+            self.claims["replayed"] += 1
+            reason, _ = await asyncio.get_running_loop().run_in_executor(
+                self.pool, replay_claim, [c.to_dict() for c in team], player.selected_friend, player.gold, claim)
+        if reason is not None:
+            self.claims["rejected"] += 1
+            self.sampler.flag(pid)
+            raise ApiError(409, reason)
+        self.claims["accepted"] += 1
+        result = BattleResult(claim.outcome, claim.frames * SIM_DT, claim.survivors, claim.gold_spent)
+        rewards = apply_battle_result(player, team, claim.chapter, result)
+        self.dirty.add(pid)
+        return {"outcome": claim.outcome, "replayed": replayed, **rewards}
+
+    async def op_arena_defend(self, pid, player, params):
+        team = self._team(player)
+        power = team_power(team)
+        self.arena.put(pid, power, snapshot_units(team))
+        return {"power": power, "defenses": len(self.arena)}
+
+    async def op_arena_match(self, pid, player, params):
+        count = _int_param(params, "count", 3)
+        if not 0 < count <= ARENA_MATCH_MAX:
+            raise ApiError(400, f"count 只能是 1..{ARENA_MATCH_MAX}")
+        power = team_power(self._team(player))
+        opponents = self.arena.match(power, count, exclude=pid)
+        return {"power": power, "opponents": [{"player": d.owner, "power": d.power,
+                                               "heroes": [u.name for u in d.units]} for d in opponents]}
+
+    async def op_arena_attack(self, pid, player, params):
+        team = self._team(player)
+        defender = params.get("defender")
+        if defender is None:
+            found = self.arena.match(team_power(team), 1, exclude=pid)
+            if not found:
+                raise ApiError(409, "沒有可匹配的防守隊伍")
+            defense = found[0]
+        else:
+            if defender == pid:
+                raise ApiError(400, "不能攻打自己的防守隊伍")
+            defense = self.arena.get(defender)
+            if defense is None:
+                raise ApiError(404, "該玩家沒有防守隊伍")
+        seed = _int_param(params, "seed")
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.battles += 1
+        result = await asyncio.get_running_loop().run_in_executor(
+            self.pool, run_arena, [c.to_dict() for c in team], defense.units, seed)
+        return {"outcome": result.outcome, "seconds": round(result.seconds, 3), "seed": seed,
+                "defender": defense.owner, "defender_power": defense.power, "survivors": list(result.survivors)}
+
+    async def op_save(self, pid, player, params):
+        self.dirty.discard(pid)
+        await self._write(player)
+        return {}
+
+
+# --- HTTP ---
+
+async def read_request(reader):
+    """讀一個 HTTP 請求，返回 (method, path, version, headers, body)；連接在請求之間關閉時返回 None"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise ApiError(400, "請求不完整") from e
+        return None
+    except asyncio.LimitOverrunError as e:
+        raise ApiError(413, "請求頭過長") from e
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+    except ValueError as e:
+        raise ApiError(400, "無法解析的請求") from e
+    if length > MAX_BODY:
+        raise ApiError(413, "請求體過大")
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], version, headers, body
+
+
+def write_response(writer, status, body=b"", content_type=JSON_TYPE, keep_alive=True, extra=()):
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+             f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}",
+             "Access-Control-Allow-Origin: *",
+             *extra]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+
+def json_body(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+_static_cache = {}
+
+
+def static_file(path):
+    """倉庫根目錄下的網頁檔案 (內容, Content-Type)；只允許根目錄一層、白名單副檔名"""
+    name = "index.html" if path == "/" else path[1:]
+    ext = os.path.splitext(name)[1]
+    if not name or "/" in name or "\\" in name or name.startswith(".") or ext not in STATIC_TYPES:
+        raise ApiError(404, "找不到檔案")
+    full = os.path.join(WEB_ROOT, name)
+    try:
+        mtime = os.stat(full).st_mtime_ns
+    except OSError as e:
+        raise ApiError(404, "找不到檔案") from e
+    cached = _static_cache.get(name)
+    if cached is None or cached[0] != mtime:
+        with open(full, "rb") as f:
+            cached = _static_cache[name] = (mtime, f.read())
+    return cached[1], STATIC_TYPES[ext]
+
+
+# --- WebSocket ---
+
+def encode_frame(opcode, payload, mask=False):
+    """一個完整（FIN）的 WebSocket 幀；客戶端發出的幀需要 mask"""
+    n = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if n < 126:
+        head = struct.pack("!BB", 0x80 | opcode, mask_bit | n)
+    elif n < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, mask_bit | 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, mask_bit | 127, n)
+    if not mask:
+        return head + payload
+    key = os.urandom(4)
+    return head + key + _apply_mask(payload, key)
+
+
+def _apply_mask(payload, key):
+    n = len(payload)
+    if not n:
+        return payload
+    stream = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(stream, "big")).to_bytes(n, "big")
+
+
+async def read_frame(reader, max_size=MAX_BODY):
+    """讀一個 WebSocket 幀，返回 (fin, opcode, payload)"""
+    b1, b2 = await reader.readexactly(2)
+    n = b2 & 0x7F
+    if n == 126:
+        (n,) = struct.unpack("!H", await reader.readexactly(2))
+    elif n == 127:
+        (n,) = struct.unpack("!Q", await reader.readexactly(8))
+    if n > max_size:
+        raise ApiError(413, "訊息過大")
+    key = await reader.readexactly(4) if b2 & 0x80 else None
+    payload = await reader.readexactly(n)
+    if key is not None:
+        payload = _apply_mask(payload, key)
+    return bool(b1 & 0x80), b1 & 0x0F, payload
+
+
+class ApiServer:
+    """把 HTTP 請求和 WebSocket 訊息分派到 BattleService"""
+
+    def __init__(self, service):
+        self.service = service
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ApiError as e:
+                    write_response(writer, e.status, json_body({"ok": False, "error": e.message}), keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = "close" not in connection if version == "HTTP/1.1" else "keep-alive" in connection
+                if path == "/ws" and method == "GET":
+                    await self.websocket(reader, writer, headers)
+                    break
+                status, payload, content_type, extra = await self.respond(method, path, body)
+                write_response(writer, status, payload, content_type, keep_alive, extra)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def respond(self, method, path, body):
+        """返回 (狀態碼, 回應體, Content-Type, 額外的頭)"""
+        try:
+            if method == "OPTIONS":
+                # 瀏覽器跨源 POST JSON 前的預檢
+                return 204, b"", JSON_TYPE, ("Access-Control-Allow-Methods: GET, POST, OPTIONS",
+                                              "Access-Control-Allow-Headers: Content-Type")
+            if path == "/api/health":
+                return 200, json_body({"ok": True, **self.service.health()}), JSON_TYPE, ()
+            route = API_ROUTE.match(path)
+            if route:
+                pid, op = route.group(1), route.group(2) or "state"
+                if method not in ("GET", "POST") or (method == "GET" and op != "state"):
+                    raise ApiError(405, "該介面只接受 POST")
+                try:
+                    params = json.loads(body) if body else {}
+                except ValueError as e:
+                    raise ApiError(400, "請求體不是有效的 JSON") from e
+                if not isinstance(params, dict):
+                    raise ApiError(400, "請求體應為 JSON 物件")
+                result = await self.service.call(op, pid, params)
+                return 200, json_body({"ok": True, **result}), JSON_TYPE, ()
+            if method != "GET":
+                raise ApiError(405, "只接受 GET")
+            content, content_type = static_file(path)
+            return 200, content, content_type, ()
+        except ApiError as e:
+            return e.status, json_body({"ok": False, "error": e.message}), JSON_TYPE, ()
+        except Exception as e:  # 規則代碼的意外錯誤不應斷開其他玩家的連接
+            print(f"{method} {path} 失敗: {e!r}", file=sys.stderr)
+            return 500, json_body({"ok": False, "error": "服務內部錯誤"}), JSON_TYPE, ()
+
+    async def websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            write_response(writer, 400, json_body({"ok": False, "error": "需要 WebSocket 握手"}), keep_alive=False)
+            return
+        accept = base64.b64encode(hashlib.sha1(key.encode("latin-1") + WS_GUID).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        # 同一連接上的訊息按順序處理；需要並行的客戶端開多個連接
+        while True:
+            try:
+                fin, opcode, payload = await read_frame(reader)
+            except ApiError:
+                writer.write(encode_frame(WS_CLOSE, struct.pack("!H", 1009)))
+                break
+            if opcode == WS_CLOSE:
+                writer.write(encode_frame(WS_CLOSE, payload[:2]))
+                break
+            if opcode == WS_PING:
+                writer.write(encode_frame(WS_PONG, payload))
+            elif opcode == WS_TEXT and fin:
+                writer.write(encode_frame(WS_TEXT, json_body(await self.ws_message(payload))))
+            elif opcode != WS_PONG:
+                writer.write(encode_frame(WS_CLOSE, struct.pack("!H", WS_CLOSE_UNSUPPORTED)))
+                break
+            await writer.drain()
+        await writer.drain()  # 關閉幀
+
+    async def ws_message(self, payload):
+        msg_id = None
+        try:
+            try:
+                msg = json.loads(payload)
+            except ValueError as e:
+                raise ApiError(400, "訊息不是有效的 JSON") from e
+            if not isinstance(msg, dict):
+                raise ApiError(400, "訊息應為 JSON 物件")
+            msg_id = msg.get("id")
+            if msg.get("op") == "health":
+                return {"id": msg_id, "ok": True, **self.service.health()}
+            result = await self.service.call(msg.get("op"), msg.get("player"), msg)
+            return {"id": msg_id, "ok": True, **result}
+        except ApiError as e:
+            return {"id": msg_id, "ok": False, "status": e.status, "error": e.message}
+        except Exception as e:
+            print(f"WebSocket 訊息處理失敗: {e!r}", file=sys.stderr)
+            return {"id": msg_id, "ok": False, "status": 500, "error": "服務內部錯誤"}
+
+
+async def start(host="127.0.0.1", port=DEFAULT_PORT, workers=None, data_dir=DEFAULT_DATA_DIR,
+                verify_sample=VERIFY_SAMPLE):
+    """啟動服務，返回 (asyncio.Server, BattleService)；結束時先 server.close() 再 await service.close()"""
+    service = BattleService(data_dir, workers, verify_sample=verify_sample)
+    service.start()
+    server = await asyncio.start_server(ApiServer(service).handle, host, port)
+    return server, service
+
+
+async def serve(host, port, workers, data_dir, verify_sample):
+    server, service = await start(host, port, workers, data_dir, verify_sample)
+    print(f"戰鬥服務已啟動: http://{host}:{port}/  (進程池 {service.workers} 個, 存檔目錄 {data_dir})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="三國戰爭本機戰鬥服務")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="戰鬥模擬進程數（預設為 CPU 核數）")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="玩家存檔目錄")
+    parser.add_argument("--verify-sample", type=float, default=VERIFY_SAMPLE,
+                        help="通過預篩的客戶端戰鬥結果完整重放的比例（0-1）")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.data_dir, args.verify_sample))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""均勻網格空間雜湊：按位置把單位分桶，用於範圍查詢和最近目標查詢。"""
+import math
+
+
+class SpatialHash:
+    def __init__(self, cell_size=100):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def _key(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def insert(self, obj):
+        self.cells.setdefault(self._key(obj.pos[0], obj.pos[1]), []).append(obj)
+
+    def rebuild(self, units):
+        """用當前存活單位重建網格（每幀一次）"""
+        self.cells.clear()
+        cells = self.cells
+        size = self.cell_size
+        for u in units:
+            if u.hp > 0:
+                key = (int(u.pos[0] // size), int(u.pos[1] // size))
+                bucket = cells.get(key)
+                if bucket is None:
+                    cells[key] = [u]
+                else:
+                    bucket.append(u)
+
+    def query(self, x, y, radius, team=None):
+        """返回半徑內的存活單位（可按隊伍過濾）"""
+        size = self.cell_size
+        min_cx, max_cx = int((x - radius) // size), int((x + radius) // size)
+        min_cy, max_cy = int((y - radius) // size), int((y + radius) // size)
+        r2 = radius * radius
+        found = []
+        cells = self.cells
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                bucket = cells.get((cx, cy))
+                if not bucket:
+                    continue
+                for u in bucket:
+                    if u.hp <= 0 or (team is not None and u.team != team):
+                        continue
+                    dx = u.pos[0] - x
+                    dy = u.pos[1] - y
+                    if dx * dx + dy * dy <= r2:
+                        found.append(u)
+        return found
+
+    def query_rect(self, x0, y0, x1, y1):
+        """返回矩形 [x0, x1] x [y0, y1] 內的存活單位（視口裁剪用）"""
+        size = self.cell_size
+        found = []
+        cells = self.cells
+        for cx in range(int(x0 // size), int(x1 // size) + 1):
+            for cy in range(int(y0 // size), int(y1 // size) + 1):
+                bucket = cells.get((cx, cy))
+                if not bucket:
+                    continue
+                for u in bucket:
+                    if u.hp > 0 and x0 <= u.pos[0] <= x1 and y0 <= u.pos[1] <= y1:
+                        found.append(u)
+        return found
+
+    def neighbors(self, x, y, radius, team=None, limit=8, exclude=None):
+        """半徑內最多 limit 個存活單位 [(單位, dx, dy, 距離平方)]，dx/dy 為單位相對 (x, y) 的位移
+
+        找夠 limit 個就停止掃描，擁擠時每次查詢的開銷也有上限（結果不保證是最近的 limit 個）。
+        """
+        size = self.cell_size
+        r2 = radius * radius
+        found = []
+        cells = self.cells
+        for cx in range(int((x - radius) // size), int((x + radius) // size) + 1):
+            for cy in range(int((y - radius) // size), int((y + radius) // size) + 1):
+                bucket = cells.get((cx, cy))
+                if not bucket:
+                    continue
+                for u in bucket:
+                    if u is exclude or u.hp <= 0 or (team is not None and u.team != team):
+                        continue
+                    dx = u.pos[0] - x
+                    dy = u.pos[1] - y
+                    d2 = dx * dx + dy * dy
+                    if d2 <= r2:
+                        found.append((u, dx, dy, d2))
+                        if len(found) >= limit:
+                            return found
+        return found
+
+    def nearest(self, x, y, radius, team=None):
+        """半徑內最近的存活單位，沒有則返回 None"""
+        best = None
+        best_d = math.inf
+        for u in self.query(x, y, radius, team):
+            d = math.dist((x, y), u.pos)
+            if d < best_d:
+                best, best_d = u, d
+        return best
@@ -0,0 +1,228 @@
+"""戰場精靈快取：單位圓盤+兵種圖標、城堡主體+圖標預先光柵化成 PhotoImage，每幀只畫一個圖片項目。
+
+Tk 的文字項目每次都要排版 emoji 字形，比貼圖慢得多；而且不依賴 PIL 就無法把字形畫進 PhotoImage，
+所以圖標用下面的點陣遮罩（最近鄰縮放）代替 emoji。血條、名字、冷卻條仍然每幀畫成輕量的疊加項目。
+
+快取按 (種類, 顏色, 圖標, 是否選中, 顯示比例) 建鍵，大小有上限（LRU）。
+PhotoImage 屬於某個 Tk 直譯器，用 SpriteCache.of(widget) 取得該窗口共享的快取。
+"""
+import math
+import tkinter as tk
+from collections import OrderedDict
+
+# 點陣圖標（"#" 為實心），畫在單位/城堡中央
+ICON_MASKS = {
+    "spear": (  # 🔱
+        "#....#....#",
+        "#....#....#",
+        "#...###...#",
+        "##..###..##",
+        ".#########.",
+        ".....#.....",
+        ".....#.....",
+        ".....#.....",
+        ".....#.....",
+        ".....#.....",
+        ".....#.....",
+    ),
+    "horse": (  # 🐎
+        "........##.",
+        ".......####",
+        "......###.#",
+        ".........#.",
+        ".#########.",
+        "##########.",
+        "#.#######..",
+        ".#......#..",
+        ".#......#..",
+        ".#......#..",
+        ".##.....##.",
+    ),
+    "bow": (  # 🏹
+        "..#........",
+        ".#.#.......",
+        ".#..#......",
+        "#....#.....",
+        "#.....#..#.",
+        "##########.",
+        "#.....#..#.",
+        "#....#.....",
+        ".#..#......",
+        ".#.#.......",
+        "..#........",
+    ),
+    "sword": (  # ⚔
+        "#.........#",
+        ".#.......#.",
+        "..#.....#..",
+        "...#...#...",
+        "....#.#....",
+        ".....#.....",
+        "....#.#....",
+        "...#...#...",
+        ".##.....##.",
+        ".##.....##.",
+        "#.........#",
+    ),
+    "castle": (  # 🏰
+        "#.#.#.#.#.#",
+        "###########",
+        ".#########.",
+        ".#########.",
+        ".####.####.",
+        ".###...###.",
+        ".###...###.",
+        ".###...###.",
+    ),
+    "crown": (  # 👑
+        "#....#....#",
+        "##..###..##",
+        "###.###.###",
+        "###########",
+        "###########",
+        ".#########.",
+    ),
+}
+
+UNIT_RADIUS = 25
+UNIT_OUTLINE = 2
+SELECT_RADIUS = 30
+SELECT_WIDTH = 3
+UNIT_ICON_SIZE = 18  # 原 16 號字 emoji 的大致寬度
+CASTLE_SIZE = (120, 80)
+CASTLE_OUTLINE = 3
+CASTLE_ICON_SIZE = 28
+
+
+class Raster:
+    """只有不透明像素的小畫布；後畫的覆蓋先畫的，未畫的像素在 PhotoImage 中保持透明"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = [[None] * width for _ in range(height)]
+
+    def _plot(self, x, y, color):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y][x] = color
+
+    def ring(self, cx, cy, r_in, r_out, color):
+        """r_in <= 到像素中心的距離 <= r_out 的像素；r_in 為 0 即實心圓"""
+        for y in range(max(0, int(cy - r_out) - 1), min(self.height, int(cy + r_out) + 2)):
+            dy = y + 0.5 - cy
+            for x in range(max(0, int(cx - r_out) - 1), min(self.width, int(cx + r_out) + 2)):
+                dx = x + 0.5 - cx
+                if r_in * r_in <= dx * dx + dy * dy <= r_out * r_out:
+                    self.pixels[y][x] = color
+
+    def rect(self, x0, y0, x1, y1, color):
+        for y in range(max(0, y0), min(self.height, y1)):
+            row = self.pixels[y]
+            for x in range(max(0, x0), min(self.width, x1)):
+                row[x] = color
+
+    def mask(self, rows, cx, cy, size, color):
+        """把點陣遮罩最近鄰縮放到 size 寬，中心放在 (cx, cy)"""
+        cols = len(rows[0])
+        w = size
+        h = max(1, round(size * len(rows) / cols))
+        x0 = round(cx - w / 2)
+        y0 = round(cy - h / 2)
+        for y in range(h):
+            src = rows[y * len(rows) // h]
+            for x in range(w):
+                if src[x * cols // w] == "#":
+                    self._plot(x0 + x, y0 + y, color)
+
+    def runs(self):
+        """[(顏色, x0, y, x1)]：每行連續同色像素合併成一段"""
+        out = []
+        for y, row in enumerate(self.pixels):
+            x = 0
+            while x < self.width:
+                color = row[x]
+                if color is None:
+                    x += 1
+                    continue
+                start = x
+                while x < self.width and row[x] == color:
+                    x += 1
+                out.append((color, start, y, x))
+        return out
+
+
+def unit_raster(fill, icon, selected, scale=1.0, outline="#FFFFFF", select_color="#F39C12"):
+    r = UNIT_RADIUS * scale
+    extent = (SELECT_RADIUS + SELECT_WIDTH / 2) if selected else (UNIT_RADIUS + UNIT_OUTLINE / 2)
+    size = 2 * math.ceil(extent * scale) + 2
+    c = size / 2
+    img = Raster(size, size)
+    img.ring(c, c, 0, r, fill)
+    img.ring(c, c, r - UNIT_OUTLINE / 2 * scale, r + UNIT_OUTLINE / 2 * scale, outline)
+    img.mask(ICON_MASKS.get(icon, ICON_MASKS["sword"]), c, c, max(3, round(UNIT_ICON_SIZE * scale)), outline)
+    if selected:
+        half = SELECT_WIDTH / 2 * scale
+        img.ring(c, c, SELECT_RADIUS * scale - half, SELECT_RADIUS * scale + half, select_color)
+    return img
+
+
+def castle_raster(fill, icon, scale=1.0, outline="#D4AF37", icon_color="#FFFFFF"):
+    w = round(CASTLE_SIZE[0] * scale)
+    h = round(CASTLE_SIZE[1] * scale)
+    border = max(1, round(CASTLE_OUTLINE * scale))
+    pad = math.ceil(border / 2)
+    img = Raster(w + 2 * pad, h + 2 * pad)
+    img.rect(0, 0, img.width, img.height, outline)
+    img.rect(border, border, img.width - border, img.height - border, fill)
+    img.mask(ICON_MASKS[icon], img.width / 2, img.height / 2, max(3, round(CASTLE_ICON_SIZE * scale)), icon_color)
+    return img
+
+
+class SpriteCache:
+    """PhotoImage 的 LRU 快取；scale 為當前顯示比例（參與建鍵，縮放後舊比例的圖逐漸被淘汰）"""
+
+    def __init__(self, master, maxsize=64, scale=1.0):
+        self.master = master
+        self.maxsize = maxsize
+        self.scale = scale
+        self._images = OrderedDict()
+        self.renders = 0  # 光柵化次數（命中率統計用）
+
+    @classmethod
+    def of(cls, widget):
+        """widget 所在 Tk 直譯器共享的快取"""
+        root = widget._root()
+        cache = getattr(root, "_sprite_cache", None)
+        if cache is None:
+            cache = root._sprite_cache = cls(root)
+        return cache
+
+    def __len__(self):
+        return len(self._images)
+
+    def clear(self):
+        self._images.clear()
+
+    def _get(self, key, make_raster):
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            return image
+        raster = make_raster()
+        image = tk.PhotoImage(master=self.master, width=raster.width, height=raster.height)
+        for color, x0, y, x1 in raster.runs():
+            image.put(color, to=(x0, y, x1, y + 1))
+        self.renders += 1
+        self._images[key] = image
+        while len(self._images) > self.maxsize:
+            self._images.popitem(last=False)
+        return image
+
+    def unit(self, fill, icon, selected=False):
+        scale = self.scale
+        return self._get(("unit", fill, icon, bool(selected), scale),
+                         lambda: unit_raster(fill, icon, selected, scale))
+
+    def castle(self, fill, icon):
+        scale = self.scale
+        return self._get(("castle", fill, icon, scale), lambda: castle_raster(fill, icon, scale))
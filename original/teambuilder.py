@@ -0,0 +1,284 @@
+"""推薦陣容：為目標章節從名冊挑選 3 名武將 + 好友助戰。
+
+評分用的是快速代理模型而不是完整戰鬥：
+    單位的有效生命 h、有效輸出 d 由 Card.stats() 和 HERO_SPECIALIZATION 算出（與戰鬥中 Unit 的規則一致）；
+    隊伍分數 score = a·log(Σh) + (1-a)·log(Σd)，勝率 ≈ sigmoid(k·(score - t))。
+a、k、t 按章節用無界面戰鬥（offline.simulate_battle）擬合，每個章節只校準一次；結果只取決於 CALIBRATION_SEED、
+武將/好友數據和數據目錄，寫在 gamedata/.cache/ 下，之後的啟動直接讀取。界面線程用 calibrate_in_background
+在子進程裡校準，不會卡住窗口。
+
+搜索：分數對 Σh、Σd 單調，被至少 3 張卡同時在 h、d 上支配的卡不可能出現在最優隊伍裡，
+先剔除它們，再對剩下的候選做帶上界剪枝的深度優先搜索。結果按 (名冊版本, 章節, 好友) 快取。
+"""
+import bisect
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import weakref
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from catalog import CACHE_DIRNAME, DATA_DIR, catalog_digest
+from combat import CRIT_MULTIPLIER
+from sanguo_prototype import (Card, PlayerData, FRIEND_ASSIST_UNITS, HERO_POOL, HERO_SPECIALIZATION,
+                              RARITY_ORDER, friend_unit_stats)
+
+TEAM_SIZE = 3
+NO_FRIEND = "无"
+REGEN_SECONDS = 3.0  # 張飛回血按多少秒折算成有效生命
+CALIBRATION_TEAMS = 48
+CALIBRATION_SEED = 38
+# 修改戰鬥規則或擬合方法時遞增，使持久化的校準結果失效
+CALIBRATION_VERSION = 1
+
+Calibration = namedtuple("Calibration", "hp_weight slope threshold samples")
+TeamSuggestion = namedtuple("TeamSuggestion", "cards friend score win_chance")
+
+
+def specialization_multipliers(hero):
+    """專精對 (生命, 輸出, 速度) 價值的倍數，按 Unit.apply_specialization 的規則折算"""
+    spec = HERO_SPECIALIZATION.get(hero, {})
+    bonus, value = spec.get("bonus"), spec.get("value", 1.0)
+    if bonus == "damage_boost":
+        return 1.0, value, 1.0
+    if bonus == "crit_rate":
+        return 1.0, 1 + value * (CRIT_MULTIPLIER - 1), 1.0
+    if bonus == "hp_recovery":
+        return 1 + value * REGEN_SECONDS, 1.0, 1.0
+    if bonus == "speed_boost":
+        return 1.0, 1.0, value
+    return 1.0, 1.0, 1.0
+
+
+def unit_profile(hp, atk, hero=None):
+    """(有效生命, 有效輸出)"""
+    hp_mult, atk_mult, _ = specialization_multipliers(hero)
+    return float(hp * hp_mult), float(atk * atk_mult)
+
+
+_card_profiles = {}  # 卡牌 id -> (影響屬性的欄位, (h, d))；升級等變化時覆蓋，每張卡只佔一項
+
+
+def card_profile(card):
+    """卡牌的 (h, d)，影響屬性的欄位未變時直接取快取"""
+    fields = (card.level, card.stars, tuple(sorted((k, str(v)) for k, v in card.equipment.items())))
+    cached = _card_profiles.get(card.id)
+    if cached is not None and cached[0] == fields:
+        return cached[1]
+    hp, atk, _ = card.stats()
+    profile = unit_profile(hp, atk, card.name)
+    _card_profiles[card.id] = (fields, profile)
+    return profile
+
+
+def friend_profile(name):
+    friend = next((f for f in FRIEND_ASSIST_UNITS if f["name"] == name), None)
+    if friend is None:
+        return 0.0, 0.0
+    hp, atk, _ = friend_unit_stats(friend)
+    return unit_profile(hp, atk)
+
+
+def team_score(hp_weight, h, d):
+    return hp_weight * math.log(max(h, 1.0)) + (1 - hp_weight) * math.log(max(d, 1.0))
+
+
+def _sigmoid(x):
+    return 1 / (1 + math.exp(-max(-60.0, min(60.0, x))))
+
+
+def _calibration_teams(rng):
+    """覆蓋各稀有度、等級、星級的隨機隊伍（等級按對數均勻抽取）"""
+    for i in range(CALIBRATION_TEAMS):
+        level = int(round(math.exp(rng.uniform(0, math.log(50)))))
+        cards = []
+        for meta in rng.sample(HERO_POOL, TEAM_SIZE):
+            cards.append(Card(meta["name"], meta["type"], rng.choice(RARITY_ORDER), level=level,
+                              base_hp=meta["base_hp"], base_atk=meta["base_atk"], base_speed=meta["base_speed"],
+                              stars=rng.randint(1, 5)))
+        friend = rng.choice([NO_FRIEND] + [f["name"] for f in FRIEND_ASSIST_UNITS]) if i % 2 else NO_FRIEND
+        yield cards, friend
+
+
+def compute_calibration(chapter):
+    """跑一批無界面戰鬥，網格搜索最大似然的 (a, k, t)；不讀寫快取"""
+    from offline import simulate_battle
+
+    rng = random.Random(CALIBRATION_SEED * 1000 + chapter)
+    state = random.getstate()  # 戰鬥內部使用全局 random，校準不應改變遊戲的隨機序列
+    random.seed(CALIBRATION_SEED * 1000 + chapter)  # 同時保證結果只取決於種子，可以持久化
+    player = PlayerData(None)
+    samples = []
+    try:
+        for cards, friend in _calibration_teams(rng):
+            player.selected_friend = friend
+            result = simulate_battle(player, cards, chapter)
+            profiles = [card_profile(c) for c in cards] + [friend_profile(friend)]
+            won = result.outcome in ("chapter_clear", "victory")
+            samples.append((sum(p[0] for p in profiles), sum(p[1] for p in profiles), won))
+    finally:
+        random.setstate(state)
+
+    wins = sum(1 for s in samples if s[2])
+    if wins in (0, len(samples)):
+        # 全勝/全敗：無法擬合，門檻放到樣本範圍外，排序仍然按分數
+        scores = [team_score(0.5, h, d) for h, d, _ in samples]
+        return Calibration(0.5, 2.0, min(scores) - 1 if wins else max(scores) + 1, len(samples))
+    best = None
+    for hp_weight in (0.2, 0.35, 0.5, 0.65, 0.8):
+        scores = [(team_score(hp_weight, h, d), won) for h, d, won in samples]
+        lo = min(s for s, _ in scores)
+        hi = max(s for s, _ in scores)
+        for slope in (1.0, 2.0, 4.0, 8.0):
+            for step in range(41):
+                t = lo + (hi - lo) * step / 40
+                ll = 0.0
+                for s, won in scores:
+                    p = min(max(_sigmoid(slope * (s - t)), 1e-6), 1 - 1e-6)
+                    ll += math.log(p if won else 1 - p)
+                if best is None or ll > best[0]:
+                    best = (ll, hp_weight, slope, t)
+    _, hp_weight, slope, t = best
+    return Calibration(hp_weight, slope, t, len(samples))
+
+
+_calibrations = None  # 章節 -> Calibration，首次使用時從快取檔案讀入
+_calibration_pool = None
+
+
+def _calibration_path():
+    key = f"v{CALIBRATION_VERSION}-{CALIBRATION_SEED}-{CALIBRATION_TEAMS}-{catalog_digest()}"
+    digest = hashlib.sha256(key.encode())
+    digest.update(json.dumps([HERO_POOL, FRIEND_ASSIST_UNITS, HERO_SPECIALIZATION], sort_keys=True).encode())
+    return os.path.join(DATA_DIR, CACHE_DIRNAME, f"calibration-{digest.hexdigest()[:16]}.json")
+
+
+def _calibration_table():
+    global _calibrations
+    if _calibrations is None:
+        try:
+            with open(_calibration_path(), encoding="utf-8") as f:
+                _calibrations = {int(chapter): Calibration(*values) for chapter, values in json.load(f).items()}
+        except (OSError, ValueError, TypeError):
+            _calibrations = {}
+    return _calibrations
+
+
+def cached_calibration(chapter):
+    """已有的校準結果，沒有時返回 None"""
+    return _calibration_table().get(chapter)
+
+
+def store_calibration(chapter, cal):
+    """記下校準結果並寫入快取檔案（寫不了時只保留在記憶體裡）"""
+    table = _calibration_table()
+    table[chapter] = cal
+    path = _calibration_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({str(ch): list(c) for ch, c in sorted(table.items())}, f)
+        os.replace(tmp_path, path)
+        # 清理舊版本數據留下的校準結果
+        for name in os.listdir(os.path.dirname(path)):
+            if name.startswith("calibration-") and name.endswith(".json") and name != os.path.basename(path):
+                os.remove(os.path.join(os.path.dirname(path), name))
+    except OSError:
+        pass
+
+
+def calibrate(chapter):
+    """章節的校準結果；沒有快取時在當前線程裡校準（第 4 章約需數秒）"""
+    cal = cached_calibration(chapter)
+    if cal is None:
+        cal = compute_calibration(chapter)
+        store_calibration(chapter, cal)
+    return cal
+
+
+def calibrate_in_background(chapter):
+    """在子進程裡校準，返回 Future；完成後由調用方在自己的線程裡 store_calibration"""
+    global _calibration_pool
+    if _calibration_pool is None:
+        # spawn：不繼承 Tk 和全局 random 的狀態
+        _calibration_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _calibration_pool.submit(compute_calibration, chapter)
+
+
+def candidate_pool(profiles):
+    """剔除被 TEAM_SIZE 張以上卡牌同時在 h、d 上支配的卡；profiles 為 [(h, d, card)]"""
+    ordered = sorted(profiles, key=lambda p: (-p[0], -p[1]))
+    seen_d = []  # 已遍歷（h 不小於當前）的 d，升序
+    pool = []
+    for p in ordered:
+        dominators = len(seen_d) - bisect.bisect_left(seen_d, p[1])
+        if dominators < TEAM_SIZE:
+            pool.append(p)
+        bisect.insort(seen_d, p[1])
+    return pool
+
+
+def best_triple(pool, hp_weight, base_h=0.0, base_d=0.0):
+    """分支定界：在候選中選最多 TEAM_SIZE 張，最大化 team_score；返回 (分數, [卡牌])"""
+    pool = sorted(pool, key=lambda p: team_score(hp_weight, base_h + p[0], base_d + p[1]), reverse=True)
+    n = len(pool)
+    size = min(TEAM_SIZE, n)
+    # 後綴最大值：剩餘候選中單卡的最大 h、d，用於樂觀上界
+    max_h = [0.0] * (n + 1)
+    max_d = [0.0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        max_h[i] = max(max_h[i + 1], pool[i][0])
+        max_d[i] = max(max_d[i + 1], pool[i][1])
+    best = [-math.inf, []]
+
+    def search(start, chosen, h, d):
+        left = size - len(chosen)
+        if left == 0:
+            score = team_score(hp_weight, h, d)
+            if score > best[0]:
+                best[0], best[1] = score, list(chosen)
+            return
+        for i in range(start, n - left + 1):
+            if team_score(hp_weight, h + left * max_h[i], d + left * max_d[i]) <= best[0]:
+                return
+            chosen.append(pool[i][2])
+            search(i + 1, chosen, h + pool[i][0], d + pool[i][1])
+            chosen.pop()
+
+    search(0, [], base_h, base_d)
+    return best[0], best[1]
+
+
+_suggestions = weakref.WeakKeyDictionary()  # 名冊 -> (名冊 version, {(章節, 好友): TeamSuggestion})
+
+
+def suggest_team(roster, chapter, friends=None):
+    """返回最佳 TeamSuggestion；friends 為可選好友名列表（默認全部，含不帶好友）"""
+    friends = friends or [NO_FRIEND] + [f["name"] for f in FRIEND_ASSIST_UNITS]
+    # 以名冊物件本身為鍵（弱引用，名冊回收時條目隨之刪除），名冊變化後整份作廢；沒有 version 的不快取
+    version = getattr(roster, "version", None)
+    cache = None
+    if version is not None:
+        cached_version, cache = _suggestions.get(roster, (None, None))
+        if cached_version != version:
+            cache = {}
+            _suggestions[roster] = (version, cache)
+    key = (chapter, tuple(friends))
+    if cache is not None and key in cache:
+        return cache[key]
+
+    cal = calibrate(chapter)
+    pool = candidate_pool([card_profile(c) + (c,) for c in roster])
+    best = None
+    for friend in friends:
+        fh, fd = friend_profile(friend)
+        score, cards = best_triple(pool, cal.hp_weight, fh, fd)
+        if best is None or score > best.score:
+            best = TeamSuggestion(cards, friend, score, _sigmoid(cal.slope * (score - cal.threshold)))
+    if cache is not None:
+        cache[key] = best
+    return best
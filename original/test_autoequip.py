@@ -0,0 +1,46 @@
+"""autoequip._assign 與窮舉最優解對比（python -m pytest test_autoequip.py）"""
+import itertools
+import random
+
+import pytest
+
+from autoequip import _assign, _dot
+
+
+def brute_force(card_w, item_vecs):
+    """所有部分匹配中的最大總價值"""
+    best = 0.0
+    n, m = len(card_w), len(item_vecs)
+    for k in range(min(n, m) + 1):
+        for cards in itertools.combinations(range(n), k):
+            for items in itertools.permutations(range(m), k):
+                best = max(best, sum(_dot(card_w[i], item_vecs[j]) for i, j in zip(cards, items)))
+    return best
+
+
+def check(card_w, item_vecs):
+    pairs = _assign(card_w, item_vecs)
+    assert len({i for i, _ in pairs}) == len(pairs)
+    assert len({j for _, j in pairs}) == len(pairs)
+    total = sum(_dot(card_w[i], item_vecs[j]) for i, j in pairs)
+    assert total == pytest.approx(brute_force(card_w, item_vecs), abs=1e-6)
+
+
+def test_rounding_cycle_terminates():
+    # 浮點捨入曾在殘量圖上形成負環，回溯路徑時死循環
+    check([(1, 5, 2.4)] * 2 + [(4, 5, 2), (1, 5, 2.4)], [(10, 0, 0.1), (10, 0, 0.1), (0, 5, 0)])
+
+
+def test_empty():
+    assert _assign([], [(1, 0, 0)]) == []
+    assert _assign([(1, 5, 2)], []) == []
+
+
+def test_matches_brute_force():
+    rng = random.Random(39)
+    weights = [(1, 5, 2), (1, 5, 2.4), (4, 5, 2), (1.2, 5, 2), (1, 6, 2)]
+    stats = [(10, 0, 0.1), (0, 5, 0), (20, 2, 0), (0, 0, 0.5), (30, 8, 0.2), (5, 5, 0.3)]
+    for _ in range(400):
+        card_w = [rng.choice(weights) for _ in range(rng.randint(1, 5))]
+        item_vecs = [rng.choice(stats) for _ in range(rng.randint(1, 5))]
+        check(card_w, item_vecs)
@@ -0,0 +1,45 @@
+"""離線掛機結算（python -m pytest test_offline.py）"""
+import random
+
+from offline import MAX_DROP_ROLLS, settle_offline, simulate_battle
+from sanguo_prototype import HERO_POOL, Card, PlayerData
+
+
+def strong_team():
+    return [Card(h["name"], h["type"], "SSR", level=50, base_hp=h["base_hp"], base_atk=h["base_atk"],
+                 base_speed=h["base_speed"], stars=5) for h in HERO_POOL[:3]]
+
+
+def test_auto_battle_clears_chapter():
+    random.seed(1)
+    assert simulate_battle(PlayerData(None), strong_team(), 1).outcome == "chapter_clear"
+
+
+def test_strong_team_earns_offline_rewards():
+    random.seed(3)
+    player = PlayerData(None)
+    team = strong_team()
+    for card in team:
+        player.roster.append(card)
+    gold, gems = player.gold, player.gems
+    report = settle_offline(player, team, 1, 2 * 3600)
+    assert report.wins > 0
+    assert report.gold > 0 and player.gold == gold + report.gold
+    assert report.gems > 0 and player.gems == gems + report.gems
+    assert report.exp
+
+
+def test_too_few_samples_are_not_extrapolated():
+    # 沒有模擬時間：只打第一場（不會被截止時間中斷），樣本不足以外推
+    random.seed(3)
+    report = settle_offline(PlayerData(None), strong_team(), 1, 24 * 3600, time_budget=0, extra_budget=0)
+    assert report.sampled == report.battles == 1
+    assert not report.extrapolated
+
+
+def test_equipment_drops_are_capped():
+    random.seed(3)
+    player = PlayerData(None)
+    report = settle_offline(player, strong_team(), 1, 24 * 3600)
+    assert report.wins > MAX_DROP_ROLLS
+    assert len(report.equipment) == len(player.equipment_inventory) <= MAX_DROP_ROLLS
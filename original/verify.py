@@ -0,0 +1,406 @@
+"""戰鬥結果校驗：客戶端在本地打完一場後上報 (種子, 輸入記錄, 聲稱的結果)，服務端據此接受或拒絕。
+
+種子由服務端發出（BattleTickets）：開戰前向服務端要一個種子，每個種子只能上報一次，
+用過、過期或不是發給該玩家的種子一律拒絕，同一份合法聲明不能重複領獎。
+上一個種子上報或過期之前不發新種子，客戶端不能多要幾個種子、只上報能贏的那場。
+
+重放：用同一種子和輸入記錄無界面地重跑 BattleSimulation，逐項比對結果（outcome、幀數、存活武將、
+波間交易花費的金幣）。結果要逐幀確定，客戶端必須以固定步長 SIM_DT 推進，自動戰鬥不限時規劃
+（auto_budget_us=None）。輸入記錄每項為 [幀序號, 操作, 參數...]，在第 幀序號+1 次 step 之前生效：
+    ["move", 單位下標, x, y]         單個武將移動到世界座標 (x, y)（GameWindow 左鍵拖放）
+    ["formation", x, y]              全隊以 (x, y) 為中心排陣移動（Shift+拖放）
+    ["target", 單位下標, 敵人下標]    指定攻擊目標（右鍵），敵人下標對應 all_enemies
+    ["event", 選項下標]               選擇波間事件，只在等待選擇時有效
+    ["auto", true/false]             開關自動戰鬥
+單位下標對應 player_units（三名武將，之後是好友助戰）。戰鬥商店的商品列表由界面隨機抽取，
+不在可重放的操作裡，用過商店的戰鬥無法通過重放。
+
+預篩：重放一場要幾十到幾百毫秒，請求量大時只能抽樣重放。plausibility 只用 Card.stats() 和章節配置
+算出的傷害界做 O(隊伍大小) 的檢查：
+    勝利   敵方城堡只受攻城傷害（siege_atk，不受波間 Buff 影響），隊伍每幀攻城傷害有上限；
+           通關還要依次打掉全部波次敵人（「增援」事件每波最多少一個），每幀對單位的傷害同樣有上限
+           （每幀一次普攻或技能；按最高相克、暴擊、技能倍率、每次波間最多一個攻擊 Buff 計）。
+           聲稱的幀數打不出這麼多傷害即拒絕。
+    失守   敵人只能靠攻城傷害打我方城堡，同一時間只有一波敵人，幀數不夠打掉城堡血量即拒絕。
+通過預篩的聲明按 ClaimSampler.sample_rate 抽樣重放；幀數接近下界的聲明和曾被拒絕過的玩家總是重放。
+"""
+import copy
+import functools
+import math
+import os
+import random
+import time
+from collections import namedtuple
+
+from combat import CRIT_MULTIPLIER
+from offline import MAX_BATTLE_SECONDS, SIM_DT
+from sanguo_prototype import (BOSS_CONFIGS, CATALOG, ENEMY_FORMATIONS, FRIEND_ASSIST_UNITS, HERO_SPECIALIZATION,
+                              RANGED_TYPES, UNIT_SKILLS, BattleSimulation, Card, Castle, PlayerData, chapter_config,
+                              formation_slots, friend_unit_stats)
+
+CLAIM_OUTCOMES = ("chapter_clear", "victory", "defeat")
+MAX_FRAMES = int(MAX_BATTLE_SECONDS / SIM_DT)
+MAX_INPUTS = 4096
+PLAYER_BONUS = 1.05  # BattleSimulation 給玩家武將的加成
+SIEGE_RATIO = 0.7
+MAX_TYPE_MULT = 1.2  # get_multiplier 的最大值
+ATK_BUFF_PER_WAVE = 1.3  # 「攻速+30%」：每次波間最多生效一個（血契的兩個 Buff 互不重複）
+BOUND_SLACK = 1.05  # 浮點和取整誤差的餘量
+REPLAY_MARGIN = 2.0  # 幀數低於下界的這個倍數時總是重放
+TICKET_TTL = 900.0  # 發出的種子在這麼多秒內有效，也是放棄一場戰鬥後重新領種子前的冷卻時間
+MAX_OPEN_TICKETS = 1  # 每名玩家同時未上報的種子數上限；達到上限時不再發新種子
+
+Claim = namedtuple("Claim", "chapter seed outcome frames survivors gold_spent auto_battle inputs")
+ReplayResult = namedtuple("ReplayResult", "outcome frames survivors gold_spent")
+ChapterBounds = namedtuple("ChapterBounds", "wave_hp castle_hp enemy_siege")
+
+
+class InvalidClaim(ValueError):
+    """聲明格式錯誤或輸入記錄無法在戰鬥中執行"""
+
+
+def _number(value, what):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise InvalidClaim(f"{what} 應為數字")
+    return value
+
+
+def _index(value, what):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidClaim(f"{what} 應為整數")
+    return value
+
+
+def parse_claim(data):
+    """JSON 物件 -> Claim；只檢查格式，不看戰鬥內容"""
+    if not isinstance(data, dict):
+        raise InvalidClaim("聲明應為 JSON 物件")
+    chapter = _index(data.get("chapter"), "chapter")
+    if chapter not in CATALOG["chapter_index"]:
+        raise InvalidClaim(f"沒有第 {chapter} 章")
+    seed = _index(data.get("seed"), "seed")
+    outcome = data.get("outcome")
+    if outcome not in CLAIM_OUTCOMES:
+        raise InvalidClaim(f"outcome 應為 {'/'.join(CLAIM_OUTCOMES)}")
+    frames = _index(data.get("frames"), "frames")
+    if not 0 < frames <= MAX_FRAMES:
+        raise InvalidClaim(f"frames 應在 1..{MAX_FRAMES} 之間")
+    survivors = data.get("survivors")
+    if not isinstance(survivors, list) or not all(isinstance(s, bool) for s in survivors):
+        raise InvalidClaim("survivors 應為布林值列表")
+    gold_spent = _index(data.get("gold_spent", 0), "gold_spent")
+    if gold_spent < 0:
+        raise InvalidClaim("gold_spent 不能為負")
+    auto_battle = data.get("auto_battle", False)
+    if not isinstance(auto_battle, bool):
+        raise InvalidClaim("auto_battle 應為布林值")
+    inputs = data.get("inputs", [])
+    if not isinstance(inputs, list) or len(inputs) > MAX_INPUTS:
+        raise InvalidClaim(f"inputs 應為最多 {MAX_INPUTS} 項的列表")
+    parsed = []
+    last = 0
+    for entry in inputs:
+        if not isinstance(entry, list) or len(entry) < 2:
+            raise InvalidClaim("輸入應為 [幀序號, 操作, 參數...]")
+        frame = _index(entry[0], "輸入的幀序號")
+        if not last <= frame < frames:
+            raise InvalidClaim("輸入的幀序號應遞增且小於 frames")
+        last = frame
+        parsed.append(_parse_input(frame, entry[1], entry[2:]))
+    return Claim(chapter, seed, outcome, frames, tuple(survivors), gold_spent, auto_battle, tuple(parsed))
+
+
+INPUT_ARGS = {"move": ("unit", "x", "y"), "formation": ("x", "y"), "target": ("unit", "enemy"),
+              "event": ("choice",), "auto": ("on",)}
+
+
+def _parse_input(frame, action, args):
+    names = INPUT_ARGS.get(action)
+    if names is None:
+        raise InvalidClaim(f"未知操作 {action!r}")
+    if len(args) != len(names):
+        raise InvalidClaim(f"{action} 需要 {len(names)} 個參數")
+    for name, value in zip(names, args):
+        if name in ("x", "y"):
+            _number(value, f"{action} 的 {name}")
+        elif name == "on":
+            if not isinstance(value, bool):
+                raise InvalidClaim("auto 的參數應為布林值")
+        else:
+            _index(value, f"{action} 的 {name}")
+    return (frame, action, *args)
+
+
+# --- 預篩 ---
+
+@functools.lru_cache(maxsize=None)
+def chapter_bounds(chapter):
+    """章節的 ChapterBounds：各波次必須打掉的敵人血量、敵方城堡總血量、敵人每幀攻城傷害上限"""
+    cfg = chapter_config(CATALOG, chapter)
+    slots = ENEMY_FORMATIONS[cfg["formation"]]
+    wave_hp = []
+    enemy_siege = 0
+    for wave in range(1, cfg["waves"] + 1):
+        base_hp = cfg["base_hp"] + (wave - 1) * cfg["hp_per_wave"]
+        base_atk = cfg["base_atk"] + (wave - 1) * cfg["atk_per_wave"]
+        hps = [int(base_hp * s["hp_mult"]) for s in slots]
+        if wave > 1 and hps:
+            hps.pop()  # 「增援」事件移除最後生成的一個敵人
+        wave_hp.append(sum(hps))
+        # 敵人攻城傷害等於攻擊力（事件只會降低它），下一波在上一波全滅後才生成
+        enemy_siege = max(enemy_siege, sum(int(base_atk * s["atk_mult"]) for s in slots))
+    boss = BOSS_CONFIGS[cfg["boss"]] if cfg.get("has_boss") else None
+    castles = [Castle(0, 0, 1, is_boss=boss is not None, boss_config=boss)]
+    castles += [Castle(0, 0, 1, is_boss=True, boss_config=BOSS_CONFIGS[s["id"]]) for s in cfg.get("extra_bosses", ())]
+    return ChapterBounds(tuple(wave_hp), sum(c.hp for c in castles), enemy_siege)
+
+
+def unit_strike_bound(name, unit_type, atk):
+    """一個單位每幀對敵方單位最多造成的傷害（不計波間 Buff）：普攻（相克+暴擊）或技能取大者"""
+    spec = HERO_SPECIALIZATION.get(name, {})
+    if spec.get("bonus") == "damage_boost":
+        atk = int(atk * spec["value"])
+    strike = CRIT_MULTIPLIER
+    skill = UNIT_SKILLS.get(unit_type)
+    if skill:
+        skill_mult = skill.get("damage_mult", 1.5)
+        if spec.get("bonus") == "skill_damage":
+            skill_mult *= spec["value"]
+        if skill.get("effect") == "volley":
+            skill_mult *= skill.get("arrow_count", 3) * 0.8
+        strike = max(strike, skill_mult)
+    return atk * MAX_TYPE_MULT * strike
+
+
+def team_damage_bound(team_cards, selected_friend):
+    """玩家一方每幀最多造成的 (對敵方單位的傷害, 攻城傷害)，三名武將加好友助戰
+
+    攻城傷害取 siege_atk，波間 Buff 只改 atk，所以攻城上限與 Buff 無關。
+    """
+    strike = siege = 0.0
+    for card in team_cards[:3]:
+        atk = int(card.stats()[1] * PLAYER_BONUS)
+        strike += unit_strike_bound(card.name, card.unit_type, atk)
+        siege += int(atk * SIEGE_RATIO)
+    friend = next((f for f in FRIEND_ASSIST_UNITS if f["name"] == selected_friend), None)
+    if friend is not None:
+        atk = friend_unit_stats(friend)[1]
+        strike += unit_strike_bound(friend["name"], friend["type"], atk)
+        siege += atk
+    return strike * BOUND_SLACK, siege * BOUND_SLACK
+
+
+def _frames_needed(damage, per_frame):
+    return math.ceil(damage / per_frame) if per_frame > 0 else MAX_FRAMES + 1
+
+
+def plausibility(team_cards, selected_friend, claim):
+    """返回 (拒絕原因或 None, 該結果需要的最少幀數)
+
+    攻破城堡至少要 城堡血量 / 每幀攻城上限 幀；通關還要逐波打掉敵人，波次依次生成，
+    第 w 波最多吃到 w-1 個攻擊 Buff，所需幀數逐波相加，兩個下界取大者。
+    """
+    if len(claim.survivors) != len(team_cards[:3]):
+        return "survivors 與隊伍人數不符", 0
+    bounds = chapter_bounds(claim.chapter)
+    if claim.outcome == "defeat":
+        min_frames = _frames_needed(Castle(0, 0, 0).max_hp, bounds.enemy_siege * BOUND_SLACK)
+    else:
+        strike, siege = team_damage_bound(team_cards, selected_friend)
+        min_frames = _frames_needed(bounds.castle_hp, siege)
+        if claim.outcome == "chapter_clear":
+            waves = sum(_frames_needed(hp, strike * ATK_BUFF_PER_WAVE ** w) for w, hp in enumerate(bounds.wave_hp))
+            min_frames = max(min_frames, waves)
+    if claim.frames < min_frames:
+        return f"{claim.frames} 幀內不可能達成 {claim.outcome}（至少需要 {min_frames} 幀）", min_frames
+    return None, min_frames
+
+
+class ClaimSampler:
+    """決定哪些通過預篩的聲明需要完整重放"""
+
+    def __init__(self, sample_rate=0.1, margin=REPLAY_MARGIN, rng=None):
+        self.sample_rate = sample_rate
+        self.margin = margin
+        self.rng = rng or random.Random()
+        self.flagged = set()  # 有過被拒絕聲明的玩家
+
+    def should_replay(self, pid, claim, min_frames):
+        return (pid in self.flagged or claim.frames < min_frames * self.margin
+                or self.rng.random() < self.sample_rate)
+
+    def flag(self, pid):
+        self.flagged.add(pid)
+
+    def state(self):
+        return sorted(self.flagged)
+
+    def restore(self, flagged):
+        self.flagged = set(flagged)
+
+
+class BattleTickets:
+    """服務端發出的一次性戰鬥種子：聲明的種子必須發給了該玩家、同一章節、未用過且未過期
+
+    種子在開戰前就交給了客戶端，客戶端可以在本地先把這場打完再決定是否上報。
+    所以未上報的種子不能被新種子頂替：上限內的種子上報（無論勝負）或過期之前不發新種子，
+    過期未上報的種子記作放棄（forfeited）。挑種子因此最多每 ttl 秒換一次，比老實打還慢。
+    """
+
+    def __init__(self, ttl=TICKET_TTL, max_open=MAX_OPEN_TICKETS, rng=None):
+        self.ttl = ttl
+        self.max_open = max_open
+        self.rng = rng or random.SystemRandom()
+        self.open = {}  # 玩家 id -> {種子: (章節, 發出時間)}，按發出順序
+        self.version = 0  # 每次發出或作廢加一，存檔時比較
+        self.forfeited = 0  # 過期未上報的種子數
+
+    def _expire(self, pid, now):
+        tickets = self.open.get(pid, {})
+        expired = [seed for seed, (_, issued_at) in tickets.items() if now - issued_at > self.ttl]
+        for seed in expired:
+            del tickets[seed]
+        if expired:
+            self.forfeited += len(expired)
+            self.version += 1
+            if not tickets:
+                del self.open[pid]
+
+    def retry_after(self, pid, now=None):
+        """pid 還要等多少秒才能領新種子（0 表示現在就可以）"""
+        now = time.time() if now is None else now
+        self._expire(pid, now)
+        tickets = self.open.get(pid, {})
+        if len(tickets) < self.max_open:
+            return 0.0
+        return min(issued_at for _, issued_at in tickets.values()) + self.ttl - now
+
+    def issue(self, pid, chapter, now=None):
+        """給 pid 發一個第 chapter 章的種子；未上報的種子已達上限時返回 None"""
+        now = time.time() if now is None else now
+        if self.retry_after(pid, now) > 0:
+            return None
+        tickets = self.open.setdefault(pid, {})
+        seed = self.rng.getrandbits(32)
+        while seed in tickets:
+            seed = self.rng.getrandbits(32)
+        tickets[seed] = (chapter, now)
+        self.version += 1
+        return seed
+
+    def consume(self, pid, seed, chapter, now=None):
+        """作廢 pid 的這個種子（無論聲明最終是否通過）；返回拒絕原因或 None"""
+        now = time.time() if now is None else now
+        tickets = self.open.get(pid, {})
+        ticket = tickets.pop(seed, None)
+        if ticket is None:
+            return "種子不是服務端發出的，或已經上報過"
+        if not tickets:
+            del self.open[pid]
+        self.version += 1
+        issued_chapter, issued_at = ticket
+        if issued_chapter != chapter:
+            return f"種子是第 {issued_chapter} 章的"
+        if now - issued_at > self.ttl:
+            return "種子已過期"
+        return None
+
+    def state(self, now=None):
+        """可寫成 JSON 的未用種子 {玩家 id: [[種子, 章節, 發出時間], ...]}（略去已過期的）"""
+        now = time.time() if now is None else now
+        return {pid: [[seed, chapter, issued_at] for seed, (chapter, issued_at) in tickets.items()
+                      if now - issued_at <= self.ttl]
+                for pid, tickets in self.open.items()}
+
+    def restore(self, state):
+        self.open = {pid: {seed: (chapter, issued_at) for seed, chapter, issued_at in entries}
+                     for pid, entries in state.items() if entries}
+
+
+# --- 重放 ---
+
+def apply_input(sim, action, args):
+    """把一項輸入作用到戰鬥上，規則與 GameWindow 的對應操作一致"""
+    if action == "auto":
+        sim.auto_battle = args[0]
+        if not sim.auto_battle:
+            sim.auto_planner.reset(sim.player_units)
+    elif action == "event":
+        if not sim.waiting_for_event or not 0 <= args[0] < len(sim.event_choices):
+            raise InvalidClaim("現在不能選擇波間事件")
+        sim.select_event(args[0])
+    elif action == "formation":
+        if not any(u.hp > 0 for u in sim.player_units):
+            raise InvalidClaim("沒有可移動的單位")
+        for u, slot in formation_slots(sim.player_units, args, RANGED_TYPES, sim.bounds):
+            u.target_pos = slot
+    else:
+        i = args[0]
+        if not 0 <= i < len(sim.player_units) or sim.player_units[i].hp <= 0:
+            raise InvalidClaim(f"單位 {i} 不存在或已陣亡")
+        unit = sim.player_units[i]
+        if action == "move":
+            unit.target_pos = [args[1], args[2]]
+        else:
+            j = args[1]
+            if not 0 <= j < len(sim.all_enemies) or sim.all_enemies[j].hp <= 0:
+                raise InvalidClaim(f"敵人 {j} 不存在或已陣亡")
+            unit.target_enemy = sim.all_enemies[j]
+            unit.target_pos = None
+
+
+def run_inputs(player, team_cards, chapter, seed, inputs=(), auto_battle=False, max_frames=MAX_FRAMES):
+    """固定步長跑一場帶輸入記錄的戰鬥，不修改玩家數據，返回 ReplayResult
+
+    outcome 為 battle_outcome() 的結果，或 "stalled"/"wiped"/"timeout"（同 offline.simulate_battle）。
+    """
+    random.seed(seed)
+    sim_player = copy.copy(player)
+    sim = BattleSimulation(sim_player, team_cards, chapter=chapter, auto_battle=auto_battle, headless=True,
+                           auto_budget_us=None)
+    pending = iter(inputs)
+    nxt = next(pending, None)
+    outcome = "timeout"
+    frame = 0
+    while frame < max_frames:
+        while nxt is not None and nxt[0] == frame:
+            apply_input(sim, nxt[1], nxt[2:])
+            nxt = next(pending, None)
+        frame += 1
+        if not sim.step(SIM_DT):
+            outcome = "stalled"
+            break
+        result = sim.battle_outcome()
+        if result is not None:
+            outcome = result
+            break
+        if not any(u.hp > 0 for u in sim.player_units):
+            outcome = "wiped"
+            break
+    survivors = tuple(i < len(sim.player_units) and sim.player_units[i].hp > 0
+                      for i in range(len(team_cards[:3])))
+    return ReplayResult(outcome, frame, survivors, player.gold - sim_player.gold)
+
+
+def replay_claim(cards, selected_friend, gold, claim):
+    """進程池中執行：按卡牌數據重建隊伍並重放聲明，返回 (拒絕原因或 None, ReplayResult 或 None)"""
+    player = PlayerData(os.devnull)
+    player.gold = gold
+    player.selected_friend = selected_friend
+    team = [Card.from_dict(d) for d in cards]
+    try:
+        result = run_inputs(player, team, claim.chapter, claim.seed, claim.inputs, claim.auto_battle, claim.frames)
+    except InvalidClaim as e:
+        return f"輸入記錄無法重放: {e}", None
+    for field in ReplayResult._fields:
+        if getattr(result, field) != getattr(claim, field):
+            return f"重放結果不符: {field} 聲稱 {getattr(claim, field)!r}，重放為 {getattr(result, field)!r}", result
+    return None, result
+
+
+def record_claim(player, team_cards, chapter, seed, inputs=(), auto_battle=True, max_frames=MAX_FRAMES):
+    """按與重放相同的規則打一場，返回可以直接提交的聲明（JSON 物件）"""
+    result = run_inputs(player, team_cards, chapter, seed, inputs, auto_battle, max_frames)
+    return {"chapter": chapter, "seed": seed, "outcome": result.outcome, "frames": result.frames,
+            "survivors": list(result.survivors), "gold_spent": result.gold_spent, "auto_battle": auto_battle,
+            "inputs": [list(entry) for entry in inputs]}